@@ -62,6 +62,8 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'core.middleware.ReplicaRoutingMiddleware',  # Read replica routing, see core/routers.py # noqa
+    'core.middleware.ShardRoutingMiddleware',  # Sharding by user, see core/routers.py # noqa
 ]
 
 ROOT_URLCONF = 'app.urls'
@@ -91,11 +93,17 @@ WSGI_APPLICATION = 'app.wsgi.application'
 # Manually updated for PostgreSQL Integration. Env variables created in Docker-compose file
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql',
+        'ENGINE': 'core.backends.postgresql',  # django.db.backends.postgresql with lazy health checks # noqa
         'HOST': os.environ.get('DB_HOST'),
         'NAME': os.environ.get('DB_NAME'),
         'USER': os.environ.get('DB_USER'),
         'PASSWORD': os.environ.get('DB_PASS'),
+        'PORT': os.environ.get('DB_PORT', ''),
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 60)),  # Seconds each worker thread keeps its connection, 0 reconnects on every request # noqa
+        'CONN_HEALTH_CHECKS': bool(int(os.environ.get('DB_CONN_HEALTH_CHECKS', 1))),  # Checked before the first query of each request, see core/backends/postgresql # noqa
+        # Set DB_POOLER=1 when DB_HOST is a PgBouncer in transaction mode. Consecutive transactions may then run on different # noqa
+        # server connections, so cursors must not outlive a transaction. Use core.db.iterate_values rather than .iterator() # noqa
+        'DISABLE_SERVER_SIDE_CURSORS': bool(int(os.environ.get('DB_POOLER', 0))),
     }
 }
 
@@ -118,6 +126,26 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# Password hashers, the first one hashes new passwords. Hashes made by the others are rehashed on the next login # noqa
+# Set PASSWORD_HASHERS to a comma separated list to switch, e.g. core.hashers.ScryptPasswordHasher first, or Argon2 with argon2-cffi installed # noqa
+PASSWORD_HASHERS = os.environ.get('PASSWORD_HASHERS', ','.join([
+    'core.hashers.PBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'core.hashers.ScryptPasswordHasher',
+])).split(',')
+PBKDF2_ITERATIONS = int(os.environ.get('PBKDF2_ITERATIONS', 0))  # 0 keeps Django's default
+SCRYPT_WORK_FACTOR = int(os.environ.get('SCRYPT_WORK_FACTOR', 2 ** 14))
+SCRYPT_BLOCK_SIZE = int(os.environ.get('SCRYPT_BLOCK_SIZE', 8))
+SCRYPT_PARALLELISM = int(os.environ.get('SCRYPT_PARALLELISM', 1))
+
+# Login password verification (see core/passwords.py)
+AUTHENTICATION_BACKENDS = ['core.passwords.HashingPoolBackend']
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 1))  # Hashing threads per uWSGI worker, 0 hashes on the request thread # noqa
+PASSWORD_HASH_MAX_QUEUE = int(os.environ.get('PASSWORD_HASH_MAX_QUEUE', 8))  # Logins waiting or hashing per uWSGI worker before answering 503 # noqa
+PASSWORD_HASH_TIMEOUT = float(os.environ.get('PASSWORD_HASH_TIMEOUT', 5))  # Seconds a login waits for the pool # noqa
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/3.2/topics/i18n/
@@ -156,9 +184,124 @@ AUTH_USER_MODEL = 'core.User'
 # Manually added to include rest_framework settings. Django will use this to render the API schema in Swagger UI
 REST_FRAMEWORK = {
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
+    # Views opt in with throttle_scope, see core/throttling.py
+    'DEFAULT_THROTTLE_CLASSES': ['core.throttling.ScopedBucketThrottle'],
+    'DEFAULT_THROTTLE_RATES': {
+        'login': os.environ.get('THROTTLE_RATE_LOGIN', '10/min'),
+        'signup': os.environ.get('THROTTLE_RATE_SIGNUP', '20/hour'),
+        'user': os.environ.get('THROTTLE_RATE_USER', '120/min'),
+        'recipes': os.environ.get('THROTTLE_RATE_RECIPES', '600/min'),
+        'recipe-writes': os.environ.get('THROTTLE_RATE_RECIPE_WRITES', '120/min'), # noqa
+    },
 }
 
 # Upload images through browser interface
 SPECTACULAR_SETTINGS = {
     'COMPONENT_SPLIT_REQUEST': True,
-}
\ No newline at end of file
+}
+
+# Cache used for per-user results such as recipe statistics.
+# The default in-process cache is not shared between uWSGI workers, so invalidating the recipe stats or demographics only reaches one of them. # noqa
+# Point CACHE_BACKEND / CACHE_LOCATION at a shared backend in production, as docker-compose-deploy.yml does # noqa
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', ''),
+        'OPTIONS': {'MAX_ENTRIES': int(os.environ.get('CACHE_MAX_ENTRIES', 300))},
+    }
+}
+
+# Recipe statistics endpoint
+RECIPE_STATS_CACHE_TIMEOUT = int(os.environ.get('RECIPE_STATS_CACHE_TIMEOUT', 300))  # Seconds
+RECIPE_STATS_HISTOGRAM_BINS = 10
+RECIPE_STATS_TOP_LIMIT = 5
+
+# Render recipe tags and ingredients from the denormalized Recipe.attrs_snapshot column instead of joining the many-to-many tables # noqa
+RECIPE_ATTRS_SNAPSHOT = bool(int(os.environ.get('RECIPE_ATTRS_SNAPSHOT', 1)))
+
+# Largest estimated number of recipes materialized as a literal ID list when filtering by tags and ingredients # noqa
+RECIPE_FILTER_MATERIALIZE_LIMIT = int(os.environ.get('RECIPE_FILTER_MATERIALIZE_LIMIT', 1000))
+
+# Resized recipe image variants
+IMAGE_VARIANT_WIDTHS = [160, 320, 640, 1280]  # Only these widths are rendered, which bounds the number of variants per image # noqa
+IMAGE_VARIANT_WORKERS = int(os.environ.get('IMAGE_VARIANT_WORKERS', 2))  # Processes per uWSGI worker, 0 renders on the request thread # noqa
+IMAGE_VARIANT_CACHE_MAX_BYTES = int(os.environ.get('IMAGE_VARIANT_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+
+# Unreferenced recipe image blobs younger than this are kept, as a concurrent upload of the same bytes may still reference them # noqa
+RECIPE_IMAGE_GRACE_SECONDS = int(os.environ.get('RECIPE_IMAGE_GRACE_SECONDS', 3600))
+
+# Recipe image uploads are streamed to a temporary file and rejected once they exceed the byte limit (matches client_max_body_size in nginx) # noqa
+RECIPE_IMAGE_MAX_UPLOAD_BYTES = int(os.environ.get('RECIPE_IMAGE_MAX_UPLOAD_BYTES', 10 * 1024 * 1024))
+RECIPE_IMAGE_MAX_PIXELS = int(os.environ.get('RECIPE_IMAGE_MAX_PIXELS', 40_000_000))  # Checked from the image header, before any decoding # noqa
+RECIPE_IMAGE_FORMATS = ['JPEG', 'PNG', 'WEBP']
+
+# Re-encoding of uploaded recipe images (orientation applied, metadata stripped, dimensions capped), run after the upload is committed # noqa
+RECIPE_IMAGE_PROCESSING = bool(int(os.environ.get('RECIPE_IMAGE_PROCESSING', 1)))
+RECIPE_IMAGE_PROCESSING_WORKERS = int(os.environ.get('RECIPE_IMAGE_PROCESSING_WORKERS', 1))  # Threads per uWSGI worker, 0 processes on the request thread # noqa
+RECIPE_IMAGE_MAX_DIMENSION = int(os.environ.get('RECIPE_IMAGE_MAX_DIMENSION', 2048))
+RECIPE_IMAGE_FORMAT = os.environ.get('RECIPE_IMAGE_FORMAT', 'jpeg')  # Progressive 'jpeg' or 'webp', falls back to jpeg when Pillow lacks WebP support # noqa
+RECIPE_IMAGE_QUALITY = int(os.environ.get('RECIPE_IMAGE_QUALITY', 82))
+
+# Batch upload of recipe images
+RECIPE_IMAGE_BATCH_MAX_FILES = int(os.environ.get('RECIPE_IMAGE_BATCH_MAX_FILES', 20))
+RECIPE_IMAGE_BATCH_WORKERS = int(os.environ.get('RECIPE_IMAGE_BATCH_WORKERS', 4))  # Threads per uWSGI worker validating and storing the files, 0 runs them on the request thread # noqa
+
+# Recipe images are private. Their URLs point at the authenticated media view, which hands the transfer to nginx with X-Accel-Redirect # noqa
+RECIPE_IMAGE_URL = '/api/recipe/media/'
+MEDIA_X_ACCEL_REDIRECT = bool(int(os.environ.get('MEDIA_X_ACCEL_REDIRECT', 0)))  # Enable behind the nginx proxy, see proxy/default.conf.tpl # noqa
+MEDIA_X_ACCEL_PREFIX = '/protected-media/'  # Internal nginx location aliasing MEDIA_ROOT
+
+# Token authentication cache (see core/authentication.py)
+TOKEN_AUTH_CACHE_SIZE = int(os.environ.get('TOKEN_AUTH_CACHE_SIZE', 10000))  # Tokens kept per uWSGI worker
+TOKEN_AUTH_CACHE_TTL = int(os.environ.get('TOKEN_AUTH_CACHE_TTL', 30))  # Seconds, also bounds how long other workers let a revoked token read, writes check the database # noqa
+TOKEN_AUTH_SHARED_CACHE = os.environ.get('TOKEN_AUTH_SHARED_CACHE') or None  # Alias in CACHES shared by all workers, e.g. 'default' with a memcached/redis backend # noqa
+
+# Sliding expiry of auth tokens. Expired tokens are rotated on login and deleted by the purge_expired_tokens command # noqa
+TOKEN_EXPIRY = int(os.environ.get('TOKEN_EXPIRY', 30 * 24 * 3600))  # Seconds since the last use, 0 never expires # noqa
+TOKEN_USAGE_INTERVAL = int(os.environ.get('TOKEN_USAGE_INTERVAL', 300))  # Seconds between writes of a token's last use, so reads stay reads # noqa
+
+# Opt-in signed access tokens (see core/authentication.py), issued at /api/user/token/signed/ and refreshed with the database token # noqa
+SIGNED_TOKEN_AUTH = bool(int(os.environ.get('SIGNED_TOKEN_AUTH', 0)))
+SIGNED_TOKEN_TTL = int(os.environ.get('SIGNED_TOKEN_TTL', 300))  # Seconds. Revoked users keep read access until their token expires # noqa
+# Previous secret keys, still accepted for signed tokens after rotating SECRET_KEY. Same name and meaning as Django 4.1's setting # noqa
+SECRET_KEY_FALLBACKS = [key for key in os.environ.get('SECRET_KEY_FALLBACKS', '').split(',') if key]
+
+# Rate limiting shared by the uWSGI workers of a host (see core/throttling.py) # noqa
+THROTTLE_ENABLED = bool(int(os.environ.get('THROTTLE_ENABLED', 0)))  # Enabled in docker-compose-deploy.yml
+THROTTLE_FILE = os.environ.get('THROTTLE_FILE', '/dev/shm/recipe-api-throttle')  # Memory mapped bucket table, on tmpfs so it never touches the disk # noqa
+THROTTLE_SLOTS = int(os.environ.get('THROTTLE_SLOTS', 65536))  # Buckets kept, 24 bytes each. The least recently used are evicted # noqa
+
+# Admin demographics over UserDetails (see user/demographics.py)
+DEMOGRAPHICS_CACHE_TIMEOUT = int(os.environ.get('DEMOGRAPHICS_CACHE_TIMEOUT', 300))  # Seconds
+DEMOGRAPHICS_AGE_BUCKETS = [18, 25, 35, 45, 55, 65]  # Lower bounds of the age buckets after '<18'
+
+# Background account deletion (see core/accounts.py)
+ACCOUNT_DELETION_BATCH_SIZE = int(os.environ.get('ACCOUNT_DELETION_BATCH_SIZE', 500))  # Rows deleted per transaction
+ACCOUNT_DELETION_WORKERS = int(os.environ.get('ACCOUNT_DELETION_WORKERS', 1))  # Threads per uWSGI worker, 0 deletes on the request thread # noqa
+
+# Read replicas (see core/routers.py). Reads of views listing them in replica_actions go to a random replica # noqa
+# Each DB_REPLICA_HOSTS entry is a host serving the default database name, or host/name. Tests use them as mirrors of default # noqa
+DATABASE_REPLICAS = []
+for index, entry in enumerate(filter(None, os.environ.get('DB_REPLICA_HOSTS', '').split(','))):
+    host, _, name = entry.partition('/')
+    DATABASE_REPLICAS.append(f'replica{index}')
+    DATABASES[f'replica{index}'] = dict(DATABASES['default'], HOST=host, NAME=name or DATABASES['default']['NAME'], TEST={'MIRROR': 'default'}) # noqa
+DB_REPLICA_STICKY_SECONDS = int(os.environ.get('DB_REPLICA_STICKY_SECONDS', 5))  # Users read from the primary this long after a write, covering the replication lag # noqa
+# Where users who wrote recently are recorded. Must be shared by every worker: by default a file cache on the host's tmpfs, # noqa
+# set DB_REPLICA_PIN_CACHE to an alias shared by all hosts, e.g. memcached or redis, when running several app hosts # noqa
+DB_REPLICA_PIN_CACHE = os.environ.get('DB_REPLICA_PIN_CACHE', 'replica-pins')
+CACHES['replica-pins'] = {
+    'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+    'LOCATION': '/dev/shm/recipe-api-replica-pins',
+    'OPTIONS': {'MAX_ENTRIES': 100000},
+}
+
+# Sharding by user (see core/routers.py). The recipes, tags, ingredients and details of a user live on the shard its id hashes to, # noqa
+# the users and tokens on the default database. Each DB_SHARDS entry is a database name on the default host, or host/name. # noqa
+# Only append entries, as shards are named by position. Run the rebalance_shards command after changing them # noqa
+DATABASE_SHARDS = []
+for entry in filter(None, os.environ.get('DB_SHARDS', '').split(',')):
+    host, _, name = entry.rpartition('/')
+    DATABASE_SHARDS.append(f'shard{len(DATABASE_SHARDS)}')
+    DATABASES[DATABASE_SHARDS[-1]] = dict(DATABASES['default'], HOST=host or DATABASES['default']['HOST'], NAME=name) # noqa
+DATABASE_ROUTERS = ['core.routers.ShardRouter', 'core.routers.ReplicaRouter']
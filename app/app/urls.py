@@ -27,6 +27,11 @@ from core import views as core_views
 urlpatterns = [
     path("admin/", admin.site.urls),
     path("api/health/", core_views.health_check, name="health_check"),
+    path(
+        "api/health/auth-cache/",
+        core_views.auth_cache_stats,
+        name="auth_cache_stats",
+    ),
     path("api/schema/", SpectacularAPIView.as_view(), name="api-schema"),
     path(
         "api/docs/",
@@ -0,0 +1,120 @@
+"""
+Two phase account deletion.
+The account is deactivated at once. Its data is then removed in the background, in batches of set based deletes, # noqa
+each in a short transaction, instead of a cascade which collects every related row in memory while holding locks. # noqa
+Accounts still marked as deleting, e.g. after a restart, are finished by the delete_accounts command, run periodically in deployment. # noqa
+"""
+
+import logging
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from rest_framework.authtoken.models import Token
+
+from core.executors import InlineExecutor, get_executor
+from core.models import (
+    Ingredient,
+    Recipe,
+    Tag,
+    User,
+    UserDetails,
+    release_recipe_image,
+)
+from core.routers import shard_for_user, use_shard_of
+
+
+logger = logging.getLogger(__name__)
+
+
+def _raw_delete(queryset):
+    """Delete the rows with a single DELETE statement, without collecting them or sending signals. Returns the count""" # noqa
+    return queryset._raw_delete(queryset.db)
+
+
+def _delete_in_batches(model, through_columns, user_id, batch_size, fields=('id',)): # noqa
+    """Delete the rows of model owned by the user batch by batch, with their through table rows first. # noqa
+    Yields the values of fields of each deleted batch once committed"""
+    while True:
+        with transaction.atomic(using=shard_for_user(user_id)):
+            rows = list(model.objects.filter(user_id=user_id).order_by().values_list(*fields)[:batch_size]) # noqa
+            if not rows:
+                return
+            ids = [row[0] for row in rows]
+
+            for through, column in through_columns:
+                _raw_delete(through.objects.filter(**{f'{column}__in': ids}))
+            _raw_delete(model.objects.filter(id__in=ids))
+
+        yield rows
+
+
+def delete_owned_rows(user_id, batch_size=None):
+    """Delete the recipes, tags, ingredients and details of a user from its shard, releasing their images""" # noqa
+    batch_size = batch_size or settings.ACCOUNT_DELETION_BATCH_SIZE
+    recipe_relations = [
+        (Recipe.tags.through, 'recipe_id'),
+        (Recipe.ingredients.through, 'recipe_id'),
+    ]
+    # The rows of the user live on its shard, see core/routers.py
+    with use_shard_of(user_id):
+        for rows in _delete_in_batches(Recipe, recipe_relations, user_id, batch_size, ('id', 'image')): # noqa
+            # Blobs are shared by content, release_recipe_image keeps those still referenced or within the grace period # noqa
+            for name in {image for _, image in rows if image}:
+                release_recipe_image(name)
+
+        # Recipes are gone, through rows left over can only come from other users' recipes # noqa
+        for model, through, column in (
+            (Tag, Recipe.tags.through, 'tag_id'),
+            (Ingredient, Recipe.ingredients.through, 'ingredient_id'),
+        ):
+            for _ in _delete_in_batches(model, [(through, column)], user_id, batch_size): # noqa
+                pass
+
+        UserDetails.objects.filter(user_id=user_id).delete()
+
+
+def delete_account_data(user_id, batch_size=None):
+    """Remove a user marked as deleting and everything they own. Safe to run again after an interruption""" # noqa
+    if not User.objects.filter(pk=user_id, deleted_at__isnull=False).exists(): # noqa
+        return False
+
+    delete_owned_rows(user_id, batch_size)
+
+    # What is left is a few rows, deleted through the ORM so the token cache is invalidated # noqa
+    with transaction.atomic():
+        Token.objects.filter(user_id=user_id).delete()
+        User.objects.filter(pk=user_id).delete()
+
+    return True
+
+
+def _run_deletion(user_id, close_connection):
+    """Run delete_account_data, logging failures as nobody waits for the result""" # noqa
+    try:
+        delete_account_data(user_id)
+    except Exception:
+        logger.exception('Deleting the data of user %s failed', user_id)
+    finally:
+        if close_connection:
+            close_old_connections()
+
+
+def schedule_account_deletion(user_id):
+    """Deactivate a user, revoke their tokens and delete their data in the background once committed""" # noqa
+    User.objects.filter(pk=user_id).update(
+        is_active=False,
+        deleted_at=timezone.now(),
+    )
+    # Deleted through the ORM, so cached lookups of the tokens are dropped
+    Token.objects.filter(user_id=user_id).delete()
+
+    executor = get_executor('account-deletion', settings.ACCOUNT_DELETION_WORKERS) # noqa
+
+    # Pool threads have their own database connection, the request thread must keep its one open # noqa
+    transaction.on_commit(lambda: executor.submit(
+        _run_deletion,
+        user_id,
+        close_connection=not isinstance(executor, InlineExecutor),
+    ))
@@ -4,6 +4,7 @@ It is a built-in feature of Django that allows you to create, read, update, and
 Here, we inherit the UserAdmin class from the BaseUserAdmin class and customize the admin pages for the custom User model. # noqa
 """
 
+from django.conf import settings
 from django.contrib import admin  # noqa
 
 # Default User
@@ -55,6 +56,8 @@ class UserAdmin(BaseUserAdmin):
 
 
 admin.site.register(models.User, UserAdmin)
-admin.site.register(models.Recipe)
-admin.site.register(models.Tag)
-admin.site.register(models.Ingredient)
+# With DB_SHARDS set, the admin would only see the shard of the logged in admin, see core/routers.py # noqa
+if not settings.DATABASE_SHARDS:
+    admin.site.register(models.Recipe)
+    admin.site.register(models.Tag)
+    admin.site.register(models.Ingredient)
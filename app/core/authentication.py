@@ -0,0 +1,334 @@
+"""
+Token authentication without a database lookup per request.
+CachedTokenAuthentication keeps token -> user lookups in a bounded LRU with a TTL per worker, optionally backed by a shared Django cache. # noqa
+Entries are invalidated by core/signals.py when a token is deleted or its user changes. Other workers drop their copy within the TTL, # noqa
+meanwhile writes check the token and its user in the database, so only reads may use a stale entry. # noqa
+Tokens expire TOKEN_EXPIRY seconds after their last use. Uses are written to TokenUsage at most once per TOKEN_USAGE_INTERVAL. # noqa
+SignedTokenAuthentication accepts short-lived HMAC signed tokens carrying the user id, refreshed with a database token. # noqa
+"""
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core import signing
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+
+from drf_spectacular.extensions import OpenApiAuthenticationExtension
+from drf_spectacular.plumbing import build_bearer_security_scheme_object
+from rest_framework import exceptions
+from rest_framework.authentication import (
+    BaseAuthentication,
+    TokenAuthentication,
+    get_authorization_header,
+)
+from rest_framework.authtoken.models import Token
+from rest_framework.permissions import SAFE_METHODS
+
+from core.models import TokenUsage
+
+
+def _cached_fields():
+    """Return the user fields kept in the cache. The password hash never leaves the database, fields it needs are loaded on access""" # noqa
+    return [
+        field.attname for field in get_user_model()._meta.concrete_fields
+        if field.name not in ('password', 'last_login')
+    ]
+
+
+def _digest(key):
+    """Cache tokens under their hash, so token keys never end up in a shared cache""" # noqa
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+class TokenCache:
+    """Bounded LRU of token key -> user row, whose entries expire after ttl seconds""" # noqa
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.shared_hits = self.misses = 0
+
+    def _shared(self):
+        alias = settings.TOKEN_AUTH_SHARED_CACHE
+        return caches[alias] if alias else None
+
+    def get(self, key):
+        """Return (user, token) for a token key, or None on a miss"""
+        digest = _digest(key)
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(digest)
+                self.hits += 1
+                return self._build(key, entry[1])
+
+        shared = self._shared()
+        row = shared.get(f'auth-token:3:{digest}') if shared else None
+
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                self._entries.pop(digest, None)
+                return None
+            self.shared_hits += 1
+
+        self._store(digest, row)
+        return self._build(key, row)
+
+    def set(self, user, token):
+        """Cache the user row of a token, locally and in the shared cache"""
+        digest = _digest(token.key)
+        row = (
+            token.created,
+            token.last_used,
+            [getattr(user, attname) for attname in _cached_fields()],
+        )
+
+        self._store(digest, row)
+        shared = self._shared()
+        if shared:
+            shared.set(f'auth-token:3:{digest}', row, settings.TOKEN_AUTH_CACHE_TTL) # noqa
+
+    def _store(self, digest, row):
+        with self._lock:
+            self._entries[digest] = (time.monotonic() + settings.TOKEN_AUTH_CACHE_TTL, row) # noqa
+            self._entries.move_to_end(digest)
+            while len(self._entries) > settings.TOKEN_AUTH_CACHE_SIZE:
+                self._entries.popitem(last=False)
+
+    def _build(self, key, row):
+        """Return fresh user and token instances from a cached row, so requests never share instances""" # noqa
+        created, last_used, values = row
+        User = get_user_model()
+        user = User.from_db(DEFAULT_DB_ALIAS, _cached_fields(), values)
+        token = Token.from_db(
+            DEFAULT_DB_ALIAS,
+            ['key', 'user_id', 'created'],
+            [key, user.pk, created],
+        )
+        token.user = user
+        token.last_used = last_used
+        return user, token
+
+    def invalidate(self, *keys):
+        """Drop the entries of the given token keys"""
+        digests = [_digest(key) for key in keys]
+
+        with self._lock:
+            for digest in digests:
+                self._entries.pop(digest, None)
+
+        shared = self._shared()
+        if shared and digests:
+            shared.delete_many([f'auth-token:3:{digest}' for digest in digests]) # noqa
+
+    def clear(self):
+        """Drop every local entry and reset the counters"""
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.shared_hits = self.misses = 0
+
+    def stats(self):
+        """Return the counters of this worker"""
+        with self._lock:
+            lookups = self.hits + self.shared_hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': settings.TOKEN_AUTH_CACHE_SIZE,
+                'ttl': settings.TOKEN_AUTH_CACHE_TTL,
+                'hits': self.hits,
+                'shared_hits': self.shared_hits,
+                'misses': self.misses,
+                'hit_rate': round((self.hits + self.shared_hits) / lookups, 4) if lookups else None, # noqa
+            }
+
+
+token_cache = TokenCache()
+
+
+def token_expired(last_used, now):
+    """Return whether a token last used at last_used has expired"""
+    return bool(settings.TOKEN_EXPIRY) and last_used < now - timedelta(seconds=settings.TOKEN_EXPIRY) # noqa
+
+
+def expired_tokens(now):
+    """Return querysets of the tokens expired at now: those with a recorded use, and those never used since created""" # noqa
+    cutoff = now - timedelta(seconds=settings.TOKEN_EXPIRY)
+    return (
+        Token.objects.filter(usage__last_used__lt=cutoff),
+        Token.objects.filter(usage__isnull=True, created__lt=cutoff),
+    )
+
+
+def load_token(**lookup):
+    """Return the token matching the lookup with its user and last use, or None""" # noqa
+    try:
+        token = Token.objects.select_related('user', 'usage').get(**lookup)
+    except Token.DoesNotExist:
+        return None
+
+    try:
+        token.last_used = token.usage.last_used
+    except TokenUsage.DoesNotExist:
+        token.last_used = token.created
+    return token
+
+
+def record_token_use(token, now):
+    """Record a use of the token, unless one was recorded within TOKEN_USAGE_INTERVAL. Returns whether it wrote""" # noqa
+    if token.last_used > now - timedelta(seconds=settings.TOKEN_USAGE_INTERVAL): # noqa
+        return False
+
+    # Conditional, so workers holding the same stale last use write it only once # noqa
+    updated = TokenUsage.objects.filter(
+        token_id=token.pk,
+        last_used__lte=now - timedelta(seconds=settings.TOKEN_USAGE_INTERVAL),
+    ).update(last_used=now)
+    if not updated:
+        TokenUsage.objects.bulk_create(
+            [TokenUsage(token_id=token.pk, last_used=now)],
+            ignore_conflicts=True,
+        )
+
+    token.last_used = now
+    return True
+
+
+def issue_token(user):
+    """Return the token of a user logging in, rotated to a new key once expired. Logging in counts as a use""" # noqa
+    now = timezone.now()
+    token = load_token(user=user)
+
+    if token is not None and token_expired(token.last_used, now):
+        token.delete()
+        token = None
+    if token is None:
+        # A new token counts as used when created
+        token, _ = Token.objects.get_or_create(user=user)
+        return token
+
+    record_token_use(token, now)
+    return token
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication looking tokens up in token_cache before the database, and expiring unused tokens""" # noqa
+
+    def authenticate(self, request):
+        auth = super().authenticate(request)
+        # The entries of other workers outlive deleted tokens and deactivated users until their TTL # noqa
+        if auth is not None and auth[1].cached and request.method not in SAFE_METHODS: # noqa
+            token = auth[1]
+            if not Token.objects.filter(key=token.key, user__is_active=True).exists(): # noqa
+                token_cache.invalidate(token.key)
+                raise exceptions.AuthenticationFailed(_('User inactive or deleted.')) # noqa
+        return auth
+
+    def authenticate_credentials(self, key):
+        cached = token_cache.get(key)
+        if cached is not None:
+            user, token = cached
+        else:
+            token = load_token(key=key)
+            if token is None:
+                raise exceptions.AuthenticationFailed(_('Invalid token.'))
+            # Inactive users are never cached
+            if not token.user.is_active:
+                raise exceptions.AuthenticationFailed(_('User inactive or deleted.')) # noqa
+            user = token.user
+
+        now = timezone.now()
+        if token_expired(token.last_used, now):
+            token_cache.invalidate(key)
+            raise exceptions.AuthenticationFailed(_('Token has expired.'))
+
+        if record_token_use(token, now) or cached is None:
+            token_cache.set(user, token)
+        token.cached = cached is not None
+        return user, token
+
+
+SIGNED_TOKEN_SALT = 'core.authentication.signed-token'
+
+
+def _signers():
+    """Return signers for SECRET_KEY followed by SECRET_KEY_FALLBACKS, so tokens survive a key rotation""" # noqa
+    keys = [settings.SECRET_KEY, *getattr(settings, 'SECRET_KEY_FALLBACKS', [])] # noqa
+    return [signing.TimestampSigner(key, salt=SIGNED_TOKEN_SALT) for key in keys] # noqa
+
+
+def create_signed_token(user):
+    """Return a signed access token for the user, valid for SIGNED_TOKEN_TTL seconds""" # noqa
+    return _signers()[0].sign_object({'u': user.pk})
+
+
+def read_signed_token(value):
+    """Return the user id of a signed token. Raises BadSignature, or SignatureExpired once past its TTL""" # noqa
+    for signer in _signers():
+        try:
+            return signer.unsign_object(value, max_age=settings.SIGNED_TOKEN_TTL)['u'] # noqa
+        except signing.SignatureExpired:
+            raise  # Signed with this key, but too old
+        except signing.BadSignature:
+            continue
+
+    raise signing.BadSignature('No key matches the token signature')
+
+
+class SignedTokenAuthentication(BaseAuthentication):
+    """Authenticate 'Authorization: Bearer <signed token>' headers from the signature alone. # noqa
+    The user is a deferred instance holding only its id, so deactivated users keep reading until their token expires. # noqa
+    Writes check the user is still active, so accounts being deleted cannot recreate data""" # noqa
+
+    keyword = 'Bearer'
+
+    def authenticate(self, request):
+        # Turning SIGNED_TOKEN_AUTH off also stops the tokens already issued
+        if not settings.SIGNED_TOKEN_AUTH:
+            return None
+
+        auth = get_authorization_header(request).split()
+        if not auth or auth[0].lower() != self.keyword.lower().encode():
+            return None
+        if len(auth) != 2:
+            raise exceptions.AuthenticationFailed(_('Invalid token header.'))
+
+        try:
+            user_id = read_signed_token(auth[1].decode())
+        except signing.SignatureExpired:
+            raise exceptions.AuthenticationFailed(_('Token has expired.'))
+        except (signing.BadSignature, UnicodeError):
+            raise exceptions.AuthenticationFailed(_('Invalid token.'))
+
+        User = get_user_model()
+        if request.method not in SAFE_METHODS and not User.objects.filter(pk=user_id, is_active=True).exists(): # noqa
+            raise exceptions.AuthenticationFailed(_('User inactive or deleted.')) # noqa
+
+        user = User.from_db(DEFAULT_DB_ALIAS, [User._meta.pk.attname], [user_id]) # noqa
+        return user, None
+
+    def authenticate_header(self, request):
+        return self.keyword
+
+
+class SignedTokenScheme(OpenApiAuthenticationExtension):
+    """Document SignedTokenAuthentication in the API schema"""
+
+    target_class = 'core.authentication.SignedTokenAuthentication'
+    name = 'signedTokenAuth'
+
+    def get_security_definition(self, auto_schema):
+        return build_bearer_security_scheme_object(
+            header_name='Authorization',
+            token_prefix=SignedTokenAuthentication.keyword,
+        )
@@ -0,0 +1,44 @@
+"""
+PostgreSQL backend checking reused connections lazily, as Django does itself with CONN_HEALTH_CHECKS from 4.1. # noqa
+A persistent connection is checked once per request, right before its first query, so requests not using it pay no round trip. # noqa
+"""
+
+from django.db.backends.postgresql import base
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """Close a reused connection that stopped working, e.g. after a database restart, before it runs a query""" # noqa
+
+    health_check_done = False
+
+    @property
+    def health_check_enabled(self):
+        return bool(self.settings_dict.get('CONN_HEALTH_CHECKS'))
+
+    def connect(self):
+        super().connect()
+        # A new connection needs no check
+        self.health_check_done = True
+
+    def close_if_unusable_or_obsolete(self):
+        super().close_if_unusable_or_obsolete()
+        # Called when a request starts and finishes, the connection is checked again on its next use # noqa
+        self.health_check_done = False
+
+    def close_if_health_check_failed(self):
+        """Close the connection if it does not answer, once per request"""
+        if (
+            self.connection is None
+            or not self.health_check_enabled
+            or self.health_check_done
+            or self.in_atomic_block
+        ):
+            return
+
+        if not self.is_usable():
+            self.close()
+        self.health_check_done = True
+
+    def _cursor(self, name=None):
+        self.close_if_health_check_failed()
+        return super()._cursor(name)
@@ -0,0 +1,43 @@
+"""
+Database helpers for persistent and pooled connections, and for the id sequences of the shards. # noqa
+Reused connections are health checked by the backend in core/backends/postgresql. # noqa
+"""
+
+
+def iterate_values(queryset, *fields, chunk_size=2000):
+    """Yield the values of fields for every row of queryset, fetching chunk_size rows per query in primary key order. # noqa
+    Unlike .iterator() it needs no server side cursor, so it streams behind PgBouncer in transaction mode too""" # noqa
+    last = None
+    while True:
+        chunk = queryset.order_by('pk')
+        if last is not None:
+            chunk = chunk.filter(pk__gt=last)
+        rows = list(chunk.values_list('pk', *fields)[:chunk_size])
+
+        for row in rows:
+            yield row[1] if len(fields) == 1 else row[1:]
+
+        if len(rows) < chunk_size:
+            return
+        last = rows[-1][0]
+
+
+def reserve_id_range(connection, table, start):
+    """Make the ids allocated for table on connection start at start, unless its sequence is past it already. # noqa
+    Supports PostgreSQL and SQLite, the backends of the shards"""
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [table])
+            sequence = cursor.fetchone()[0]
+            cursor.execute(f'SELECT last_value, is_called FROM {sequence}')
+            last, called = cursor.fetchone()
+            if last + called < start:
+                cursor.execute('SELECT setval(%s, %s, false)', [sequence, start]) # noqa
+        elif connection.vendor == 'sqlite':
+            # Tables with AUTOINCREMENT allocate the id after seq
+            cursor.execute('SELECT seq FROM sqlite_sequence WHERE name = %s', [table]) # noqa
+            row = cursor.fetchone()
+            if row is None:
+                cursor.execute('INSERT INTO sqlite_sequence (name, seq) VALUES (%s, %s)', [table, start - 1]) # noqa
+            elif row[0] < start - 1:
+                cursor.execute('UPDATE sqlite_sequence SET seq = %s WHERE name = %s', [start - 1, table]) # noqa
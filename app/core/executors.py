@@ -0,0 +1,63 @@
+"""
+Bounded, per-process worker pools for work that should not run on (or block) the request thread. # noqa
+Pools are created lazily, so each uWSGI worker gets its own after forking.
+Process pools start their processes from a forkserver, as forking a threaded uWSGI worker could copy locks held by its other threads. # noqa
+Their processes set Django up again from DJANGO_SETTINGS_MODULE, so overridden settings do not reach them. # noqa
+"""
+
+import multiprocessing
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+
+import django
+
+
+_executors = {}
+_lock = threading.Lock()
+
+
+class InlineExecutor:
+    """Executor running every task immediately on the calling thread. Used when a pool is configured with 0 workers""" # noqa
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+        return future
+
+    def map(self, fn, *iterables):
+        return map(fn, *iterables)
+
+
+def get_executor(name, max_workers, processes=False):
+    """Return the pool registered under name and size, creating it on first use""" # noqa
+    key = (name, max_workers, processes)
+
+    with _lock:
+        if key not in _executors:
+            if max_workers <= 0:
+                _executors[key] = InlineExecutor()
+            elif processes:
+                _executors[key] = ProcessPoolExecutor(
+                    max_workers=max_workers,
+                    mp_context=multiprocessing.get_context('forkserver'),
+                    initializer=django.setup,
+                )
+            else:
+                _executors[key] = ThreadPoolExecutor(
+                    max_workers=max_workers,
+                    thread_name_prefix=name,
+                )
+
+        return _executors[key]
+
+
+def shutdown_executors():
+    """Stop every pool, waiting for running tasks. Mostly useful in tests"""
+    with _lock:
+        for executor in _executors.values():
+            if hasattr(executor, "shutdown"):
+                executor.shutdown(wait=True)
+        _executors.clear()
@@ -0,0 +1,34 @@
+"""
+Password hashers with parameters tunable from the settings.
+They keep the algorithm names of Django's hashers, so existing hashes verify and are rehashed on login once the parameters change. # noqa
+"""
+
+from django.conf import settings
+from django.contrib.auth import hashers
+
+
+class PBKDF2PasswordHasher(hashers.PBKDF2PasswordHasher):
+    """PBKDF2-SHA256 with PBKDF2_ITERATIONS, or Django's default iterations"""
+
+    @property
+    def iterations(self):
+        return settings.PBKDF2_ITERATIONS or hashers.PBKDF2PasswordHasher.iterations # noqa
+
+
+class ScryptPasswordHasher(hashers.ScryptPasswordHasher):
+    """Scrypt with the SCRYPT_WORK_FACTOR, SCRYPT_BLOCK_SIZE and SCRYPT_PARALLELISM settings""" # noqa
+
+    @property
+    def work_factor(self):
+        return settings.SCRYPT_WORK_FACTOR
+
+    @property
+    def block_size(self):
+        return settings.SCRYPT_BLOCK_SIZE
+
+    @property
+    def parallelism(self):
+        return settings.SCRYPT_PARALLELISM
+
+    # Upper bound only, scrypt allocates 128 * n * r * p bytes. OpenSSL's default (maxmem=0) of 32 MB rejects work factors above 2**14 # noqa
+    maxmem = 1024 ** 3
@@ -0,0 +1,66 @@
+"""
+Django command to benchmark the per-request database overhead of each connection mode. # noqa
+Each simulated request sends the request signals around one small query, like a view would. # noqa
+Only meaningful against PostgreSQL: on SQLite is_usable() runs no query, so the checked mode costs nothing there. # noqa
+"""
+
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.core.signals import request_finished, request_started
+from django.db import connection
+
+
+class Command(BaseCommand):
+    """Compare new, persistent, health-checked and pooled connections"""
+
+    help = "Benchmark the database overhead per request of each connection mode" # noqa
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=200)
+        parser.add_argument("--repeat", type=int, default=5)
+        parser.add_argument(
+            "--pooler",
+            metavar="HOST:PORT",
+            help="Also measure through a PgBouncer listening there",
+        )
+
+    def handle(self, *args, **options):
+        """Default entry point for the command"""
+        original = dict(connection.settings_dict)
+
+        modes = {
+            "new connection": {"CONN_MAX_AGE": 0, "CONN_HEALTH_CHECKS": False}, # noqa
+            "persistent": {"CONN_MAX_AGE": 600, "CONN_HEALTH_CHECKS": False},
+            "persistent, checked": {"CONN_MAX_AGE": 600, "CONN_HEALTH_CHECKS": True}, # noqa
+        }
+        if options["pooler"]:
+            host, port = options["pooler"].rsplit(":", 1)
+            modes["pgbouncer, new connection"] = {
+                "HOST": host, "PORT": port, "CONN_MAX_AGE": 0,
+                "CONN_HEALTH_CHECKS": False, "DISABLE_SERVER_SIDE_CURSORS": True, # noqa
+            }
+
+        try:
+            for name, mode in modes.items():
+                connection.close()
+                connection.settings_dict.update(original, **mode)
+                timings = [self.run(options["requests"]) for _ in range(options["repeat"])] # noqa
+                self.stdout.write(
+                    f"{name:>26}: {statistics.median(timings) * 1e6:.0f} us per request" # noqa
+                )
+        finally:
+            connection.close()
+            connection.settings_dict.update(original)
+
+    def run(self, requests):
+        """Return the average seconds per simulated request"""
+        start = time.perf_counter()
+        for _ in range(requests):
+            request_started.send(sender=self.__class__)
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+                cursor.fetchone()
+            request_finished.send(sender=self.__class__)
+        return (time.perf_counter() - start) / requests
@@ -0,0 +1,80 @@
+"""
+Django command to benchmark login throughput for each password hasher.
+The benchmark user is committed, so the request threads can see it, and deleted at the end. # noqa
+"""
+
+import threading
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import override_settings
+
+from core.passwords import authenticate_login
+
+
+HASHERS = {
+    "pbkdf2 (default)": ["core.hashers.PBKDF2PasswordHasher"],
+    "scrypt": ["core.hashers.ScryptPasswordHasher"],
+}
+
+
+class Command(BaseCommand):
+    """Measure logins per second through the hashing pool"""
+
+    help = "Benchmark logins per second with each password hasher"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--logins", type=int, default=40)
+        parser.add_argument("--threads", type=int, default=4)
+        parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4]) # noqa
+
+    def handle(self, *args, **options):
+        """Default entry point for the command"""
+
+        for name, hashers in HASHERS.items():
+            with override_settings(PASSWORD_HASHERS=hashers):
+                user = get_user_model().objects.create_user(
+                    email="bench@example.com", password="benchpass123",
+                )
+                try:
+                    for workers in options["workers"]:
+                        with override_settings(
+                            PASSWORD_HASH_WORKERS=workers,
+                            PASSWORD_HASH_MAX_QUEUE=options["threads"],
+                            PASSWORD_HASH_TIMEOUT=600,
+                        ):
+                            rate = self.run(options["logins"], options["threads"]) # noqa
+                        self.stdout.write(
+                            f"{name:>16}, {workers} hashing workers: {rate:.1f} logins per second" # noqa
+                        )
+                finally:
+                    user.delete()
+
+    def run(self, logins, threads):
+        """Log in concurrently from request threads, returning logins per second""" # noqa
+        failures = []
+
+        def request_thread(count):
+            try:
+                for _ in range(count):
+                    if not authenticate_login("bench@example.com", "benchpass123"): # noqa
+                        failures.append(count)
+            finally:
+                connection.close()
+
+        workers = [
+            threading.Thread(target=request_thread, args=(logins // threads,))
+            for _ in range(threads)
+        ]
+        start = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - start
+
+        if failures:
+            raise RuntimeError(f"{len(failures)} logins failed")
+        return logins // threads * threads / elapsed
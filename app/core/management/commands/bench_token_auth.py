@@ -0,0 +1,75 @@
+"""
+Django command to benchmark the per-request cost of the token authentication modes. # noqa
+All data is created inside a transaction which is rolled back at the end.
+"""
+
+import statistics
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from core.authentication import (
+    CachedTokenAuthentication,
+    SignedTokenAuthentication,
+    create_signed_token,
+    token_cache,
+)
+
+
+class Command(BaseCommand):
+    """Compare database, cached and signed token authentication"""
+
+    help = "Benchmark authenticating a request with each token mode"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=2000)
+        parser.add_argument("--repeat", type=int, default=5)
+
+    def handle(self, *args, **options):
+        """Default entry point for the command"""
+
+        with transaction.atomic():
+            user = get_user_model().objects.create_user(
+                email="bench@example.com", password=None,
+            )
+            token = Token.objects.create(user=user)
+            token_cache.clear()
+
+            modes = {
+                "database token": (TokenAuthentication(), f"Token {token.key}"), # noqa
+                "cached token": (CachedTokenAuthentication(), f"Token {token.key}"), # noqa
+                "signed token": (SignedTokenAuthentication(), f"Bearer {create_signed_token(user)}"), # noqa
+            }
+
+            factory = APIRequestFactory()
+            for name, (authenticator, header) in modes.items():
+                request = Request(factory.get("/", HTTP_AUTHORIZATION=header))
+                timings = []
+                queries = []
+
+                def count_query(execute, sql, params, many, context):
+                    queries.append(sql)
+                    return execute(sql, params, many, context)
+
+                # Counts every query, unlike connection.queries which is capped # noqa
+                with connection.execute_wrapper(count_query):
+                    for _ in range(options["repeat"]):
+                        start = time.perf_counter()
+                        for _ in range(options["requests"]):
+                            authenticator.authenticate(request)
+                        timings.append((time.perf_counter() - start) / options["requests"]) # noqa
+
+                total = options["repeat"] * options["requests"]
+                self.stdout.write(
+                    f"{name:>15}: {statistics.median(timings) * 1e6:.1f} us per request, " # noqa
+                    f"{len(queries) / total:.3f} queries per request"
+                )
+
+            transaction.set_rollback(True)
@@ -0,0 +1,174 @@
+"""
+Django command to delete recipe image files which no recipe references anymore. # noqa
+"""
+
+import os
+import sqlite3
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.db import iterate_values
+from core.models import Recipe
+from core.routers import all_shards
+
+
+# Directories under MEDIA_ROOT holding recipe images: content-addressed blobs and files uploaded before them # noqa
+IMAGE_DIRS = ("blobs", os.path.join("uploads", "recipe"))
+
+
+def scan_files(root, directory):
+    """Yield (name relative to root, stat) of every file below directory, without listing whole trees in memory""" # noqa
+    stack = [os.path.join(root, directory)]
+    while stack:
+        try:
+            entries = os.scandir(stack.pop())
+        except FileNotFoundError:
+            continue
+        with entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    yield os.path.relpath(entry.path, root), entry.stat()
+
+
+class ReferenceSet:
+    """Set of referenced image names kept in a temporary SQLite file, so millions of names do not need to fit in memory""" # noqa
+
+    def __init__(self, directory):
+        self.db = sqlite3.connect(os.path.join(directory, "references.sqlite3")) # noqa
+        self.db.execute("PRAGMA journal_mode = OFF")
+        self.db.execute("PRAGMA synchronous = OFF")
+        self.db.execute("CREATE TABLE refs (name TEXT PRIMARY KEY) WITHOUT ROWID") # noqa
+
+    def add_all(self, names, batch_size):
+        """Insert the names, batch_size rows per statement"""
+        batch = []
+        for name in names:
+            batch.append((name,))
+            if len(batch) >= batch_size:
+                self.db.executemany("INSERT OR IGNORE INTO refs VALUES (?)", batch) # noqa
+                batch = []
+        self.db.executemany("INSERT OR IGNORE INTO refs VALUES (?)", batch)
+        self.db.commit()
+
+    def __contains__(self, name):
+        return self.db.execute("SELECT 1 FROM refs WHERE name = ?", (name,)).fetchone() is not None # noqa
+
+    def close(self):
+        self.db.close()
+
+
+class Command(BaseCommand):
+    """Sweep the media volume for recipe images without a referencing recipe""" # noqa
+
+    help = "Delete unreferenced recipe image files older than the grace period" # noqa
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only report the orphaned files",
+        )
+        parser.add_argument(
+            "--grace-seconds",
+            type=int,
+            default=None,
+            help="Keep files younger than this (default: RECIPE_IMAGE_GRACE_SECONDS)", # noqa
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="Number of files deleted per batch",
+        )
+        parser.add_argument(
+            "--sleep",
+            type=float,
+            default=0.1,
+            help="Seconds to pause between batches, to limit the I/O load",
+        )
+        parser.add_argument(
+            "--interval",
+            type=int,
+            default=0,
+            help="Run again every this many seconds, instead of once",
+        )
+
+    def handle(self, *args, **options):
+        """Default entry point for the command"""
+        while True:
+            self.sweep(options)
+            if not options["interval"]:
+                break
+            time.sleep(options["interval"])
+
+    def sweep(self, options):
+        """Collect the orphaned images once"""
+        grace = options["grace_seconds"]
+        if grace is None:
+            grace = settings.RECIPE_IMAGE_GRACE_SECONDS
+        # Files written after this point are always kept, so images uploaded during the sweep are safe # noqa
+        cutoff = time.time() - grace
+
+        with tempfile.TemporaryDirectory() as directory:
+            references = ReferenceSet(directory)
+            try:
+                # Blobs are shared by content, so a recipe on any shard keeps them # noqa
+                for alias in all_shards():
+                    references.add_all(
+                        iterate_values(
+                            Recipe.objects.using(alias).exclude(image="").exclude(image=None), # noqa
+                            "image",
+                        ),
+                        options["batch_size"],
+                    )
+
+                scanned = deleted = freed = 0
+                batch = []
+                for directory_name in IMAGE_DIRS:
+                    for name, stat in scan_files(settings.MEDIA_ROOT, directory_name): # noqa
+                        scanned += 1
+                        if stat.st_mtime < cutoff and name not in references: # noqa
+                            batch.append((name, stat.st_size))
+                        if len(batch) >= options["batch_size"]:
+                            count, size = self.delete(batch, options)
+                            deleted, freed, batch = deleted + count, freed + size, [] # noqa
+                if batch:
+                    count, size = self.delete(batch, options)
+                    deleted, freed = deleted + count, freed + size
+            finally:
+                references.close()
+
+        verb = "Found" if options["dry_run"] else "Deleted"
+        self.stdout.write(
+            f"Scanned {scanned} files: {verb} {deleted} orphaned images ({freed} bytes)" # noqa
+        )
+
+    def delete(self, batch, options):
+        """Delete a batch of orphaned files, returning their count and size"""
+        # Check the batch against the database again, as recipes may have been given one of the files since the snapshot # noqa
+        names = [name for name, _ in batch]
+        referenced = set(
+            Recipe.objects.filter(image__in=names).values_list("image", flat=True) # noqa
+        )
+
+        count = size = 0
+        for name, file_size in batch:
+            if name in referenced:
+                continue
+            if not options["dry_run"]:
+                try:
+                    os.remove(os.path.join(settings.MEDIA_ROOT, name))
+                except FileNotFoundError:
+                    continue
+            count += 1
+            size += file_size
+
+        if not options["dry_run"] and options["sleep"]:
+            time.sleep(options["sleep"])
+
+        return count, size
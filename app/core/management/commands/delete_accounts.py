@@ -0,0 +1,60 @@
+"""
+Django command to finish deleting accounts whose background deletion was interrupted. # noqa
+docker-compose-deploy.yml runs it with --interval, so deletions interrupted by a restart are finished without a manual run. # noqa
+"""
+
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from core.accounts import delete_account_data
+from core.models import User
+
+
+class Command(BaseCommand):
+    """Delete the data of every account marked as deleting"""
+
+    help = "Finish deleting accounts marked as deleting, e.g. after a restart" # noqa
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=None,
+            help="Rows deleted per transaction (default: ACCOUNT_DELETION_BATCH_SIZE)", # noqa
+        )
+        parser.add_argument(
+            "--min-age",
+            type=int,
+            default=0,
+            help="Only finish accounts marked as deleting at least this many seconds ago, leaving the recent ones to their background deletion", # noqa
+        )
+        parser.add_argument(
+            "--interval",
+            type=int,
+            default=0,
+            help="Run again every this many seconds, instead of once",
+        )
+
+    def handle(self, *args, **options):
+        """Default entry point for the command"""
+        while True:
+            self.resume(options)
+            if not options["interval"]:
+                break
+            time.sleep(options["interval"])
+
+    def resume(self, options):
+        """Finish the pending deletions once"""
+        marked_before = timezone.now() - timedelta(seconds=options["min_age"])
+        user_ids = list(
+            User.objects.filter(deleted_at__lte=marked_before)
+            .order_by("deleted_at").values_list("pk", flat=True)
+        )
+
+        for user_id in user_ids:
+            delete_account_data(user_id, options["batch_size"])
+
+        self.stdout.write(f"Deleted {len(user_ids)} accounts")
@@ -0,0 +1,217 @@
+"""
+Django command to create many users at once from a CSV or NDJSON file.
+Passwords are hashed on a pool of processes while the previous chunk is inserted, so throughput grows with the cores. # noqa
+Invalid rows, e.g. without an email or with a non numeric age, are reported on stderr and skipped. # noqa
+"""
+
+import csv
+import io
+import json
+import os
+import sys
+import time
+from collections import defaultdict, deque
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from rest_framework.authtoken.models import Token
+
+from core.executors import get_executor
+from core.models import UserDetails
+from core.routers import shard_for_user
+
+
+def hash_passwords(passwords):
+    """Hash a slice of passwords. Runs in the pool processes"""
+    return [make_password(password or None) for password in passwords]
+
+
+def read_rows(stream, file_format):
+    """Yield (line number, row) for the rows of a CSV file with a header line, or of a file with a JSON object per line. # noqa
+    Lines which are not valid JSON are yielded with a row of None"""
+    if file_format == "csv":
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+        return
+
+    for line_num, line in enumerate(stream, 1):
+        if line.strip():
+            try:
+                yield line_num, json.loads(line)
+            except ValueError:
+                yield line_num, None
+
+
+def chunked(rows, size):
+    """Yield lists of up to size rows"""
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class Command(BaseCommand):
+    """Bulk create users with their details and optionally auth tokens"""
+
+    help = "Create users from a CSV or NDJSON file with email, password, name and optional age, country, city, favorite_food columns" # noqa
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="File to read, '-' for stdin")
+        parser.add_argument(
+            "--format",
+            choices=("csv", "ndjson"),
+            help="File format (default: from the file extension, csv for stdin)", # noqa
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=os.cpu_count(),
+            help="Processes hashing passwords, 0 hashes in this process",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=1000,
+            help="Number of users inserted per transaction",
+        )
+        parser.add_argument(
+            "--tokens",
+            metavar="FILE",
+            help="Also create auth tokens, and write 'email,token' lines to FILE", # noqa
+        )
+
+    def handle(self, *args, **options):
+        """Default entry point for the command"""
+        path = options["path"]
+        file_format = options["format"]
+        if file_format is None:
+            file_format = "ndjson" if path.endswith((".ndjson", ".jsonl")) else "csv" # noqa
+
+        stream = io.TextIOWrapper(sys.stdin.buffer, encoding="utf-8") if path == "-" else open(path, encoding="utf-8", newline="") # noqa
+        tokens = open(options["tokens"], "w", newline="") if options["tokens"] else None # noqa
+        try:
+            created, skipped, elapsed = self.provision(
+                read_rows(stream, file_format), tokens, options,
+            )
+        finally:
+            stream.close()
+            if tokens:
+                tokens.close()
+
+        rate = created / elapsed if elapsed else 0
+        self.stdout.write(
+            f"Created {created} users, skipped {skipped} in {elapsed:.1f}s: {rate:.0f} rows per second" # noqa
+        )
+
+    def validate(self, rows):
+        """Yield the rows fit for insertion, with a normalized email and age, and report the others on stderr. # noqa
+        Checked before hashing, so a bad row never stops the import after earlier chunks committed""" # noqa
+        User = get_user_model()
+        for line_num, row in rows:
+            if not isinstance(row, dict):
+                error = "not a JSON object"
+            elif not isinstance(row.get("email") or "", str) or not (row.get("email") or "").strip(): # noqa
+                error = "no email"
+            elif not isinstance(row.get("password") or "", str):
+                error = "the password is not a string"
+            else:
+                try:
+                    age = int(row.get("age") or 0)
+                except (TypeError, ValueError):
+                    error = f"invalid age {row.get('age')!r}"
+                else:
+                    yield dict(row, email=User.objects.normalize_email(row["email"].strip()), age=age) # noqa
+                    continue
+
+            self.invalid += 1
+            self.stderr.write(f"Skipping line {line_num}: {error}")
+
+    def provision(self, rows, tokens, options):
+        """Insert the rows chunk by chunk, returning (created, skipped, seconds)""" # noqa
+        executor = get_executor("provision-hashing", options["workers"], processes=True) # noqa
+        slices = max(options["workers"], 1)
+        writer = csv.writer(tokens) if tokens else None
+
+        start = time.perf_counter()
+        created = skipped = 0
+        # Chunks being hashed. One is queued behind the one being inserted, so the pool never idles # noqa
+        pending = deque()
+
+        def insert_next():
+            chunk, futures = pending.popleft()
+            hashes = [password for future in futures for password in future.result()] # noqa
+            return self.insert(chunk, hashes, writer)
+
+        self.invalid = 0
+        for chunk in chunked(self.validate(rows), options["chunk_size"]):
+            passwords = [row.get("password") for row in chunk]
+            size = -(-len(passwords) // slices)
+            futures = [
+                executor.submit(hash_passwords, passwords[i:i + size])
+                for i in range(0, len(passwords), size)
+            ]
+            pending.append((chunk, futures))
+
+            if len(pending) > 1:
+                count, duplicates = insert_next()
+                created, skipped = created + count, skipped + duplicates
+
+        while pending:
+            count, duplicates = insert_next()
+            created, skipped = created + count, skipped + duplicates
+
+        return created, skipped + self.invalid, time.perf_counter() - start
+
+    def insert(self, chunk, hashes, writer):
+        """Insert one chunk in a transaction, skipping existing emails. Returns (created, skipped)""" # noqa
+        User = get_user_model()
+
+        users, rows = {}, {}
+        for row, password in zip(chunk, hashes):
+            email = row["email"]
+            if email in users:
+                continue
+            users[email] = User(email=email, name=row.get("name") or "", password=password) # noqa
+            rows[email] = row
+
+        existing = set(User.objects.filter(email__in=users).values_list("email", flat=True)) # noqa
+        for email in existing:
+            del users[email]
+
+        with transaction.atomic():
+            # PostgreSQL and SQLite return the new ids, which the details and tokens refer to # noqa
+            new_users = User.objects.bulk_create(users.values())
+
+            new_tokens = Token.objects.bulk_create([
+                Token(key=Token.generate_key(), user=user) for user in new_users # noqa
+            ]) if writer else []
+
+            details = defaultdict(list)
+            for user in new_users:
+                if rows[user.email].get("country"):
+                    details[shard_for_user(user.pk)].append(UserDetails(
+                        user=user,
+                        age=rows[user.email]["age"],
+                        country=rows[user.email]["country"],
+                        city=rows[user.email].get("city") or "",
+                        favorite_food=rows[user.email].get("favorite_food") or "", # noqa
+                    ))
+
+            # Details live on the shard of their user, see core/routers.py. Inserted last, so only the commit of the users can fail after them # noqa
+            for alias, shard_details in details.items():
+                with transaction.atomic(using=alias):
+                    UserDetails.objects.using(alias).bulk_create(shard_details) # noqa
+
+        # Written once committed, so the file never lists rolled back tokens
+        if writer:
+            writer.writerows((token.user.email, token.key) for token in new_tokens) # noqa
+
+        return len(new_users), len(chunk) - len(new_users)
@@ -0,0 +1,61 @@
+"""
+Django command to delete expired auth tokens in small batches.
+Each batch is a short transaction of its own, so logins and requests are never blocked behind a long delete. # noqa
+"""
+
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from core.authentication import expired_tokens
+
+
+class Command(BaseCommand):
+    """Delete tokens unused for longer than TOKEN_EXPIRY"""
+
+    help = "Delete expired auth tokens in bounded batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only count the expired tokens",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Number of tokens deleted per statement",
+        )
+        parser.add_argument(
+            "--sleep",
+            type=float,
+            default=0.1,
+            help="Seconds to pause between batches",
+        )
+
+    def handle(self, *args, **options):
+        """Default entry point for the command"""
+        if not settings.TOKEN_EXPIRY:
+            self.stdout.write("TOKEN_EXPIRY is 0, tokens never expire")
+            return
+
+        deleted = 0
+        for expired in expired_tokens(timezone.now()):
+            if options["dry_run"]:
+                deleted += expired.count()
+                continue
+
+            while True:
+                # DELETE ... WHERE key IN (SELECT key ... LIMIT n), with the expiry checked again in case a token was used meanwhile # noqa
+                keys = list(expired.values_list("pk", flat=True)[:options["batch_size"]]) # noqa
+                if not keys:
+                    break
+                deleted += expired.filter(pk__in=keys).delete()[1].get("authtoken.Token", 0) # noqa
+                if options["sleep"]:
+                    time.sleep(options["sleep"])
+
+        verb = "Found" if options["dry_run"] else "Deleted"
+        self.stdout.write(f"{verb} {deleted} expired tokens")
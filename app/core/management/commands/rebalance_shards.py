@@ -0,0 +1,158 @@
+"""
+Django command to move the rows of users to the shard their id hashes to, after DB_SHARDS changed. # noqa
+Run it once sharding is enabled, to move the existing rows off the default database, and after each shard added. # noqa
+Each user is copied in a transaction on its new shard, recorded there in ShardMove, then deleted from the old one. # noqa
+Moves interrupted between the copy and the delete are finished by the next run, without copying again. # noqa
+Requests select the new shard at once, so a user misses the rows not moved yet: run it right after deploying, while traffic is low. # noqa
+"""
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import Q
+
+from core.models import Ingredient, Recipe, ShardMove, Tag, UserDetails
+from core.routers import shard_for_user
+from recipe.stats import invalidate_recipe_stats
+
+
+# Models owned by a user, each copied with its user_id
+OWNED_MODELS = (Tag, Ingredient, Recipe, UserDetails)
+# Relations of recipes: field, related model, column in the through table
+RECIPE_RELATIONS = (
+    ("tags", Tag, "tag_id"),
+    ("ingredients", Ingredient, "ingredient_id"),
+)
+
+
+def _raw_delete(queryset):
+    """Delete the rows with a single DELETE statement, without collecting them or sending signals""" # noqa
+    return queryset._raw_delete(queryset.db)
+
+
+class Command(BaseCommand):
+    """Move users whose rows are not on the shard of their id"""
+
+    help = "Move the recipes, tags, ingredients and details of users to the shard of their id" # noqa
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only report the users to move",
+        )
+        parser.add_argument(
+            "--source",
+            action="append",
+            metavar="ALIAS",
+            help="Database to move users off, repeatable (default: the default database and every shard)", # noqa
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Number of user ids read per query",
+        )
+
+    def handle(self, *args, **options):
+        """Default entry point for the command"""
+        sources = options["source"] or list(dict.fromkeys([DEFAULT_DB_ALIAS, *settings.DATABASE_SHARDS])) # noqa
+        for alias in sources:
+            if alias not in settings.DATABASES:
+                raise CommandError(f"Unknown database: {alias}")
+
+        self.finish_moves(options["dry_run"])
+
+        moved = rows = 0
+        for source in sources:
+            for user_id in self.misplaced_users(source, options["batch_size"]): # noqa
+                target = shard_for_user(user_id)
+                if options["dry_run"]:
+                    self.stdout.write(f"User {user_id}: {source} -> {target}")
+                else:
+                    rows += self.move_user(user_id, source, target)
+                moved += 1
+
+        if options["dry_run"]:
+            self.stdout.write(f"Found {moved} users to move")
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Moved {moved} users, {rows} rows")) # noqa
+
+    def misplaced_users(self, source, batch_size):
+        """Return the sorted ids of the users owning rows on source which belong on another shard""" # noqa
+        misplaced = set()
+        for model in OWNED_MODELS:
+            owners = model.objects.using(source).order_by("user_id").values_list("user_id", flat=True).distinct() # noqa
+            last = None
+            while True:
+                # Keyset pagination over the user_id index
+                chunk = owners if last is None else owners.filter(user_id__gt=last) # noqa
+                user_ids = list(chunk[:batch_size])
+                misplaced.update(
+                    user_id for user_id in user_ids
+                    if shard_for_user(user_id) != source
+                )
+                if len(user_ids) < batch_size:
+                    break
+                last = user_ids[-1]
+
+        return sorted(misplaced)
+
+    def finish_moves(self, dry_run):
+        """Delete the rows of users copied by an interrupted run from their source""" # noqa
+        for target in dict.fromkeys([DEFAULT_DB_ALIAS, *settings.DATABASE_SHARDS]): # noqa
+            for move in ShardMove.objects.using(target).order_by("pk"):
+                self.stdout.write(f"Finishing the move of user {move.user_id}: {move.source} -> {target}") # noqa
+                if not dry_run:
+                    self.delete_user(move.user_id, move.source)
+                    move.delete(using=target)
+
+    def move_user(self, user_id, source, target):
+        """Copy the rows of a user from source to target, then delete them from source. Returns the rows copied. # noqa
+        The copies keep their ids, as each database allocates them from its own range (core.routers.shard_id_start). # noqa
+        Rows the user created on target meanwhile are kept, including its details, which replace those of source""" # noqa
+        copied = 0
+        with transaction.atomic(using=target):
+            ids = {}
+            for model in OWNED_MODELS:
+                objs = list(model.objects.using(source).filter(user_id=user_id).order_by("pk")) # noqa
+                if model is UserDetails and UserDetails.objects.using(target).filter(user_id=user_id).exists(): # noqa
+                    objs = []  # One per user
+                model.objects.using(target).bulk_create(objs)
+                ids[model] = {obj.pk for obj in objs}
+                copied += len(objs)
+
+            for field, model, column in RECIPE_RELATIONS:
+                through = getattr(Recipe, field).through
+                links = through.objects.using(source).filter(
+                    recipe__user_id=user_id,
+                ).values_list("recipe_id", column)
+                objs = [
+                    through(recipe_id=recipe_id, **{column: related_id})
+                    for recipe_id, related_id in links
+                    # A link to a row of another user cannot follow the recipe # noqa
+                    if related_id in ids[model]
+                ]
+                through.objects.using(target).bulk_create(objs)
+                copied += len(objs)
+
+            Recipe.objects.db_manager(target).refresh_attrs_snapshots(ids[Recipe]) # noqa
+            ShardMove.objects.using(target).create(user_id=user_id, source=source) # noqa
+
+        self.delete_user(user_id, source)
+        ShardMove.objects.using(target).filter(user_id=user_id, source=source).delete() # noqa
+        return copied
+
+    def delete_user(self, user_id, source):
+        """Delete the rows of a user from source"""
+        with transaction.atomic(using=source):
+            for field, model, _ in RECIPE_RELATIONS:
+                through = getattr(Recipe, field).through
+                _raw_delete(through.objects.using(source).filter(
+                    Q(recipe__user_id=user_id)
+                    | Q(**{f"{model._meta.model_name}__user_id": user_id}),
+                ))
+            for model in OWNED_MODELS:
+                _raw_delete(model.objects.using(source).filter(user_id=user_id)) # noqa
+
+        invalidate_recipe_stats(user_id)
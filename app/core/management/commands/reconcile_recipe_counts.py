@@ -0,0 +1,69 @@
+"""
+Django command to repair drift in the denormalized Tag / Ingredient recipe counters. # noqa
+"""
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, Q
+
+from core.db import iterate_values
+from core.models import Tag, Ingredient
+from core.routers import all_shards
+
+
+class Command(BaseCommand):
+    """Recount recipe_count from the through tables and fix rows that drifted""" # noqa
+
+    help = "Recount Tag.recipe_count and Ingredient.recipe_count and repair drifted rows" # noqa
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only report drifted rows, do not update them",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Number of rows updated per transaction",
+        )
+
+    def handle(self, *args, **options):
+        """Default entry point for the command"""
+
+        for model in (Tag, Ingredient):
+            fixed = 0
+            # Each shard counts its own rows, see core/routers.py
+            for alias in all_shards():
+                # Only rows whose stored counter differs from the real count are returned (HAVING clause) # noqa
+                drifted = model.objects.using(alias).annotate(
+                    actual=Count("recipe"),
+                ).filter(
+                    ~Q(recipe_count=F("actual")),
+                )
+
+                batch = []
+                for pk, actual in iterate_values(drifted, "pk", "actual"):
+                    batch.append(model(pk=pk, recipe_count=actual))
+
+                    if len(batch) >= options["batch_size"]:
+                        fixed += self._save(model, batch, options["dry_run"], alias) # noqa
+                        batch = []
+
+                fixed += self._save(model, batch, options["dry_run"], alias)
+
+            verb = "Found" if options["dry_run"] else "Fixed"
+            self.stdout.write(
+                f"{verb} {fixed} drifted {model._meta.verbose_name} counters"
+            )
+
+        self.stdout.write(self.style.SUCCESS("Recipe counters reconciled!"))
+
+    def _save(self, model, batch, dry_run, alias):
+        """Write one batch of corrected counters to the database alias"""
+        if batch and not dry_run:
+            with transaction.atomic(using=alias):
+                model.objects.using(alias).bulk_update(batch, ["recipe_count"]) # noqa
+
+        return len(batch)
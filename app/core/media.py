@@ -0,0 +1,32 @@
+"""
+Responses for media files that need authorization.
+Behind nginx the view only authorizes the request and hands the transfer back with X-Accel-Redirect, so nginx sends the file with sendfile. # noqa
+Without nginx (development, tests) the file is streamed by Django.
+"""
+
+import mimetypes
+import os
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse
+
+
+def protected_media_response(path, content_type=None, open_file=None):
+    """Return a response sending the file at path, which must be inside MEDIA_ROOT. # noqa
+    open_file returns the file opened when Django streams it, e.g. retrying files evicted from a cache, by default open(path)""" # noqa
+    content_type = content_type or mimetypes.guess_type(path)[0] or 'application/octet-stream' # noqa
+
+    if settings.MEDIA_X_ACCEL_REDIRECT:
+        name = os.path.relpath(path, settings.MEDIA_ROOT)
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = quote(f'{settings.MEDIA_X_ACCEL_PREFIX}{name}') # noqa
+    else:
+        try:
+            file = open_file() if open_file else open(path, 'rb')
+        except FileNotFoundError:
+            raise Http404('The file no longer exists.')
+        response = FileResponse(file, content_type=content_type)
+
+    response['Cache-Control'] = 'private, max-age=3600'
+    return response
@@ -0,0 +1,62 @@
+"""
+Middleware for the core app.
+"""
+
+from django.conf import settings
+
+from core.routers import pin_to_primary, replica_request, shard_request
+
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+class ReplicaRoutingMiddleware:
+    """Let views opt the reads of GET requests into the read replicas with replica_actions, and pin users who write to the primary. # noqa
+    replica_actions names viewset actions, e.g. ('list', 'retrieve'), or handler methods of other views, e.g. ('get',)""" # noqa
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        try:
+            response = self.get_response(request)
+        finally:
+            token = getattr(request, '_replica_token', None)
+            if token is not None:
+                replica_request.reset(token)
+
+        user = getattr(request, 'user', None)
+        if (
+            settings.DATABASE_REPLICAS
+            and request.method not in SAFE_METHODS
+            and user is not None and user.is_authenticated
+            and response.status_code < 400
+        ):
+            pin_to_primary(user.pk)
+
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if request.method != 'GET' or not settings.DATABASE_REPLICAS:
+            return None
+
+        actions = getattr(view_func, 'actions', None)
+        name = actions.get('get') if actions else 'get'
+        if name in getattr(getattr(view_func, 'cls', None), 'replica_actions', ()): # noqa
+            request._replica_token = replica_request.set(request)
+        return None
+
+
+class ShardRoutingMiddleware:
+    """Let ShardRouter select the shard of the authenticated user of the request""" # noqa
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        # DRF authenticates in the view, the router reads request.user once it is set # noqa
+        token = shard_request.set(request)
+        try:
+            return self.get_response(request)
+        finally:
+            shard_request.reset(token)
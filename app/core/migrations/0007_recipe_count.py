@@ -0,0 +1,53 @@
+# Generated by Django 4.0.10 on 2026-10-19 08:23
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill_recipe_counts(apps, schema_editor):
+    """Count the recipes already using each tag and ingredient"""
+    Recipe = apps.get_model('core', 'Recipe')
+    db = schema_editor.connection.alias
+
+    for model_name, field in (('Tag', 'tags'), ('Ingredient', 'ingredients')):
+        model = apps.get_model('core', model_name)
+        through = getattr(Recipe, field).through
+        column = f'{model_name.lower()}_id'
+
+        counts = through.objects.using(db).filter(
+            **{column: OuterRef('pk')},
+        ).order_by().values(column).annotate(n=Count('id')).values('n')
+
+        model.objects.using(db).update(
+            recipe_count=Coalesce(Subquery(counts), Value(0)),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_userdetails'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ingredient',
+            name='recipe_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='tag',
+            name='recipe_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='ingredient',
+            index=models.Index(fields=['user', 'recipe_count'], name='core_ingred_user_id_de1121_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tag',
+            index=models.Index(fields=['user', 'recipe_count'], name='core_tag_user_id_699afc_idx'),
+        ),
+        migrations.RunPython(backfill_recipe_counts, migrations.RunPython.noop),
+    ]
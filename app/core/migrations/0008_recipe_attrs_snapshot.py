@@ -0,0 +1,18 @@
+# Generated by Django 4.0.10 on 2026-10-19 08:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_recipe_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='attrs_snapshot',
+            field=models.JSONField(blank=True, editable=False, null=True),
+        ),
+    ]
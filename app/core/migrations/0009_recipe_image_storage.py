@@ -0,0 +1,20 @@
+# Generated by Django 4.0.10 on 2026-10-19 08:33
+
+import core.models
+import core.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_recipe_attrs_snapshot'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='recipe',
+            name='image',
+            field=models.ImageField(db_index=True, null=True, storage=core.storage.recipe_image_storage, upload_to=core.models.recipe_image_file_path),
+        ),
+    ]
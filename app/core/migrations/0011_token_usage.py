@@ -0,0 +1,37 @@
+# Generated by Django 4.0.10 on 2026-10-19 08:58
+
+from django.db import migrations, models
+from django.utils import timezone
+import django.db.models.deletion
+
+
+def start_existing_tokens(apps, schema_editor):
+    """Count existing tokens as used now, so deploying expiry does not log everyone out at once""" # noqa
+    Token = apps.get_model('authtoken', 'Token')
+    TokenUsage = apps.get_model('core', 'TokenUsage')
+    now = timezone.now()
+    db = schema_editor.connection.alias
+
+    TokenUsage.objects.using(db).bulk_create(
+        (TokenUsage(token_id=key, last_used=now) for key in Token.objects.using(db).values_list('key', flat=True).iterator()), # noqa
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authtoken', '0003_tokenproxy'),
+        ('core', '0010_recipe_image_sizes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TokenUsage',
+            fields=[
+                ('token', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='usage', serialize=False, to='authtoken.token')),
+                ('last_used', models.DateTimeField(db_index=True)),
+            ],
+        ),
+        migrations.RunPython(start_existing_tokens, migrations.RunPython.noop),
+    ]
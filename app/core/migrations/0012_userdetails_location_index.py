@@ -0,0 +1,17 @@
+# Generated by Django 4.0.10 on 2026-10-19 09:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_token_usage'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='userdetails',
+            index=models.Index(fields=['country', 'city'], include=('age',), name='core_userdetails_location_idx'),
+        ),
+    ]
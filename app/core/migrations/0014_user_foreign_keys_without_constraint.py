@@ -0,0 +1,51 @@
+# Generated by Django 4.0.10 on 2026-10-19 09:25
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class AlterFieldOnShards(migrations.AlterField):
+    """AlterField changing the schema of the shards only.
+    The users live on the default database, so the shards cannot have constraints on them. # noqa
+    The default database holds both, and keeps its constraints.
+    Its schema no longer matches the model state, which records db_constraint=False for every database: # noqa
+    later migrations altering these fields must use AlterFieldOnShards too, or handle the constraints of the default database by hand""" # noqa
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state): # noqa
+        if schema_editor.connection.alias in settings.DATABASE_SHARDS:
+            super().database_forwards(app_label, schema_editor, from_state, to_state) # noqa
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state): # noqa
+        if schema_editor.connection.alias in settings.DATABASE_SHARDS:
+            super().database_backwards(app_label, schema_editor, from_state, to_state) # noqa
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_user_deleted_at'),
+    ]
+
+    operations = [
+        AlterFieldOnShards(
+            model_name='ingredient',
+            name='user',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        AlterFieldOnShards(
+            model_name='recipe',
+            name='user',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        AlterFieldOnShards(
+            model_name='tag',
+            name='user',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        AlterFieldOnShards(
+            model_name='userdetails',
+            name='user',
+            field=models.OneToOneField(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.0.10 on 2026-10-19 09:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_user_foreign_keys_without_constraint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShardMove',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_id', models.BigIntegerField()),
+                ('source', models.CharField(max_length=100)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='shardmove',
+            constraint=models.UniqueConstraint(fields=('user_id', 'source'), name='core_shardmove_user_source_uniq'),
+        ),
+    ]
@@ -2,15 +2,21 @@
 Database models for the core app
 """
 from django.conf import settings
-from django.db import models
+from django.db import connections, models, router
 from django.contrib.auth.models import (
     AbstractBaseUser,
     BaseUserManager,
     PermissionsMixin,
 )
 
+from rest_framework.authtoken.models import Token
+
+from core.routers import all_shards
+from core.storage import recipe_image_storage
+
 import uuid
 import os
+import time
 
 
 def recipe_image_file_path(instance, filename):
@@ -66,6 +72,8 @@ class User(AbstractBaseUser, PermissionsMixin):
     name = models.CharField(max_length=255)
     is_active = models.BooleanField(default=True)
     is_staff = models.BooleanField(default=False)
+    # Set when the account is being deleted, until core/accounts.py has removed its data # noqa
+    deleted_at = models.DateTimeField(null=True, blank=True, editable=False)
 
     objects = (
         UserManager()
@@ -74,17 +82,175 @@ class User(AbstractBaseUser, PermissionsMixin):
     USERNAME_FIELD = "email"
 
 
+class TokenUsage(models.Model):
+    """When an auth token was last used, for its sliding expiry. Written at most once per TOKEN_USAGE_INTERVAL, see core/authentication.py""" # noqa
+
+    token = models.OneToOneField(
+        Token,
+        primary_key=True,
+        on_delete=models.CASCADE,
+        related_name="usage",
+    )
+    # Indexed, as the purge_expired_tokens command selects stale tokens by it # noqa
+    last_used = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f'{self.token_id} - {self.last_used}'
+
+
+class ShardMove(models.Model):
+    """A user whose rows the rebalance_shards command copied to this database, and has yet to delete from source. # noqa
+    Written in the transaction of the copy, so a run interrupted before the delete finishes it instead of copying again""" # noqa
+
+    user_id = models.BigIntegerField()
+    source = models.CharField(max_length=100)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["user_id", "source"], name="core_shardmove_user_source_uniq"), # noqa
+        ]
+
+    def __str__(self):
+        return f'{self.user_id} - {self.source}'
+
+
+class UserDetailsManager(models.Manager):
+    """Manager writing the details of a user with one statement where the database allows it""" # noqa
+
+    def _write_db(self, user):
+        """Return the alias written for the details of a user. self.db is the read route, which may be a replica""" # noqa
+        return self._db or router.db_for_write(self.model, instance=user)
+
+    def _returning_supported(self, using):
+        connection = connections[using]
+        # PostgreSQL, and SQLite from 3.35, support both ON CONFLICT and RETURNING # noqa
+        return connection.vendor in ("postgresql", "sqlite") and connection.features.can_return_columns_from_insert # noqa
+
+    def _execute(self, using, sql, params):
+        """Run a statement returning one row of details on using, and return it as an instance or None""" # noqa
+        fields = self.model._meta.concrete_fields
+        with connections[using].cursor() as cursor:
+            cursor.execute(sql, params)
+            row = cursor.fetchone()
+        if row is None:
+            return None
+        return self.model.from_db(using, [field.attname for field in fields], row) # noqa
+
+    def upsert(self, user, **values):
+        """Create the details of a user, or update the given values of existing ones. Returns the details""" # noqa
+        using = self._write_db(user)
+        if not self._returning_supported(using):
+            return self.db_manager(using).update_or_create(user=user, defaults=values)[0] # noqa
+
+        connection = connections[using]
+        quote = connection.ops.quote_name
+        meta = self.model._meta
+        fields = [field for field in meta.concrete_fields if not field.primary_key] # noqa
+        updated = [field for field in fields if field.name in values]
+
+        row = {field: values.get(field.name, field.get_default()) for field in fields} # noqa
+        row[meta.get_field("user")] = user.pk
+
+        sql = "INSERT INTO {table} ({columns}) VALUES ({values}) ON CONFLICT ({user}) DO UPDATE SET {updates} RETURNING {returning}".format( # noqa
+            table=quote(meta.db_table),
+            columns=", ".join(quote(field.column) for field in fields),
+            values=", ".join(["%s"] * len(fields)),
+            user=quote(meta.get_field("user").column),
+            # Without values to update, the no-op assignment still makes RETURNING yield the existing row # noqa
+            updates=", ".join(f"{quote(field.column)} = EXCLUDED.{quote(field.column)}" for field in updated or [meta.get_field("user")]), # noqa
+            returning=", ".join(quote(field.column) for field in meta.concrete_fields), # noqa
+        )
+        params = [field.get_db_prep_save(value, connection) for field, value in row.items()] # noqa
+        return self._execute(using, sql, params)
+
+    def update_for_user(self, user, **values):
+        """Update the given values of a user's details. Returns the details, or None when the user has none""" # noqa
+        using = self._write_db(user)
+        if not values or not self._returning_supported(using):
+            details = self.db_manager(using).filter(user=user).first()
+            if details is not None and values:
+                for name, value in values.items():
+                    setattr(details, name, value)
+                details.save(update_fields=list(values))
+            return details
+
+        connection = connections[using]
+        quote = connection.ops.quote_name
+        meta = self.model._meta
+        updated = [meta.get_field(name) for name in values]
+
+        sql = "UPDATE {table} SET {updates} WHERE {user} = %s RETURNING {returning}".format( # noqa
+            table=quote(meta.db_table),
+            updates=", ".join(f"{quote(field.column)} = %s" for field in updated), # noqa
+            user=quote(meta.get_field("user").column),
+            returning=", ".join(quote(field.column) for field in meta.concrete_fields), # noqa
+        )
+        params = [field.get_db_prep_save(values[field.name], connection) for field in updated] # noqa
+        return self._execute(using, sql, params + [user.pk])
+
+
 class UserDetails(models.Model):
-    user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE) # One-to-one relationship with the User model # noqa
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        db_constraint=False,  # Only the default database has the constraint, the users are not on the shards, see migration 0014 # noqa
+    ) # One-to-one relationship with the User model # noqa
     age = models.IntegerField()
     country = models.CharField(max_length=100)
     city = models.CharField(max_length=100)
     favorite_food = models.CharField(max_length=100, blank=True)
 
+    objects = UserDetailsManager()
+
+    class Meta:
+        indexes = [
+            # Serves the GROUP BY country, city of the demographics. On PostgreSQL the age is included, so it is an index only scan # noqa
+            models.Index(
+                fields=["country", "city"],
+                include=["age"],
+                name="core_userdetails_location_idx",
+            ),
+        ]
+
     def __str__(self):
         return f'{self.user.email} - Details'
 
 
+class RecipeManager(models.Manager):
+    """Manager for recipes, maintaining the denormalized attrs_snapshot column""" # noqa
+
+    def build_attrs_snapshots(self, recipe_ids):
+        """Return {recipe_id: snapshot} built from the through tables, with one query per relation""" # noqa
+        snapshots = {pk: {"tags": [], "ingredients": []} for pk in recipe_ids}
+
+        for field, column in (("tags", "tag"), ("ingredients", "ingredient")):
+            rows = getattr(self.model, field).through.objects.using(self.db).filter( # noqa
+                recipe_id__in=snapshots,
+            ).values_list(
+                "recipe_id", f"{column}_id", f"{column}__name",
+            ).order_by(f"{column}_id")
+
+            for recipe_id, pk, name in rows:
+                snapshots[recipe_id][field].append({"id": pk, "name": name})
+
+        return snapshots
+
+    def refresh_attrs_snapshots(self, recipe_ids, batch_size=500):
+        """Rebuild the snapshot of the given recipes, in batches"""
+        recipe_ids = list(recipe_ids)
+
+        for start in range(0, len(recipe_ids), batch_size):
+            snapshots = self.build_attrs_snapshots(recipe_ids[start:start + batch_size]) # noqa
+            self.bulk_update(
+                [self.model(pk=pk, attrs_snapshot=snapshot) for pk, snapshot in snapshots.items()], # noqa
+                ["attrs_snapshot"],
+            )
+
+    def clear_attrs_snapshots(self, **filters):
+        """Mark snapshots as stale, so they are rendered from the relations until rebuilt""" # noqa
+        self.filter(**filters).update(attrs_snapshot=None)
+
+
 class Recipe(models.Model):
     """Recipe model based on Django's basic built-in models.Model class"""
 
@@ -92,6 +258,7 @@ class Recipe(models.Model):
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE,  # If the user is deleted, delete the recipe as well # noqa
+        db_constraint=False,  # Only the default database has the constraint, the users are not on the shards, see migration 0014 # noqa
     )
 
     title = models.CharField(max_length=255)
@@ -103,7 +270,37 @@ class Recipe(models.Model):
     tags = models.ManyToManyField("Tag")  # Many-to-many relationship with the Tag model. Many recipes can have many tags # noqa
     ingredients = models.ManyToManyField("Ingredient")  # Many-to-many relationship with the Ingredient model. Many recipes can have many ingredients # noqa
 
-    image = models.ImageField(null=True, upload_to=recipe_image_file_path) # Image name is generated by recipe_image_file_path function # noqa
+    # Stored by content hash, so identical images share one blob. The extension comes from recipe_image_file_path # noqa
+    # Indexed, as the references to a blob are counted from this column
+    image = models.ImageField(
+        null=True,
+        upload_to=recipe_image_file_path,
+        storage=recipe_image_storage,
+        db_index=True,
+    )
+
+    # Byte sizes of the image as uploaded and as stored after re-encoding (see recipe/uploads.py), to report the savings # noqa
+    image_original_size = models.PositiveIntegerField(null=True, blank=True, editable=False) # noqa
+    image_size = models.PositiveIntegerField(null=True, blank=True, editable=False) # noqa
+
+    # Read model of tags and ingredients as {"tags": [{id, name}], "ingredients": [{id, name}]}, NULL when stale # noqa
+    # Lets recipe lists render without joining the many-to-many tables
+    attrs_snapshot = models.JSONField(null=True, blank=True, editable=False)
+
+    objects = RecipeManager()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """Remember the image loaded from the database, to release it once replaced""" # noqa
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_image = instance.__dict__.get("image")
+        return instance
+
+    def refresh_attrs_snapshot(self):
+        """Rebuild the snapshot of this recipe"""
+        recipes = Recipe.objects.db_manager(self._state.db)
+        self.attrs_snapshot = recipes.build_attrs_snapshots([self.pk])[self.pk] # noqa
+        recipes.filter(pk=self.pk).update(attrs_snapshot=self.attrs_snapshot) # noqa
 
     def __str__(self):
         return self.title
@@ -117,8 +314,17 @@ class Tag(models.Model):
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE,  # If the user is deleted, delete the tag as well # noqa
+        db_constraint=False,  # Only the default database has the constraint, the users are not on the shards, see migration 0014 # noqa
     )
 
+    # Number of recipes using the tag. Maintained by core/signals.py, repaired by the reconcile_recipe_counts command # noqa
+    recipe_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'recipe_count']),
+        ]
+
     def __str__(self):
         return self.name
 
@@ -131,7 +337,39 @@ class Ingredient(models.Model):
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE,  # If the user is deleted, delete the ingredient as well # noqa
+        db_constraint=False,  # Only the default database has the constraint, the users are not on the shards, see migration 0014 # noqa
     )
 
+    # Number of recipes using the ingredient. Maintained by core/signals.py, repaired by the reconcile_recipe_counts command # noqa
+    recipe_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'recipe_count']),
+        ]
+
     def __str__(self):
         return self.name
+
+
+def release_recipe_image(name):
+    """Delete an image blob once no recipe references it anymore.
+    Blobs written or re-uploaded within the grace period are kept, as a concurrent # noqa
+    upload of the same bytes may not be committed yet"""
+    if not name:
+        return False
+    # Users of every shard may share the blob
+    if any(Recipe.objects.using(alias).filter(image=name).exists() for alias in all_shards()): # noqa
+        return False
+
+    storage = Recipe._meta.get_field("image").storage
+    try:
+        age = time.time() - os.path.getmtime(storage.path(name))
+    except FileNotFoundError:
+        return False
+
+    if age < settings.RECIPE_IMAGE_GRACE_SECONDS:
+        return False
+
+    storage.delete(name)
+    return True
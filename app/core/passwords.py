@@ -0,0 +1,103 @@
+"""
+Login path verifying passwords on a bounded pool of hashing threads, through HashingPoolBackend. # noqa
+hashlib releases the GIL while hashing, so the other request threads of a uWSGI worker keep serving while logins hash. # noqa
+Logins beyond the queue limit fail fast with 503 instead of piling up behind the pool. # noqa
+"""
+
+import threading
+from concurrent.futures import TimeoutError
+
+from django.conf import settings
+from django.contrib.auth import authenticate, get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.hashers import check_password, make_password
+from django.utils.translation import gettext_lazy as _
+
+from rest_framework import exceptions, status
+
+from core.executors import get_executor
+
+
+class LoginBusy(exceptions.APIException):
+    """Raised when too many password verifications are already queued"""
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = _('Too many logins in progress, retry shortly.')
+    default_code = 'login_busy'
+    wait = 1  # Sent as Retry-After
+
+
+_pending = 0
+_pending_lock = threading.Lock()
+
+
+def _release(future):
+    global _pending
+    with _pending_lock:
+        _pending -= 1
+
+
+def _verify(password, encoded):
+    """Check a password against its hash, returning (valid, new hash if the hasher or its parameters changed)""" # noqa
+    rehashed = []
+    valid = check_password(
+        password,
+        encoded,
+        setter=lambda raw: rehashed.append(make_password(raw)),
+    )
+    return valid, rehashed[0] if rehashed else None
+
+
+def _run_on_pool(fn, *args):
+    """Run fn on the hashing pool, unless its queue is full"""
+    global _pending
+    with _pending_lock:
+        if _pending >= settings.PASSWORD_HASH_MAX_QUEUE:
+            raise LoginBusy()
+        _pending += 1
+
+    executor = get_executor('password-hashing', settings.PASSWORD_HASH_WORKERS) # noqa
+    try:
+        future = executor.submit(fn, *args)
+    except BaseException:
+        _release(None)
+        raise
+    future.add_done_callback(_release)
+
+    try:
+        return future.result(timeout=settings.PASSWORD_HASH_TIMEOUT)
+    except TimeoutError:
+        raise LoginBusy()
+
+
+class HashingPoolBackend(ModelBackend):
+    """ModelBackend verifying passwords on the hashing pool. Hashes are upgraded on success""" # noqa
+
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        User = get_user_model()
+        if username is None:
+            username = kwargs.get(User.USERNAME_FIELD)
+        if username is None or password is None:
+            return None
+
+        try:
+            user = User._default_manager.get_by_natural_key(username)
+        except User.DoesNotExist:
+            # Hash anyway, so response times do not reveal which emails exist # noqa
+            _run_on_pool(make_password, password)
+            return None
+
+        valid, rehashed = _run_on_pool(_verify, password, user.password)
+        if not valid or not self.user_can_authenticate(user):
+            return None
+
+        if rehashed:
+            # Conditional, so a concurrent password change is never overwritten # noqa
+            User._default_manager.filter(pk=user.pk, password=user.password).update(password=rehashed) # noqa
+            user.password = rehashed
+
+        return user
+
+
+def authenticate_login(email, password, request=None):
+    """Return the active user with these credentials, or None. Goes through AUTHENTICATION_BACKENDS, which send user_login_failed""" # noqa
+    return authenticate(request, username=email, password=password)
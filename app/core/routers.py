@@ -0,0 +1,180 @@
+"""
+Database routers.
+ShardRouter places the rows owned by a user on a shard chosen by a hash of the user id. # noqa
+The users, their tokens and everything else stay on the default database, the directory. # noqa
+ReplicaRouter sends the reads of selected views to read replicas.
+ReplicaRoutingMiddleware (core/middleware.py) marks the requests whose reads may use a replica. # noqa
+Everything else, including all writes, reads outside requests and reads of users who wrote recently, uses the primary. # noqa
+"""
+
+import hashlib
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS
+from django.utils.functional import LazyObject
+
+
+# Models whose rows are owned by a user, by label_lower. The through tables follow their recipe # noqa
+SHARDED_MODELS = {
+    'core.recipe',
+    'core.recipe_tags',
+    'core.recipe_ingredients',
+    'core.tag',
+    'core.ingredient',
+    'core.userdetails',
+}
+
+# Each database allocates the ids of sharded rows from its own range, so rows keep their id when moved to another shard # noqa
+SHARD_ID_RANGE = 10 ** 12
+
+# The request being handled, whose authenticated user selects the shard
+shard_request = ContextVar('shard_request', default=None)
+# The user selected with use_shard_of(), e.g. in commands and background work # noqa
+shard_user = ContextVar('shard_user', default=None)
+
+
+class NoShardSelected(RuntimeError):
+    """Raised when sharded rows are queried without a user to select the shard""" # noqa
+
+
+def all_shards():
+    """Return the aliases of every database holding sharded rows, for work spanning all users""" # noqa
+    return list(settings.DATABASE_SHARDS) or [DEFAULT_DB_ALIAS]
+
+
+def shard_id_start(alias):
+    """Return the first id allocated for sharded rows on alias: 1 on the default database, (n + 1) * SHARD_ID_RANGE on shard n""" # noqa
+    if alias not in settings.DATABASE_SHARDS:
+        return 1
+    return (settings.DATABASE_SHARDS.index(alias) + 1) * SHARD_ID_RANGE
+
+
+def shard_for_user(user_id):
+    """Return the alias of the shard of a user: the shard with the highest hash of (shard, user). # noqa
+    Adding a shard only moves the users it now wins, about 1 / shards of them""" # noqa
+    if not settings.DATABASE_SHARDS:
+        return DEFAULT_DB_ALIAS
+
+    return max(
+        settings.DATABASE_SHARDS,
+        key=lambda alias: hashlib.blake2b(f'{alias}:{user_id}'.encode(), digest_size=8).digest(), # noqa
+    )
+
+
+@contextmanager
+def use_shard_of(user_id):
+    """Route the sharded queries without an instance to the shard of a user. Yields its alias""" # noqa
+    token = shard_user.set(user_id)
+    try:
+        yield shard_for_user(user_id)
+    finally:
+        shard_user.reset(token)
+
+
+def _current_user_id():
+    """Return the id of the user selected with use_shard_of(), else of the authenticated user of the request""" # noqa
+    user_id = shard_user.get()
+    if user_id is not None:
+        return user_id
+
+    request = shard_request.get()
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return user.pk
+    return None
+
+
+class ShardRouter:
+    """Route the models of SHARDED_MODELS to the shard of their user when DATABASE_SHARDS is set. # noqa
+    The shard comes from the instance of the hints, else from the current user. Other models are left to the next router""" # noqa
+
+    def _db_for(self, model, hints):
+        if not settings.DATABASE_SHARDS or model._meta.label_lower not in SHARDED_MODELS: # noqa
+            return None
+
+        instance = hints.get('instance')
+        if instance is not None:
+            # Loaded rows stay on their database. Related managers of a user pass the user # noqa
+            if instance._meta.label_lower in SHARDED_MODELS and instance._state.db: # noqa
+                return instance._state.db
+            user_id = instance.pk if isinstance(instance, get_user_model()) else getattr(instance, 'user_id', None) # noqa
+            if user_id is not None:
+                return shard_for_user(user_id)
+
+        user_id = _current_user_id()
+        if user_id is None:
+            # Guessing would read or write another user's shard. Work spanning users loops over all_shards() # noqa
+            raise NoShardSelected(
+                f'No user selects the shard of {model._meta.label}, use use_shard_of() or .using()' # noqa
+            )
+        return shard_for_user(user_id)
+
+    def db_for_read(self, model, **hints):
+        return self._db_for(model, hints)
+
+    def db_for_write(self, model, **hints):
+        return self._db_for(model, hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Shards get every table, so their schema follows the same migrations # noqa
+        if db in settings.DATABASE_SHARDS:
+            return True
+        return None
+
+
+# The request being handled, when its reads may go to a replica
+replica_request = ContextVar('replica_request', default=None)
+
+
+def _pin_key(user_id):
+    return f'replica-pin:{user_id}'
+
+
+def pin_to_primary(user_id):
+    """Send the reads of a user to the primary for DB_REPLICA_STICKY_SECONDS, so they see their own writes""" # noqa
+    caches[settings.DB_REPLICA_PIN_CACHE].set(_pin_key(user_id), True, settings.DB_REPLICA_STICKY_SECONDS) # noqa
+
+
+def _replica_allowed(request):
+    """Return whether the reads of the request may use a replica"""
+    # Only the user DRF set after authenticating counts. Until then request.user is the lazy session user of # noqa
+    # AuthenticationMiddleware: evaluating it here would load the session through this router again # noqa
+    user = request.__dict__.get('user')
+    # Before authentication, e.g. token lookups, and for session users, reads stay on the primary # noqa
+    if user is None or isinstance(user, LazyObject) or not user.is_authenticated: # noqa
+        return False
+
+    pinned = getattr(request, '_replica_pinned', None)
+    if pinned is None:
+        pinned = request._replica_pinned = bool(
+            caches[settings.DB_REPLICA_PIN_CACHE].get(_pin_key(user.pk))
+        )
+    return not pinned
+
+
+class ReplicaRouter:
+    """Route the reads of replica eligible requests to DATABASE_REPLICAS"""
+
+    def db_for_read(self, model, **hints):
+        request = replica_request.get()
+        if request is not None and settings.DATABASE_REPLICAS and _replica_allowed(request): # noqa
+            return random.choice(settings.DATABASE_REPLICAS)
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
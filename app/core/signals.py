@@ -0,0 +1,171 @@
+"""
+Signal handlers keeping denormalized columns of the core models in sync.
+Connected in CoreConfig.ready(), so every write path (API, admin, shell) maintains them. # noqa
+"""
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.db.models.signals import (
+    post_save,
+    pre_delete,
+    post_delete,
+    m2m_changed,
+    post_migrate,
+)
+from django.dispatch import receiver
+
+from rest_framework.authtoken.models import Token
+
+from core.accounts import delete_owned_rows
+from core.authentication import token_cache
+from core.db import reserve_id_range
+from core.models import (
+    Recipe,
+    Tag,
+    Ingredient,
+    User,
+    UserDetails,
+    release_recipe_image,
+)
+from core.routers import shard_id_start
+
+
+# Through table of each counted relation -> (counted model, its column in the through table) # noqa
+COUNTED_RELATIONS = {
+    Recipe.tags.through: (Tag, 'tag_id'),
+    Recipe.ingredients.through: (Ingredient, 'ingredient_id'),
+}
+
+
+def adjust_recipe_count(model, pks, delta, using):
+    """Atomically add delta to the recipe_count of the given rows on the database using""" # noqa
+    if delta == 0:
+        return
+
+    count = F('recipe_count') + delta
+    if delta < 0:
+        count = Greatest(count, 0)  # Never fail a write because of drift, the reconcile command repairs it # noqa
+
+    model.objects.using(using).filter(pk__in=pks).update(recipe_count=count)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def update_recipe_counts(sender, instance, action, reverse, pk_set, using, **kwargs): # noqa
+    """Keep Tag.recipe_count and Ingredient.recipe_count in sync with the through tables""" # noqa
+    model, column = COUNTED_RELATIONS[sender]
+
+    # Removals are counted before the rows are deleted, inside the same transaction as the delete # noqa
+    if not reverse:
+        # recipe.tags.add(...) / remove(...) / clear()
+        rows = sender.objects.using(using).filter(recipe_id=instance.pk)
+
+        if action == 'post_add':  # pk_set only holds the rows actually inserted # noqa
+            adjust_recipe_count(model, pk_set, 1, using)
+        elif action == 'pre_remove':
+            rows = rows.filter(**{f'{column}__in': pk_set})
+            adjust_recipe_count(model, rows.values(column), -1, using)
+        elif action == 'pre_clear':
+            adjust_recipe_count(model, rows.values(column), -1, using)
+    else:
+        # tag.recipe_set.add(...) / remove(...) / clear()
+        rows = sender.objects.using(using).filter(**{column: instance.pk})
+
+        if action == 'post_add':
+            adjust_recipe_count(model, [instance.pk], len(pk_set), using)
+        elif action == 'pre_remove':
+            adjust_recipe_count(model, [instance.pk], -rows.filter(recipe_id__in=pk_set).count(), using) # noqa
+        elif action == 'pre_clear':
+            adjust_recipe_count(model, [instance.pk], -rows.count(), using)
+
+
+@receiver(pre_delete, sender=Recipe)
+def release_recipe_counts(sender, instance, using, **kwargs):
+    """Decrement the counters of everything a deleted recipe used. Its through rows are removed without m2m_changed""" # noqa
+    for through, (model, column) in COUNTED_RELATIONS.items():
+        rows = through.objects.using(using).filter(recipe_id=instance.pk).values(column) # noqa
+        adjust_recipe_count(model, rows, -1, using)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def clear_snapshots_on_m2m_change(sender, instance, action, reverse, pk_set, using, **kwargs): # noqa
+    """Mark the snapshot of recipes whose tags or ingredients change as stale""" # noqa
+    recipes = Recipe.objects.db_manager(using)
+    if not reverse and action in ("post_add", "post_remove", "post_clear"):
+        instance.attrs_snapshot = None
+        recipes.clear_attrs_snapshots(pk=instance.pk)
+    elif reverse and action in ("post_add", "post_remove"):
+        recipes.clear_attrs_snapshots(pk__in=pk_set)
+    elif reverse and action == "pre_clear":
+        _, column = COUNTED_RELATIONS[sender]
+        recipes.clear_attrs_snapshots(
+            pk__in=sender.objects.using(using).filter(**{column: instance.pk}).values("recipe_id"), # noqa
+        )
+
+
+@receiver(post_save, sender=Tag)
+@receiver(pre_delete, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+@receiver(pre_delete, sender=Ingredient)
+def clear_snapshots_on_attr_write(sender, instance, using, **kwargs):
+    """Mark the snapshot of recipes using a renamed or deleted tag or ingredient as stale""" # noqa
+    if not kwargs.get("created"):
+        field = "tags" if sender is Tag else "ingredients"
+        Recipe.objects.db_manager(using).clear_attrs_snapshots(**{field: instance}) # noqa
+
+
+@receiver(post_save, sender=Recipe)
+def release_replaced_image(sender, instance, using, **kwargs):
+    """Release the previous image blob of a recipe once the new one is committed""" # noqa
+    previous = getattr(instance, "_loaded_image", None)
+    instance._loaded_image = instance.image.name
+
+    if previous and previous != instance.image.name:
+        transaction.on_commit(lambda: release_recipe_image(previous), using=using) # noqa
+
+
+@receiver(post_delete, sender=Recipe)
+def release_deleted_image(sender, instance, using, **kwargs):
+    """Release the image blob of a deleted recipe once the delete is committed""" # noqa
+    if instance.image:
+        name = instance.image.name
+        transaction.on_commit(lambda: release_recipe_image(name), using=using) # noqa
+
+
+def invalidate_tokens(keys):
+    """Drop cached tokens now, and again on commit, in case a concurrent request cached the old row meanwhile""" # noqa
+    token_cache.invalidate(*keys)
+    transaction.on_commit(lambda: token_cache.invalidate(*keys))
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_deleted_token(sender, instance, **kwargs):
+    """Stop authenticating with a deleted token"""
+    invalidate_tokens([instance.key])
+
+
+@receiver(post_save, sender=User)
+def invalidate_user_tokens(sender, instance, created, **kwargs):
+    """Drop the cached user of a changed user, e.g. deactivated or with a new password""" # noqa
+    if not created:
+        invalidate_tokens(list(
+            Token.objects.filter(user=instance).values_list('key', flat=True)
+        ))
+
+
+@receiver(pre_delete, sender=User)
+def delete_sharded_rows(sender, instance, **kwargs):
+    """Delete the rows of a deleted user from its shard. The cascade of the delete only reaches the default database""" # noqa
+    if settings.DATABASE_SHARDS:
+        delete_owned_rows(instance.pk)
+
+
+@receiver(post_migrate)
+def reserve_shard_ids(sender, using, **kwargs):
+    """Allocate the ids of new rows on a shard from its own range, so they never collide with the rows rebalance_shards moves there""" # noqa
+    if sender.label == 'core' and using in settings.DATABASE_SHARDS:
+        for model in (Recipe, Tag, Ingredient, UserDetails):
+            reserve_id_range(connections[using], model._meta.db_table, shard_id_start(using)) # noqa
@@ -0,0 +1,62 @@
+"""
+Content-addressable storage for uploaded files.
+Files are stored under the SHA-256 of their bytes, so identical uploads share a single blob on disk. # noqa
+"""
+
+import hashlib
+import os
+import tempfile
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+
+
+class ContentAddressableStorage(FileSystemStorage):
+    """File system storage naming every file after the SHA-256 of its content""" # noqa
+
+    prefix = "blobs"
+
+    def blob_name(self, digest, ext):
+        """Return the storage name of a blob, fanned out over two directory levels""" # noqa
+        return f"{self.prefix}/{digest[:2]}/{digest[2:4]}/{digest}{ext.lower()}" # noqa
+
+    def _save(self, name, content):
+        """Hash the content while writing it to a temporary file, then move it to its blob name""" # noqa
+        tmp_dir = self.path(os.path.join(self.prefix, "tmp"))
+        os.makedirs(tmp_dir, exist_ok=True)
+
+        digest = hashlib.sha256()
+        fd, tmp_path = tempfile.mkstemp(dir=tmp_dir)
+        try:
+            with os.fdopen(fd, "wb") as tmp:
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    tmp.write(chunk)
+
+            name = self.blob_name(digest.hexdigest(), os.path.splitext(name)[1]) # noqa
+            full_path = self.path(name)
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+
+            if os.path.exists(full_path):
+                # Duplicate upload. Refresh the mtime, so the blob is not released as old and unused # noqa
+                os.utime(full_path)
+                os.unlink(tmp_path)
+            else:
+                if self.file_permissions_mode is not None:
+                    os.chmod(tmp_path, self.file_permissions_mode)
+                os.replace(tmp_path, full_path)  # Atomic, concurrent writers of the same blob write the same bytes # noqa
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+        return name
+
+    def get_available_name(self, name, max_length=None):
+        """Names are derived from the content in _save, so existing names are never a conflict""" # noqa
+        return name
+
+
+def recipe_image_storage():
+    """Storage of Recipe.image. A callable, so migrations do not serialize the storage instance""" # noqa
+    return ContentAddressableStorage(base_url=settings.RECIPE_IMAGE_URL)
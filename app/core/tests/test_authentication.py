@@ -0,0 +1,158 @@
+"""
+Test the cached token authentication
+"""
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from core.authentication import _digest, token_cache
+
+
+ME_URL = reverse('user:me')
+STATS_URL = reverse('auth_cache_stats')
+
+
+class CachedTokenAuthenticationTests(TestCase):
+    """Test tokens are looked up from the cache and invalidated"""
+
+    def setUp(self):
+        token_cache.clear()
+        cache.clear()
+        self.user = get_user_model().objects.create_user(
+            email='user@example.com',
+            password='password123',
+            name='Test User',
+        )
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def test_cached_lookup_skips_database(self):
+        """Test repeated requests authenticate without a query"""
+        with self.assertNumQueries(1):
+            res = self.client.get(ME_URL)
+        with self.assertNumQueries(0):
+            cached = self.client.get(ME_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(cached.data, res.data)
+        self.assertEqual(token_cache.stats()['hits'], 1)
+
+    def test_deleted_token_rejected(self):
+        """Test a deleted token stops authenticating at once"""
+        self.client.get(ME_URL)
+
+        self.token.delete()
+        res = self.client.get(ME_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_deactivated_user_rejected(self):
+        """Test deactivating a user invalidates the cached entry"""
+        self.client.get(ME_URL)
+
+        self.user.is_active = False
+        self.user.save()
+        res = self.client.get(ME_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_stale_entry_rejects_writes(self):
+        """Test a worker still caching a deactivated user only lets it read until the TTL""" # noqa
+        self.client.get(ME_URL)
+        # Without signals, as for the cache of another worker
+        get_user_model().objects.filter(pk=self.user.pk).update(is_active=False) # noqa
+
+        self.assertEqual(self.client.get(ME_URL).status_code, status.HTTP_200_OK) # noqa
+        res = self.client.patch(ME_URL, {'name': 'New Name'})
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.name, 'Test User')
+        self.assertEqual(self.client.get(ME_URL).status_code, status.HTTP_401_UNAUTHORIZED) # noqa
+
+    def test_password_change_invalidates(self):
+        """Test changing the password drops the cached user"""
+        self.client.get(ME_URL)
+
+        self.user.set_password('newpassword123')
+        self.user.save()
+        self.client.get(ME_URL)
+
+        self.assertEqual(token_cache.stats()['misses'], 2)
+
+    def test_profile_update_not_stale(self):
+        """Test updates of the user are visible to later requests"""
+        self.client.get(ME_URL)
+
+        self.client.patch(ME_URL, {'name': 'New Name'})
+        res = self.client.get(ME_URL)
+
+        self.assertEqual(res.data['name'], 'New Name')
+
+    @override_settings(TOKEN_AUTH_CACHE_SIZE=1)
+    def test_size_is_bounded(self):
+        """Test the least recently used tokens are evicted"""
+        other = get_user_model().objects.create_user(
+            email='other@example.com',
+            password='password123',
+        )
+        other_client = APIClient()
+        other_client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=other).key}') # noqa
+
+        self.client.get(ME_URL)
+        other_client.get(ME_URL)
+        self.client.get(ME_URL)
+
+        self.assertEqual(token_cache.stats()['size'], 1)
+        self.assertEqual(token_cache.stats()['misses'], 3)
+
+    @override_settings(TOKEN_AUTH_CACHE_TTL=0)
+    def test_entries_expire(self):
+        """Test entries are not used past their TTL"""
+        self.client.get(ME_URL)
+        self.client.get(ME_URL)
+
+        self.assertEqual(token_cache.stats()['hits'], 0)
+
+    @override_settings(TOKEN_AUTH_SHARED_CACHE='default')
+    def test_shared_cache(self):
+        """Test workers without a local entry use the shared cache"""
+        self.client.get(ME_URL)
+        token_cache.clear()  # As seen by another worker
+
+        with self.assertNumQueries(0):
+            res = self.client.get(ME_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(token_cache.stats()['shared_hits'], 1)
+
+    @override_settings(TOKEN_AUTH_SHARED_CACHE='default')
+    def test_password_not_cached(self):
+        """Test the password hash is left out of the cached user"""
+        self.client.get(ME_URL)
+        token_cache.clear()
+
+        row = cache.get(f'auth-token:3:{_digest(self.token.key)}')
+        self.assertNotIn(self.user.password, row[2])
+        res = self.client.get(ME_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(token_cache.stats()['shared_hits'], 1)
+
+    def test_stats_admin_only(self):
+        """Test the counters are only exposed to staff users"""
+        res = self.client.get(STATS_URL)
+        self.assertEqual(res.status_code, status.HTTP_403_FORBIDDEN)
+
+        self.user.is_staff = True
+        self.user.save()
+        res = self.client.get(STATS_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertIn('hit_rate', res.data)
@@ -0,0 +1,73 @@
+"""
+Test the database connection helpers
+"""
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.db.backends.postgresql import base
+from django.test import SimpleTestCase, TestCase
+
+from core.backends.postgresql.base import DatabaseWrapper
+from core.db import iterate_values
+from core.models import Tag
+
+
+class HealthCheckTests(SimpleTestCase):
+    """Test reused connections are checked once per request, before their first query""" # noqa
+
+    def wrapper(self, usable, health_checks=True):
+        wrapper = DatabaseWrapper({**connection.settings_dict, 'CONN_HEALTH_CHECKS': health_checks}) # noqa
+        wrapper.connection = mock.Mock()
+        wrapper.is_usable = mock.Mock(return_value=usable)
+        wrapper.close = mock.Mock()
+        return wrapper
+
+    def test_checked_once_per_request(self):
+        """Test a reused connection is checked on its first use in a request only""" # noqa
+        wrapper = self.wrapper(usable=True)
+        with mock.patch.object(base.DatabaseWrapper, 'close_if_unusable_or_obsolete'): # noqa
+            wrapper.close_if_unusable_or_obsolete()  # Request started
+
+        wrapper.is_usable.assert_not_called()
+        wrapper.close_if_health_check_failed()
+        wrapper.close_if_health_check_failed()
+
+        wrapper.is_usable.assert_called_once_with()
+        wrapper.close.assert_not_called()
+
+    def test_unusable_closed(self):
+        """Test a connection that stopped answering is closed before use"""
+        wrapper = self.wrapper(usable=False)
+
+        wrapper.close_if_health_check_failed()
+
+        wrapper.close.assert_called_once_with()
+
+    def test_disabled(self):
+        """Test connections are not checked without CONN_HEALTH_CHECKS"""
+        wrapper = self.wrapper(usable=False, health_checks=False)
+
+        wrapper.close_if_health_check_failed()
+
+        wrapper.is_usable.assert_not_called()
+        wrapper.close.assert_not_called()
+
+
+class IterateValuesTests(TestCase):
+    """Test streaming rows without a server side cursor"""
+
+    def test_all_rows_in_chunks(self):
+        """Test every row is yielded once, with one query per chunk"""
+        user = get_user_model().objects.create_user(email='user@example.com', password='testpass123') # noqa
+        for i in range(5):
+            Tag.objects.create(user=user, name=f'Tag {i}')
+
+        with self.assertNumQueries(3):
+            names = list(iterate_values(Tag.objects.all(), 'name', chunk_size=2)) # noqa
+
+        self.assertEqual(names, [f'Tag {i}' for i in range(5)])
+        self.assertEqual(
+            list(iterate_values(Tag.objects.filter(name='Tag 1'), 'name', 'user_id')), # noqa
+            [('Tag 1', user.id)],
+        )
@@ -0,0 +1,93 @@
+"""
+Test the collect_orphaned_images command
+"""
+from decimal import Decimal
+from io import StringIO
+import os
+import shutil
+import tempfile
+
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+from core.models import Recipe
+
+
+class CollectOrphanedImagesTests(TestCase):
+    """Test unreferenced image files are swept from the media volume"""
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(
+            MEDIA_ROOT=self.media_root,
+            RECIPE_IMAGE_GRACE_SECONDS=3600,
+        )
+        self.settings_override.enable()
+        self.user = get_user_model().objects.create_user(
+            email='test@example.com',
+            password='password123',
+        )
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root)
+
+    def create_file(self, name, old=True):
+        """Write a file under MEDIA_ROOT, dated back past the grace period"""
+        path = os.path.join(self.media_root, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(b'image bytes')
+        if old:
+            os.utime(path, (0, 0))
+        return path
+
+    def create_recipe(self, content):
+        recipe = Recipe(
+            user=self.user,
+            title='Sample recipe',
+            time_minutes=10,
+            price=Decimal('5.00'),
+        )
+        recipe.image.save('photo.jpg', ContentFile(content))
+        os.utime(recipe.image.path, (0, 0))
+        return recipe
+
+    def collect(self, *args):
+        out = StringIO()
+        call_command('collect_orphaned_images', '--sleep', '0', *args, stdout=out) # noqa
+        return out.getvalue()
+
+    def test_orphans_deleted(self):
+        """Test old unreferenced files are deleted and referenced ones kept"""
+        recipe = self.create_recipe(b'referenced')
+        orphan_blob = self.create_file('blobs/ab/cd/abcd.jpg')
+        legacy_upload = self.create_file('uploads/recipe/old.jpg')
+
+        out = self.collect('--batch-size', '1')
+
+        self.assertTrue(os.path.exists(recipe.image.path))
+        self.assertFalse(os.path.exists(orphan_blob))
+        self.assertFalse(os.path.exists(legacy_upload))
+        self.assertIn('Deleted 2 orphaned images', out)
+
+    def test_recent_and_unrelated_files_kept(self):
+        """Test files within the grace period and outside the image directories are kept""" # noqa
+        recent = self.create_file('blobs/ab/cd/recent.jpg', old=False)
+        variant = self.create_file('cache/variants/ab/variant.jpg')
+
+        self.collect()
+
+        self.assertTrue(os.path.exists(recent))
+        self.assertTrue(os.path.exists(variant))
+
+    def test_dry_run(self):
+        """Test a dry run only reports the orphans"""
+        orphan = self.create_file('blobs/ab/cd/abcd.jpg')
+
+        out = self.collect('--dry-run')
+
+        self.assertTrue(os.path.exists(orphan))
+        self.assertIn('Found 1 orphaned images', out)
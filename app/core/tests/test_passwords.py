@@ -0,0 +1,101 @@
+"""
+Test the login path and the tunable password hashers
+"""
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.signals import user_login_failed
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.passwords import authenticate_login
+
+
+TOKEN_URL = reverse('user:token')
+
+
+class LoginTests(TestCase):
+    """Test logins verify passwords on the hashing pool"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            email='user@example.com',
+            password='testpass123',
+        )
+
+    def login(self, password='testpass123'):
+        return self.client.post(TOKEN_URL, {
+            'email': 'user@example.com',
+            'password': password,
+        })
+
+    def test_login(self):
+        """Test valid credentials return a token, invalid ones do not"""
+        self.assertEqual(self.login().status_code, status.HTTP_200_OK)
+        self.assertEqual(self.login('wrong').status_code, status.HTTP_400_BAD_REQUEST) # noqa
+        self.assertIsNone(authenticate_login('nobody@example.com', 'testpass123')) # noqa
+
+    def test_inactive_user(self):
+        """Test inactive users cannot log in"""
+        self.user.is_active = False
+        self.user.save()
+
+        self.assertIsNone(authenticate_login('user@example.com', 'testpass123')) # noqa
+
+    def test_failed_login_signal(self):
+        """Test failed logins send user_login_failed, e.g. for lockout apps""" # noqa
+        handler = mock.Mock()
+        user_login_failed.connect(handler)
+        self.addCleanup(user_login_failed.disconnect, handler)
+
+        self.login('wrong')
+
+        handler.assert_called_once()
+        self.assertEqual(handler.call_args.kwargs['credentials']['username'], 'user@example.com') # noqa
+
+    @override_settings(AUTHENTICATION_BACKENDS=['django.contrib.auth.backends.AllowAllUsersModelBackend']) # noqa
+    def test_configured_backends(self):
+        """Test logins go through AUTHENTICATION_BACKENDS"""
+        self.user.is_active = False
+        self.user.save()
+
+        self.assertEqual(authenticate_login('user@example.com', 'testpass123'), self.user) # noqa
+
+    @override_settings(PASSWORD_HASHERS=[
+        'core.hashers.ScryptPasswordHasher',
+        'core.hashers.PBKDF2PasswordHasher',
+    ])
+    def test_rehash_to_preferred_hasher(self):
+        """Test hashes of another hasher are replaced on login"""
+        self.assertTrue(self.user.password.startswith('pbkdf2_sha256$'))
+
+        self.assertEqual(self.login().status_code, status.HTTP_200_OK)
+
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.password.startswith('scrypt$16384$'))
+        self.assertTrue(self.user.check_password('testpass123'))
+
+    def test_rehash_on_parameter_change(self):
+        """Test hashes are upgraded once the hasher parameters change"""
+        with override_settings(PBKDF2_ITERATIONS=1000):
+            self.user.set_password('testpass123')
+            self.user.save()
+        self.assertIn('$1000$', self.user.password)
+
+        with override_settings(PBKDF2_ITERATIONS=2000):
+            self.assertEqual(self.login().status_code, status.HTTP_200_OK)
+
+        self.user.refresh_from_db()
+        self.assertIn('$2000$', self.user.password)
+
+    def test_rejected_when_queue_full(self):
+        """Test logins fail fast with 503 when the hashing queue is full"""
+        with override_settings(PASSWORD_HASH_MAX_QUEUE=0):
+            res = self.login()
+
+        self.assertEqual(res.status_code, status.HTTP_503_SERVICE_UNAVAILABLE) # noqa
+        self.assertEqual(res['Retry-After'], '1')
@@ -0,0 +1,112 @@
+"""
+Test the provision_users command
+"""
+import csv
+import json
+import os
+import tempfile
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase
+
+from rest_framework.authtoken.models import Token
+
+from core.models import UserDetails
+
+
+class ProvisionUsersTests(TestCase):
+    """Test bulk creating users from files"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def write(self, name, content):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def provision(self, path, **options):
+        out = StringIO()
+        call_command('provision_users', path, stdout=out, stderr=StringIO(), **options) # noqa
+        return out.getvalue()
+
+    def test_csv(self):
+        """Test users and details are created from a CSV file"""
+        path = self.write('users.csv', (
+            'email,password,name,age,country,city\n'
+            'one@example.com,pass12345,One,30,Country,City\n'
+            'two@EXAMPLE.com,pass67890,Two,,,\n'
+        ))
+
+        out = self.provision(path, workers=2, chunk_size=1)
+
+        self.assertIn('Created 2 users, skipped 0', out)
+        self.assertIn('rows per second', out)
+        one = get_user_model().objects.get(email='one@example.com')
+        self.assertEqual(one.name, 'One')
+        self.assertTrue(one.check_password('pass12345'))
+        self.assertEqual(UserDetails.objects.get(user=one).age, 30)
+        two = get_user_model().objects.get(email='two@example.com')
+        self.assertTrue(two.check_password('pass67890'))
+        self.assertFalse(UserDetails.objects.filter(user=two).exists())
+
+    def test_ndjson_with_tokens(self):
+        """Test NDJSON files are read and tokens are written out"""
+        path = self.write('users.ndjson', '\n'.join(json.dumps(row) for row in [ # noqa
+            {'email': f'user{i}@example.com', 'password': 'pass12345'}
+            for i in range(5)
+        ]))
+        tokens = os.path.join(self.directory, 'tokens.csv')
+
+        out = self.provision(path, workers=0, chunk_size=2, tokens=tokens)
+
+        self.assertIn('Created 5 users', out)
+        with open(tokens) as f:
+            rows = dict(csv.reader(f))
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(Token.objects.get(key=rows['user3@example.com']).user.email, 'user3@example.com') # noqa
+
+    def test_skips_existing_and_duplicates(self):
+        """Test emails already present in the database or the file are skipped""" # noqa
+        get_user_model().objects.create_user(email='one@example.com', password='old12345') # noqa
+        path = self.write('users.csv', (
+            'email,password\n'
+            'one@example.com,new12345\n'
+            'two@example.com,pass12345\n'
+            'two@example.com,pass67890\n'
+        ))
+
+        out = self.provision(path, workers=0)
+
+        self.assertIn('Created 1 users, skipped 2', out)
+        self.assertTrue(get_user_model().objects.get(email='one@example.com').check_password('old12345')) # noqa
+        self.assertTrue(get_user_model().objects.get(email='two@example.com').check_password('pass12345')) # noqa
+
+    def test_invalid_rows_skipped(self):
+        """Test invalid rows are reported and skipped, whatever their chunk, while the valid rows are created""" # noqa
+        path = self.write('users.ndjson', '\n'.join([
+            json.dumps({'email': 'one@example.com', 'password': 'pass12345'}), # noqa
+            json.dumps({'email': 'two@example.com', 'password': 'pass12345', 'age': 'thirty', 'country': 'Country'}), # noqa
+            '{not json',
+            json.dumps({'password': 'pass12345'}),
+            json.dumps({'email': 'three@example.com', 'password': 'pass12345', 'age': '40', 'country': 'Country'}), # noqa
+        ]))
+        err = StringIO()
+
+        call_command('provision_users', path, workers=0, chunk_size=1, stdout=StringIO(), stderr=err) # noqa
+
+        self.assertEqual(err.getvalue().splitlines(), [
+            "Skipping line 2: invalid age 'thirty'",
+            'Skipping line 3: not a JSON object',
+            'Skipping line 4: no email',
+        ])
+        self.assertEqual(
+            set(get_user_model().objects.values_list('email', flat=True)),
+            {'one@example.com', 'three@example.com'},
+        )
+        self.assertEqual(UserDetails.objects.get().age, 40)
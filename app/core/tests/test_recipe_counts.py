@@ -0,0 +1,111 @@
+"""
+Test the denormalized recipe counters on tags and ingredients
+"""
+from decimal import Decimal
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase
+
+from core.models import Recipe, Tag, Ingredient
+
+
+def create_recipe(user, **params):
+    """Create and return a sample recipe"""
+    defaults = {
+        'title': 'Sample recipe',
+        'time_minutes': 10,
+        'price': Decimal('5.00'),
+    }
+    defaults.update(params)
+
+    return Recipe.objects.create(user=user, **defaults)
+
+
+class RecipeCountTests(TestCase):
+    """Test recipe_count is maintained by every through table write"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            email='test@example.com',
+            password='password123',
+        )
+        self.tag = Tag.objects.create(user=self.user, name='Vegan')
+        self.ingredient = Ingredient.objects.create(user=self.user, name='Salt') # noqa
+
+    def assertCounts(self, tag_count, ingredient_count):
+        self.tag.refresh_from_db()
+        self.ingredient.refresh_from_db()
+        self.assertEqual(self.tag.recipe_count, tag_count)
+        self.assertEqual(self.ingredient.recipe_count, ingredient_count)
+
+    def test_add_and_remove(self):
+        """Test adding and removing increments and decrements the counters"""
+        r1 = create_recipe(user=self.user)
+        r2 = create_recipe(user=self.user)
+
+        r1.tags.add(self.tag)
+        r2.tags.add(self.tag)
+        r1.tags.add(self.tag)  # Already assigned, not counted twice
+        r1.ingredients.add(self.ingredient)
+        self.assertCounts(2, 1)
+
+        r1.tags.remove(self.tag)
+        r1.ingredients.remove(self.ingredient)
+        r1.ingredients.remove(self.ingredient)  # Not assigned anymore, not counted twice # noqa
+        self.assertCounts(1, 0)
+
+    def test_clear(self):
+        """Test clearing a recipe decrements the counters"""
+        recipe = create_recipe(user=self.user)
+        recipe.tags.add(self.tag)
+        recipe.ingredients.add(self.ingredient)
+
+        recipe.tags.clear()
+        recipe.ingredients.clear()
+
+        self.assertCounts(0, 0)
+
+    def test_reverse_relation(self):
+        """Test writes from the tag side of the relation are counted"""
+        r1 = create_recipe(user=self.user)
+        r2 = create_recipe(user=self.user)
+
+        self.tag.recipe_set.add(r1, r2)
+        self.assertCounts(2, 0)
+
+        self.tag.recipe_set.remove(r1)
+        self.assertCounts(1, 0)
+
+        self.tag.recipe_set.clear()
+        self.assertCounts(0, 0)
+
+    def test_delete_recipe(self):
+        """Test deleting recipes releases their tags and ingredients"""
+        r1 = create_recipe(user=self.user)
+        r2 = create_recipe(user=self.user)
+        for recipe in (r1, r2):
+            recipe.tags.add(self.tag)
+            recipe.ingredients.add(self.ingredient)
+
+        r1.delete()
+        self.assertCounts(1, 1)
+
+        Recipe.objects.filter(user=self.user).delete()
+        self.assertCounts(0, 0)
+
+    def test_reconcile_command(self):
+        """Test the reconcile command repairs drifted counters"""
+        recipe = create_recipe(user=self.user)
+        recipe.tags.add(self.tag)
+        Tag.objects.filter(pk=self.tag.pk).update(recipe_count=7)
+        Ingredient.objects.filter(pk=self.ingredient.pk).update(recipe_count=3) # noqa
+
+        out = StringIO()
+        call_command('reconcile_recipe_counts', '--dry-run', stdout=out)
+        self.assertIn('Found 1 drifted tag counters', out.getvalue())
+        self.assertCounts(7, 3)
+
+        call_command('reconcile_recipe_counts', stdout=StringIO())
+        self.assertCounts(1, 0)
@@ -0,0 +1,95 @@
+"""
+Test the denormalized tags / ingredients snapshot on recipes
+"""
+from decimal import Decimal
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase
+
+from core.models import Recipe, Tag, Ingredient
+from recipe.serializers import RecipeSerializer
+
+
+def create_recipe(user, **params):
+    """Create and return a sample recipe"""
+    defaults = {
+        'title': 'Sample recipe',
+        'time_minutes': 10,
+        'price': Decimal('5.00'),
+    }
+    defaults.update(params)
+
+    return Recipe.objects.create(user=user, **defaults)
+
+
+class RecipeSnapshotTests(TestCase):
+    """Test building, invalidating and checking recipe snapshots"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            email='test@example.com',
+            password='password123',
+        )
+        self.recipe = create_recipe(user=self.user)
+        self.tag = Tag.objects.create(user=self.user, name='Vegan')
+        self.ingredient = Ingredient.objects.create(user=self.user, name='Tofu') # noqa
+        self.recipe.tags.add(self.tag)
+        self.recipe.ingredients.add(self.ingredient)
+
+    def test_refresh_snapshot(self):
+        """Test the snapshot lists the tags and ingredients of the recipe"""
+        self.recipe.refresh_attrs_snapshot()
+        self.recipe.refresh_from_db()
+
+        self.assertEqual(self.recipe.attrs_snapshot, {
+            'tags': [{'id': self.tag.id, 'name': 'Vegan'}],
+            'ingredients': [{'id': self.ingredient.id, 'name': 'Tofu'}],
+        })
+
+    def test_relation_changes_clear_snapshot(self):
+        """Test direct writes to the relations mark the snapshot as stale"""
+        self.recipe.refresh_attrs_snapshot()
+        self.recipe.tags.remove(self.tag)
+        self.recipe.refresh_from_db()
+        self.assertIsNone(self.recipe.attrs_snapshot)
+
+        self.recipe.refresh_attrs_snapshot()
+        self.ingredient.name = 'Silken tofu'
+        self.ingredient.save()
+        self.recipe.refresh_from_db()
+        self.assertIsNone(self.recipe.attrs_snapshot)
+
+    def test_update_keeps_cleared_snapshot(self):
+        """Test updating a recipe loaded before its snapshot was cleared does not write the stale snapshot back""" # noqa
+        self.recipe.refresh_attrs_snapshot()
+        loaded = Recipe.objects.get(pk=self.recipe.pk)
+        self.tag.name = 'Vegetarian'
+        self.tag.save()
+
+        serializer = RecipeSerializer(loaded, data={'title': 'New title'}, partial=True) # noqa
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.title, 'New title')
+        self.assertIsNone(self.recipe.attrs_snapshot)
+
+    def test_check_command(self):
+        """Test the check command reports and rebuilds bad snapshots"""
+        other = create_recipe(user=self.user)
+        other.refresh_attrs_snapshot()
+        Recipe.objects.filter(pk=other.pk).update(
+            attrs_snapshot={'tags': [{'id': 0, 'name': 'Ghost'}], 'ingredients': []}, # noqa
+        )
+
+        out = StringIO()
+        call_command('check_recipe_snapshots', stdout=out)
+        self.assertIn('Checked 2 recipes: 1 missing, 1 inconsistent', out.getvalue()) # noqa
+
+        call_command('check_recipe_snapshots', '--fix', stdout=StringIO())
+        other.refresh_from_db()
+        self.recipe.refresh_from_db()
+        self.assertEqual(other.attrs_snapshot, {'tags': [], 'ingredients': []}) # noqa
+        self.assertEqual(self.recipe.attrs_snapshot['tags'][0]['name'], 'Vegan') # noqa
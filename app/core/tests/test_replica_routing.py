@@ -0,0 +1,164 @@
+"""
+Test the routing of reads to the read replicas
+"""
+from unittest import mock, skipIf
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.db import connections
+from django.test import RequestFactory, TransactionTestCase, override_settings # noqa
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from core import routers
+from core.models import Tag, UserDetails
+
+
+RECIPES_URL = reverse('recipe:recipe-list')
+TAGS_URL = reverse('recipe:tag-list')
+PROFILE_URL = reverse('user:me_profile')
+
+# Run this module with DB_REPLICA_HOSTS set to read through a second alias, a test mirror of default, e.g. DB_REPLICA_HOSTS=db # noqa
+REPLICA = (settings.DATABASE_REPLICAS or ['default'])[0]
+
+
+@override_settings(DATABASE_REPLICAS=[REPLICA], DB_REPLICA_PIN_CACHE='default') # noqa
+class ReplicaRoutingTests(TransactionTestCase):
+    """Test which database the reads of requests use.
+    Committing, as a replica connection cannot see the open transaction of a TestCase""" # noqa
+
+    databases = {'default', *settings.DATABASE_REPLICAS}
+
+    def setUp(self):
+        caches['default'].clear()
+        self.user = get_user_model().objects.create_user(
+            email='user@example.com',
+            password='testpass123',
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+        patcher = mock.patch('core.routers.random.choice', wraps=routers.random.choice) # noqa
+        self.choice = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def reads_on(self, alias, func):
+        """Return the SQL of the SELECT statements run on alias by func""" # noqa
+        with CaptureQueriesContext(connections[alias]) as queries:
+            func()
+        return ' '.join(
+            query['sql'] for query in queries.captured_queries
+            if query['sql'].lstrip().upper().startswith('SELECT')
+        )
+
+    def test_reads_use_replica(self):
+        """Test GET on the opted in views reads from a replica"""
+        for url, table in ((RECIPES_URL, 'core_recipe'), (TAGS_URL, 'core_tag'), (PROFILE_URL, 'core_userdetails')): # noqa
+            self.choice.reset_mock()
+
+            sql = self.reads_on(REPLICA, lambda: self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)) # noqa
+
+            self.choice.assert_called_with([REPLICA])
+            self.assertIn(table, sql)
+
+    @skipIf(REPLICA == 'default', 'Needs a replica in DB_REPLICA_HOSTS')
+    def test_replica_connection(self):
+        """Test the reads of opted in views run on the replica connection, and the writes on the primary one""" # noqa
+        Tag.objects.create(user=self.user, name='Vegan')
+
+        self.assertNotIn('core_tag', self.reads_on('default', lambda: self.client.get(TAGS_URL))) # noqa
+        self.assertNotIn('core_recipe', self.reads_on(REPLICA, lambda: self.client.post(RECIPES_URL, { # noqa
+            'title': 'Sample recipe',
+            'time_minutes': 5,
+            'price': '5.00',
+        })))
+        # The writer is pinned to the primary
+        self.assertNotIn('core_tag', self.reads_on(REPLICA, lambda: self.client.get(TAGS_URL))) # noqa
+
+    @skipIf(REPLICA == 'default', 'Needs a replica in DB_REPLICA_HOSTS')
+    def test_details_writes_use_primary(self):
+        """Test the single statement writes of the details run on the primary connection while reads use a replica""" # noqa
+        request = RequestFactory().get(PROFILE_URL)
+        request.user = self.user
+        token = routers.replica_request.set(request)
+        try:
+            with CaptureQueriesContext(connections[REPLICA]) as queries:
+                UserDetails.objects.upsert(self.user, age=30, country='UAE', city='Dubai') # noqa
+                UserDetails.objects.update_for_user(self.user, city='Abu Dhabi') # noqa
+        finally:
+            routers.replica_request.reset(token)
+
+        self.assertEqual(queries.captured_queries, [])
+        self.assertEqual(UserDetails.objects.get(user=self.user).city, 'Abu Dhabi') # noqa
+
+    def test_writes_use_primary(self):
+        """Test writes never use a replica"""
+        res = self.client.post(RECIPES_URL, {
+            'title': 'Sample recipe',
+            'time_minutes': 5,
+            'price': '5.00',
+        })
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.choice.assert_not_called()
+
+    def test_reads_after_write_use_primary(self):
+        """Test a user reads from the primary within the window after a write""" # noqa
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+        self.client.patch(reverse('recipe:tag-detail', args=[tag.id]), {'name': 'Vegetarian'}) # noqa
+        self.choice.reset_mock()
+
+        self.client.get(TAGS_URL)
+
+        self.choice.assert_not_called()
+
+        caches['default'].clear()  # The window is over
+        self.client.get(TAGS_URL)
+
+        self.choice.assert_called_with([REPLICA])
+
+    def test_pin_is_per_user(self):
+        """Test a write only pins the user who made it"""
+        routers.pin_to_primary(self.user.pk + 1)
+
+        self.client.get(TAGS_URL)
+
+        self.choice.assert_called_with([REPLICA])
+
+    def test_failed_write_does_not_pin(self):
+        """Test rejected writes leave the user on the replicas"""
+        self.client.post(RECIPES_URL, {'title': 'No time or price'})
+        self.client.get(TAGS_URL)
+
+        self.choice.assert_called_with([REPLICA])
+
+    def test_session_and_token(self):
+        """Test a request with a session cookie and a token authenticates without loading the session through the router""" # noqa
+        client = APIClient()
+        client.force_login(self.user)
+        token = Token.objects.create(user=self.user)
+        client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+
+        res = client.get(TAGS_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.choice.assert_called_with([REPLICA])
+
+    def test_reads_outside_requests_use_primary(self):
+        """Test reads of management commands and background work use the primary""" # noqa
+        list(Tag.objects.all())
+
+        self.choice.assert_not_called()
+
+    @override_settings(DATABASE_REPLICAS=[])
+    def test_no_replicas(self):
+        """Test every read uses the primary without replicas"""
+        res = self.client.get(TAGS_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.choice.assert_not_called()
@@ -0,0 +1,286 @@
+"""
+Test sharding the rows of users across databases
+"""
+from decimal import Decimal
+from io import StringIO
+from unittest import mock, skipUnless
+
+from django.conf import settings
+from django.contrib import admin
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connections
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.management.commands import rebalance_shards
+from core.models import Ingredient, Recipe, ShardMove, Tag, UserDetails
+from core.routers import (
+    SHARD_ID_RANGE,
+    NoShardSelected,
+    ShardRouter,
+    shard_for_user,
+    shard_id_start,
+    use_shard_of,
+)
+
+
+RECIPES_URL = reverse('recipe:recipe-list')
+PROFILE_URL = reverse('user:me_profile')
+DEMOGRAPHICS_URL = reverse('user:demographics')
+
+
+@override_settings(DATABASE_SHARDS=['shard0', 'shard1', 'shard2'])
+class ShardRouterTests(SimpleTestCase):
+    """Test choosing the shard of a user"""
+
+    def test_spread(self):
+        """Test users are spread over every shard"""
+        counts = {}
+        for user_id in range(1, 3001):
+            shard = shard_for_user(user_id)
+            counts[shard] = counts.get(shard, 0) + 1
+
+        self.assertEqual(set(counts), {'shard0', 'shard1', 'shard2'})
+        self.assertGreater(min(counts.values()), 800)
+
+    def test_adding_shard_moves_few_users(self):
+        """Test adding a shard only moves users onto it"""
+        before = {user_id: shard_for_user(user_id) for user_id in range(1, 3001)} # noqa
+
+        with override_settings(DATABASE_SHARDS=['shard0', 'shard1', 'shard2', 'shard3']): # noqa
+            moved = [
+                user_id for user_id, shard in before.items()
+                if shard_for_user(user_id) != shard
+            ]
+            self.assertTrue(all(shard_for_user(user_id) == 'shard3' for user_id in moved)) # noqa
+
+        self.assertLess(len(moved), 3000 * 0.35)
+
+    @override_settings(DATABASE_SHARDS=[])
+    def test_not_sharded(self):
+        """Test every model uses the default database without shards"""
+        self.assertEqual(shard_for_user(1), 'default')
+        self.assertIsNone(ShardRouter().db_for_read(Recipe))
+
+    def test_routing(self):
+        """Test sharded models follow the user, other models are left to the next router""" # noqa
+        router = ShardRouter()
+        user = get_user_model()(pk=7)
+
+        self.assertIsNone(router.db_for_read(get_user_model()))
+        self.assertEqual(router.db_for_write(Recipe, instance=Recipe(user=user)), shard_for_user(7)) # noqa
+        self.assertEqual(router.db_for_read(Tag, instance=user), shard_for_user(7)) # noqa
+        with use_shard_of(7):
+            self.assertEqual(router.db_for_read(Recipe.tags.through), shard_for_user(7)) # noqa
+
+    def test_no_user(self):
+        """Test sharded queries without a user fail instead of guessing"""
+        with self.assertRaises(NoShardSelected):
+            ShardRouter().db_for_read(Recipe)
+
+
+def create_user(email):
+    return get_user_model().objects.create_user(email=email, password='testpass123') # noqa
+
+
+# Run with two or more databases in DB_SHARDS, e.g. DB_SHARDS=shard0,shard1
+@skipUnless(len(settings.DATABASE_SHARDS) > 1, 'Needs two shards in DB_SHARDS') # noqa
+class ShardedApiTests(TestCase):
+    """Test the API and commands with the rows of users on several databases""" # noqa
+
+    databases = '__all__'
+
+    def setUp(self):
+        cache.clear()
+        # Two users on different shards
+        self.user = create_user('user@example.com')
+        self.other = create_user('other0@example.com')
+        while shard_for_user(self.other.pk) == shard_for_user(self.user.pk):
+            self.other = create_user(f'other{self.other.pk}@example.com')
+
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def rows(self, model, user):
+        """Return {alias: count} of the rows of the user on each database"""
+        return {
+            alias: model.objects.using(alias).filter(user=user).count()
+            for alias in ['default', *settings.DATABASE_SHARDS]
+        }
+
+    def only_on(self, alias, count):
+        """Return the counts expected of rows only on alias"""
+        expected = dict.fromkeys(['default', *settings.DATABASE_SHARDS], 0)
+        expected[alias] = count
+        return expected
+
+    def test_rows_on_user_shard(self):
+        """Test rows created through the API land on the shard of their user""" # noqa
+        res = self.client.post(RECIPES_URL, {
+            'title': 'Soup',
+            'time_minutes': 10,
+            'price': '2.50',
+            'tags': [{'name': 'Vegan'}],
+            'ingredients': [{'name': 'Salt'}],
+        }, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        shard = shard_for_user(self.user.pk)
+        self.assertEqual(self.rows(Recipe, self.user), self.only_on(shard, 1)) # noqa
+        self.assertEqual(self.rows(Tag, self.user), self.only_on(shard, 1))
+        self.assertEqual(Tag.objects.using(shard).get(user=self.user).recipe_count, 1) # noqa
+
+        res = self.client.get(RECIPES_URL)
+
+        self.assertEqual([recipe['title'] for recipe in res.data], ['Soup'])
+        self.assertEqual(res.data[0]['tags'], [{'id': res.data[0]['tags'][0]['id'], 'name': 'Vegan'}]) # noqa
+
+        self.client.force_authenticate(self.other)
+        self.assertEqual(self.client.get(RECIPES_URL).data, [])
+
+    def test_profile(self):
+        """Test the profile combines the user with its details and counts from its shard""" # noqa
+        with use_shard_of(self.user.pk):
+            UserDetails.objects.create(user=self.user, age=30, country='UAE', city='Dubai') # noqa
+            Tag.objects.create(user=self.user, name='Vegan')
+
+        res = self.client.get(PROFILE_URL)
+
+        self.assertEqual(res.data['details']['city'], 'Dubai')
+        self.assertEqual(res.data['counts'], {'recipes': 0, 'tags': 1, 'ingredients': 0}) # noqa
+
+    def test_demographics_merge_shards(self):
+        """Test the demographics add up the users of every shard"""
+        for user, age in ((self.user, 20), (self.other, 30)):
+            with use_shard_of(user.pk):
+                UserDetails.objects.create(user=user, age=age, country='UAE', city='Dubai') # noqa
+        with use_shard_of(self.user.pk):
+            Recipe.objects.create(user=self.user, title='Soup', time_minutes=5, price=Decimal('1.00')) # noqa
+        self.client.force_authenticate(get_user_model().objects.create_superuser('admin@example.com', 'testpass123')) # noqa
+
+        res = self.client.get(DEMOGRAPHICS_URL, {'recipes': 1})
+
+        group, = res.data['groups']
+        self.assertEqual(group['users'], 2)
+        self.assertEqual(group['age']['avg'], 25)
+        self.assertEqual(group['recipes'], 1)
+
+    @override_settings(ACCOUNT_DELETION_WORKERS=0)
+    def test_delete_account(self):
+        """Test deleting an account removes its rows from its shard"""
+        with use_shard_of(self.user.pk):
+            Recipe.objects.create(user=self.user, title='Soup', time_minutes=5, price=Decimal('1.00')) # noqa
+
+        with self.captureOnCommitCallbacks(execute=True):
+            res = self.client.delete(reverse('user:me'))
+
+        self.assertEqual(res.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(sum(self.rows(Recipe, self.user).values()), 0)
+        self.assertFalse(get_user_model().objects.filter(pk=self.user.pk).exists()) # noqa
+
+    def test_delete_user(self):
+        """Test deleting a user through the ORM, e.g. in the admin, removes its rows from its shard""" # noqa
+        with use_shard_of(self.user.pk):
+            recipe = Recipe.objects.create(user=self.user, title='Soup', time_minutes=5, price=Decimal('1.00')) # noqa
+            recipe.tags.add(Tag.objects.create(user=self.user, name='Vegan'))
+            UserDetails.objects.create(user=self.user, age=30, country='UAE', city='Dubai') # noqa
+
+        shard = shard_for_user(self.user.pk)
+        user = get_user_model()(pk=self.user.pk)
+
+        self.user.delete()
+
+        for model in (Recipe, Tag, UserDetails):
+            self.assertEqual(sum(self.rows(model, user).values()), 0)
+        self.assertFalse(Recipe.tags.through.objects.using(shard).exists())
+
+    def test_admin_without_sharded_models(self):
+        """Test the admin leaves out the sharded models, as it would only see the shard of the admin""" # noqa
+        for model in (Recipe, Tag, Ingredient):
+            self.assertFalse(admin.site.is_registered(model))
+        self.assertTrue(admin.site.is_registered(get_user_model()))
+
+    def test_user_constraints(self):
+        """Test the shards have no constraints on the users, which live on the default database, and the default database keeps them""" # noqa
+        for alias in ['default', *settings.DATABASE_SHARDS]:
+            with connections[alias].cursor() as cursor:
+                constraints = connections[alias].introspection.get_constraints(cursor, Recipe._meta.db_table) # noqa
+            user_constraints = [
+                name for name, constraint in constraints.items()
+                if constraint['foreign_key'] and constraint['columns'] == ['user_id'] # noqa
+            ]
+            self.assertEqual(bool(user_constraints), alias == 'default', alias) # noqa
+
+    def test_rebalance_moves_default_rows(self):
+        """Test rebalancing moves rows from before sharding to the shards, keeping their relations""" # noqa
+        recipe = Recipe.objects.using('default').create(user=self.user, title='Soup', time_minutes=5, price=Decimal('1.00')) # noqa
+        recipe.tags.add(Tag.objects.using('default').create(user=self.user, name='Vegan')) # noqa
+        UserDetails.objects.using('default').create(user=self.other, age=30, country='UAE', city='Dubai') # noqa
+
+        out = StringIO()
+        call_command('rebalance_shards', '--dry-run', stdout=out)
+
+        self.assertIn('Found 2 users to move', out.getvalue())
+        self.assertEqual(Recipe.objects.using('default').count(), 1)
+
+        call_command('rebalance_shards', stdout=StringIO())
+
+        shard = shard_for_user(self.user.pk)
+        self.assertEqual(self.rows(Recipe, self.user), self.only_on(shard, 1)) # noqa
+        self.assertEqual(self.rows(UserDetails, self.other), self.only_on(shard_for_user(self.other.pk), 1)) # noqa
+        moved = Recipe.objects.using(shard).get(user=self.user)
+        self.assertEqual(moved.pk, recipe.pk)
+        self.assertEqual([tag.name for tag in moved.tags.all()], ['Vegan'])
+        self.assertEqual(moved.attrs_snapshot['tags'][0]['name'], 'Vegan')
+        self.assertFalse(Recipe.tags.through.objects.using('default').exists()) # noqa
+
+    def test_shard_id_ranges(self):
+        """Test each shard allocates ids from its own range, so moved rows keep theirs""" # noqa
+        for alias in settings.DATABASE_SHARDS:
+            tag = Tag.objects.using(alias).create(user=self.user, name='Vegan')
+            self.assertGreaterEqual(tag.pk, shard_id_start(alias))
+            self.assertLess(tag.pk, shard_id_start(alias) + SHARD_ID_RANGE)
+
+    def test_rebalance_after_adding_shard(self):
+        """Test rebalancing after adding a shard only moves the users it wins""" # noqa
+        first = settings.DATABASE_SHARDS[0]
+        with override_settings(DATABASE_SHARDS=[first]):
+            for user in (self.user, self.other):
+                self.client.force_authenticate(user)
+                self.client.post(RECIPES_URL, {'title': 'Soup', 'time_minutes': 5, 'price': '1.00'}) # noqa
+
+        out = StringIO()
+        call_command('rebalance_shards', stdout=out)
+
+        self.assertIn('Moved 1 users', out.getvalue())
+        for user in (self.user, self.other):
+            self.assertEqual(self.rows(Recipe, user), self.only_on(shard_for_user(user.pk), 1)) # noqa
+
+    def test_rebalance_interrupted(self):
+        """Test a rebalance interrupted between the copy and the delete is finished by the next run without copying again""" # noqa
+        Recipe.objects.using('default').create(user=self.user, title='Soup', time_minutes=5, price=Decimal('1.00')) # noqa
+
+        with mock.patch.object(rebalance_shards.Command, 'delete_user', side_effect=RuntimeError): # noqa
+            with self.assertRaises(RuntimeError):
+                call_command('rebalance_shards', stdout=StringIO())
+        call_command('rebalance_shards', stdout=StringIO())
+
+        self.assertEqual(self.rows(Recipe, self.user), self.only_on(shard_for_user(self.user.pk), 1)) # noqa
+        self.assertFalse(ShardMove.objects.using(shard_for_user(self.user.pk)).exists()) # noqa
+
+    def test_rebalance_keeps_new_details(self):
+        """Test details the user created on its new shard meanwhile are kept over the old ones""" # noqa
+        UserDetails.objects.using('default').create(user=self.user, age=30, country='UAE', city='Dubai') # noqa
+        with use_shard_of(self.user.pk):
+            UserDetails.objects.create(user=self.user, age=31, country='UAE', city='Abu Dhabi') # noqa
+
+        call_command('rebalance_shards', stdout=StringIO())
+
+        shard = shard_for_user(self.user.pk)
+        self.assertEqual(self.rows(UserDetails, self.user), self.only_on(shard, 1)) # noqa
+        self.assertEqual(UserDetails.objects.using(shard).get(user=self.user).city, 'Abu Dhabi') # noqa
@@ -0,0 +1,105 @@
+"""
+Test the content-addressable storage of recipe images
+"""
+from decimal import Decimal
+import hashlib
+import os
+import shutil
+import tempfile
+
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.test import TestCase, override_settings
+
+from core.models import Recipe, release_recipe_image
+from core.storage import ContentAddressableStorage
+
+
+class ContentAddressableStorageTests(TestCase):
+    """Test storing, deduplicating and releasing image blobs"""
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(
+            MEDIA_ROOT=self.media_root,
+            RECIPE_IMAGE_GRACE_SECONDS=0,
+        )
+        self.settings_override.enable()
+        self.storage = ContentAddressableStorage()
+        self.user = get_user_model().objects.create_user(
+            email='test@example.com',
+            password='password123',
+        )
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root)
+
+    def create_recipe(self, content, filename='photo.jpg'):
+        recipe = Recipe(
+            user=self.user,
+            title='Sample recipe',
+            time_minutes=10,
+            price=Decimal('5.00'),
+        )
+        recipe.image.save(filename, ContentFile(content))
+        return recipe
+
+    def blob_count(self):
+        return sum(
+            len(files) for root, _, files in os.walk(self.media_root)
+            if not root.endswith('tmp')
+        )
+
+    def test_name_is_content_hash(self):
+        """Test files are stored under the SHA-256 of their content"""
+        name = self.storage.save('uploads/recipe/photo.JPG', ContentFile(b'abc')) # noqa
+
+        digest = hashlib.sha256(b'abc').hexdigest()
+        self.assertEqual(name, f'blobs/{digest[:2]}/{digest[2:4]}/{digest}.jpg') # noqa
+        with self.storage.open(name) as f:
+            self.assertEqual(f.read(), b'abc')
+
+    def test_identical_uploads_share_a_blob(self):
+        """Test uploading the same bytes twice stores them once"""
+        r1 = self.create_recipe(b'same bytes')
+        r2 = self.create_recipe(b'same bytes')
+        r3 = self.create_recipe(b'other bytes')
+
+        self.assertEqual(r1.image.name, r2.image.name)
+        self.assertNotEqual(r1.image.name, r3.image.name)
+        self.assertEqual(self.blob_count(), 2)
+
+    def test_blob_released_when_last_reference_deleted(self):
+        """Test a blob is only deleted with its last referencing recipe"""
+        r1 = self.create_recipe(b'shared')
+        r2 = self.create_recipe(b'shared')
+        path = r1.image.path
+
+        with self.captureOnCommitCallbacks(execute=True):
+            r1.delete()
+        self.assertTrue(os.path.exists(path))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            r2.delete()
+        self.assertFalse(os.path.exists(path))
+
+    def test_replaced_image_released(self):
+        """Test replacing the image of a recipe releases the old blob"""
+        recipe = Recipe.objects.get(pk=self.create_recipe(b'old').pk)
+        old_path = recipe.image.path
+
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe.image.save('new.jpg', ContentFile(b'new'))
+
+        self.assertFalse(os.path.exists(old_path))
+        self.assertTrue(os.path.exists(recipe.image.path))
+
+    def test_recent_blobs_kept(self):
+        """Test unreferenced blobs within the grace period are not deleted"""
+        name = self.storage.save('photo.jpg', ContentFile(b'pending'))
+
+        with override_settings(RECIPE_IMAGE_GRACE_SECONDS=3600):
+            self.assertFalse(release_recipe_image(name))
+
+        self.assertTrue(self.storage.exists(name))
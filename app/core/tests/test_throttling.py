@@ -0,0 +1,121 @@
+"""
+Test the rate limiting shared between workers
+"""
+import multiprocessing
+import os
+import tempfile
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.throttling import BucketTable, get_bucket_table
+
+
+TOKEN_URL = reverse('user:token')
+TAGS_URL = reverse('recipe:tag-list')
+
+
+def consume_many(path, count, results):
+    """Take count tokens from a table opened in another process"""
+    table = BucketTable(path, 64)
+    results.put(sum(table.consume('shared', 50, 0.001) == 0 for _ in range(count))) # noqa
+
+
+class BucketTableTests(SimpleTestCase):
+    """Test the token buckets of the memory mapped table"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'buckets')
+
+    def test_capacity_and_refill(self):
+        """Test buckets grant up to their capacity, then report the wait"""
+        table = BucketTable(self.path, 64)
+
+        self.assertEqual(table.consume('a', 2, 1), 0)
+        self.assertEqual(table.consume('a', 2, 1), 0)
+        self.assertGreater(table.consume('a', 2, 1), 0.5)
+        self.assertEqual(table.consume('b', 2, 1), 0)
+
+    def test_shared_between_tables(self):
+        """Test tables opened on the same file see the same buckets"""
+        BucketTable(self.path, 64).consume('a', 1, 0.01)
+
+        self.assertGreater(BucketTable(self.path, 64).consume('a', 1, 0.01), 0) # noqa
+
+    def test_atomic_across_processes(self):
+        """Test concurrent workers never grant more than the capacity"""
+        context = multiprocessing.get_context('fork')
+        results = context.Queue()
+        workers = [
+            context.Process(target=consume_many, args=(self.path, 30, results)) # noqa
+            for _ in range(4)
+        ]
+        for worker in workers:
+            worker.start()
+        granted = sum(results.get(timeout=30) for _ in workers)
+        for worker in workers:
+            worker.join()
+
+        self.assertEqual(granted, 50)
+
+
+class ThrottledApiTests(TestCase):
+    """Test the views throttled by scope"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        rates = dict(settings.REST_FRAMEWORK['DEFAULT_THROTTLE_RATES'], login='2/min') # noqa
+        override = override_settings(
+            THROTTLE_ENABLED=True,
+            THROTTLE_FILE=os.path.join(directory.name, 'buckets'),
+            REST_FRAMEWORK=dict(settings.REST_FRAMEWORK, DEFAULT_THROTTLE_RATES=rates), # noqa
+        )
+        override.enable()
+        self.addCleanup(override.disable)
+
+        self.client = APIClient()
+        get_user_model().objects.create_user(
+            email='user@example.com',
+            password='testpass123',
+        )
+
+    def login(self):
+        return self.client.post(TOKEN_URL, {
+            'email': 'user@example.com',
+            'password': 'testpass123',
+        })
+
+    def test_login_throttled(self):
+        """Test logins beyond the rate are rejected with Retry-After"""
+        self.assertEqual(self.login().status_code, status.HTTP_200_OK)
+        self.assertEqual(self.login().status_code, status.HTTP_200_OK)
+
+        res = self.login()
+
+        self.assertEqual(res.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertIn(res['Retry-After'], ('29', '30'))
+
+    def test_scopes_separate(self):
+        """Test exhausting the login rate leaves other scopes usable"""
+        token = self.login().data['token']
+        get_bucket_table().consume('login:ip:127.0.0.1', 2, 1 / 30)
+
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token}')
+        res = self.client.get(TAGS_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.login().status_code, status.HTTP_429_TOO_MANY_REQUESTS) # noqa
+
+    @override_settings(THROTTLE_ENABLED=False)
+    def test_disabled(self):
+        """Test nothing is throttled unless enabled"""
+        for _ in range(3):
+            self.assertEqual(self.login().status_code, status.HTTP_200_OK)
@@ -0,0 +1,142 @@
+"""
+Test the sliding expiry and purging of auth tokens
+"""
+from datetime import timedelta
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from core.authentication import token_cache
+from core.models import TokenUsage
+
+
+ME_URL = reverse('user:me')
+TOKEN_URL = reverse('user:token')
+
+
+def create_token(email, last_used=None, created=None):
+    """Create a user and token, last used or created the given time ago"""
+    user = get_user_model().objects.create_user(email=email, password='testpass123') # noqa
+    token = Token.objects.create(user=user)
+    if created is not None:
+        Token.objects.filter(pk=token.pk).update(created=timezone.now() - created) # noqa
+    if last_used is not None:
+        TokenUsage.objects.create(token=token, last_used=timezone.now() - last_used) # noqa
+    return token
+
+
+@override_settings(TOKEN_EXPIRY=3600, TOKEN_USAGE_INTERVAL=60)
+class TokenExpiryTests(TestCase):
+    """Test tokens expire after TOKEN_EXPIRY seconds without use"""
+
+    def setUp(self):
+        token_cache.clear()
+        self.client = APIClient()
+
+    def get_me(self, token):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        return self.client.get(ME_URL)
+
+    def test_expired_token_rejected(self):
+        """Test tokens unused for longer than the expiry are rejected"""
+        token = create_token('user@example.com', last_used=timedelta(hours=2)) # noqa
+
+        res = self.get_me(token)
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_never_used_token_expires_from_creation(self):
+        """Test tokens without a recorded use expire from their creation"""
+        token = create_token('user@example.com', created=timedelta(hours=2))
+
+        self.assertEqual(self.get_me(token).status_code, status.HTTP_401_UNAUTHORIZED) # noqa
+
+    @override_settings(TOKEN_EXPIRY=0)
+    def test_expiry_disabled(self):
+        """Test tokens never expire when TOKEN_EXPIRY is 0"""
+        token = create_token('user@example.com', last_used=timedelta(days=400)) # noqa
+
+        self.assertEqual(self.get_me(token).status_code, status.HTTP_200_OK)
+
+    def test_use_slides_expiry(self):
+        """Test a use past the interval is recorded"""
+        token = create_token('user@example.com', last_used=timedelta(minutes=30)) # noqa
+
+        self.assertEqual(self.get_me(token).status_code, status.HTTP_200_OK)
+
+        usage = TokenUsage.objects.get(token=token)
+        self.assertLess(timezone.now() - usage.last_used, timedelta(minutes=1)) # noqa
+
+    def test_writes_coalesced(self):
+        """Test uses within the interval do not write"""
+        token = create_token('user@example.com', last_used=timedelta(minutes=30)) # noqa
+
+        with self.assertNumQueries(2):  # Token lookup and usage update
+            self.get_me(token)
+        token_cache.clear()
+        with self.assertNumQueries(1):  # Token lookup only
+            self.get_me(token)
+        with self.assertNumQueries(0):
+            self.get_me(token)
+
+    def test_login_rotates_expired_token(self):
+        """Test logging in replaces an expired token with a new key"""
+        token = create_token('user@example.com', last_used=timedelta(hours=2)) # noqa
+
+        res = self.client.post(TOKEN_URL, {
+            'email': 'user@example.com',
+            'password': 'testpass123',
+        })
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(res.data['token'], token.key)
+        self.assertFalse(Token.objects.filter(pk=token.pk).exists())
+
+    def test_login_keeps_valid_token(self):
+        """Test logging in returns the current token and slides it"""
+        token = create_token('user@example.com', last_used=timedelta(minutes=30)) # noqa
+
+        res = self.client.post(TOKEN_URL, {
+            'email': 'user@example.com',
+            'password': 'testpass123',
+        })
+
+        self.assertEqual(res.data['token'], token.key)
+        usage = TokenUsage.objects.get(token=token)
+        self.assertLess(timezone.now() - usage.last_used, timedelta(minutes=1)) # noqa
+
+
+@override_settings(TOKEN_EXPIRY=3600)
+class PurgeExpiredTokensTests(TestCase):
+    """Test the purge_expired_tokens command"""
+
+    def setUp(self):
+        create_token('used@example.com', last_used=timedelta(hours=2))
+        create_token('unused@example.com', created=timedelta(hours=2))
+        create_token('other@example.com', last_used=timedelta(hours=3))
+        self.active = create_token('active@example.com', last_used=timedelta(minutes=5)) # noqa
+
+    def test_purge(self):
+        """Test expired tokens are deleted in batches and active ones kept"""
+        out = StringIO()
+        call_command('purge_expired_tokens', batch_size=1, sleep=0, stdout=out) # noqa
+
+        self.assertIn('Deleted 3 expired tokens', out.getvalue())
+        self.assertEqual(list(Token.objects.all()), [self.active])
+        self.assertEqual(TokenUsage.objects.count(), 1)
+
+    def test_dry_run(self):
+        """Test a dry run only counts the expired tokens"""
+        out = StringIO()
+        call_command('purge_expired_tokens', dry_run=True, stdout=out)
+
+        self.assertIn('Found 3 expired tokens', out.getvalue())
+        self.assertEqual(Token.objects.count(), 4)
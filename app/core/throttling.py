@@ -0,0 +1,141 @@
+"""
+Rate limiting shared by every uWSGI worker of a host, without database or cache round trips. # noqa
+Token buckets live in a memory mapped file (THROTTLE_FILE, on /dev/shm by default). # noqa
+Each update holds a byte range lock on its slots, so workers update a bucket atomically. # noqa
+"""
+
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import time
+
+from django.conf import settings
+
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+
+# Slot: hash of the bucket key (0 when free), tokens left, time of the last update # noqa
+SLOT = struct.Struct('<Qdd')
+# Slots a key may use. Keys of a full group evict its least recently updated bucket # noqa
+GROUP_SIZE = 4
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_rate(rate):
+    """Return (capacity, tokens per second) of a rate like '10/min'. Up to capacity requests may burst""" # noqa
+    count, period = rate.split('/')
+    return int(count), int(count) / PERIODS[period[0]]
+
+
+class BucketTable:
+    """Fixed size table of token buckets in a shared memory mapped file"""
+
+    def __init__(self, path, slots):
+        self.groups = max(slots // GROUP_SIZE, 1)
+        size = self.groups * GROUP_SIZE * SLOT.size
+
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(self.fd).st_size != size:
+            # Resizing drops the buckets, which only lets clients burst once # noqa
+            fcntl.lockf(self.fd, fcntl.LOCK_EX)
+            try:
+                if os.fstat(self.fd).st_size != size:  # Another worker may have been first # noqa
+                    os.ftruncate(self.fd, 0)
+                    os.ftruncate(self.fd, size)
+            finally:
+                fcntl.lockf(self.fd, fcntl.LOCK_UN)
+        self.map = mmap.mmap(self.fd, size)
+        # Byte range locks are held per process, this serializes its threads # noqa
+        self.lock = threading.Lock()
+
+    def consume(self, key, capacity, rate):
+        """Take a token from the bucket of key. Returns 0 when granted, else the seconds until a token is available""" # noqa
+        digest = int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'little') or 1 # noqa
+        start = digest % self.groups * GROUP_SIZE * SLOT.size
+        length = GROUP_SIZE * SLOT.size
+
+        with self.lock:
+            fcntl.lockf(self.fd, fcntl.LOCK_EX, length, start)
+            try:
+                now = time.time()
+                offset, tokens = None, capacity
+                oldest_offset, oldest = start, None
+
+                for slot in range(start, start + length, SLOT.size):
+                    slot_key, slot_tokens, updated = SLOT.unpack_from(self.map, slot) # noqa
+                    if slot_key == digest:
+                        # Clamped, as the wall clock may go backwards # noqa
+                        elapsed = max(now - updated, 0)
+                        offset, tokens = slot, min(capacity, slot_tokens + elapsed * rate) # noqa
+                        break
+                    if oldest is None or updated < oldest:
+                        oldest_offset, oldest = slot, updated
+
+                if offset is None:
+                    offset = oldest_offset
+
+                if tokens >= 1:
+                    SLOT.pack_into(self.map, offset, digest, tokens - 1, now)
+                    return 0
+
+                SLOT.pack_into(self.map, offset, digest, tokens, now)
+                return (1 - tokens) / rate
+            finally:
+                fcntl.lockf(self.fd, fcntl.LOCK_UN, length, start)
+
+    def clear(self):
+        """Drop every bucket"""
+        with self.lock:
+            fcntl.lockf(self.fd, fcntl.LOCK_EX)
+            try:
+                self.map[:] = bytes(len(self.map))
+            finally:
+                fcntl.lockf(self.fd, fcntl.LOCK_UN)
+
+
+_tables = {}
+_tables_lock = threading.Lock()
+
+
+def get_bucket_table():
+    """Return the table of THROTTLE_FILE, opening it on first use in this process""" # noqa
+    key = (settings.THROTTLE_FILE, settings.THROTTLE_SLOTS)
+
+    with _tables_lock:
+        if key not in _tables:
+            _tables[key] = BucketTable(*key)
+        return _tables[key]
+
+
+class ScopedBucketThrottle(BaseThrottle):
+    """Throttle views by their throttle_scope, using the rates of DEFAULT_THROTTLE_RATES. # noqa
+    Writes use throttle_write_scope when the view sets one. Authenticated users get a bucket each, anonymous clients one per IP""" # noqa
+
+    def get_scope(self, request, view):
+        scope = getattr(view, 'throttle_scope', None)
+        if request.method not in SAFE_METHODS:
+            scope = getattr(view, 'throttle_write_scope', scope)
+        return scope
+
+    def allow_request(self, request, view):
+        scope = self.get_scope(request, view)
+        if not settings.THROTTLE_ENABLED or scope is None:
+            return True
+
+        if request.user and request.user.is_authenticated:
+            ident = f'user:{request.user.pk}'
+        else:
+            ident = f'ip:{self.get_ident(request)}'
+
+        capacity, rate = parse_rate(api_settings.DEFAULT_THROTTLE_RATES[scope]) # noqa
+        self.retry_after = get_bucket_table().consume(f'{scope}:{ident}', capacity, rate) # noqa
+        return self.retry_after == 0
+
+    def wait(self):
+        return self.retry_after
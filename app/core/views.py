@@ -2,11 +2,28 @@
 This file contains the views for the core app.
 """
 
-from rest_framework.decorators import api_view
+from drf_spectacular.utils import extend_schema, OpenApiTypes
+from rest_framework.decorators import (
+    api_view,
+    authentication_classes,
+    permission_classes,
+)
+from rest_framework.permissions import IsAdminUser
 from rest_framework.response import Response
 
+from core.authentication import CachedTokenAuthentication, token_cache
+
 
 @api_view(['GET'])
 def health_check(request):
     """Return the status of the API"""
     return Response({'healthy': True})
+
+
+@extend_schema(responses=OpenApiTypes.OBJECT)
+@api_view(['GET'])
+@authentication_classes([CachedTokenAuthentication])
+@permission_classes([IsAdminUser])
+def auth_cache_stats(request):
+    """Return the token cache counters of the worker handling the request"""
+    return Response(token_cache.stats())
@@ -0,0 +1,59 @@
+"""
+    Tag / ingredient filtering for recipe lists.
+    Predicates are applied most selective first, using the recipe_count counters of tags and ingredients as per-user cardinality statistics. # noqa
+"""
+
+from django.conf import settings
+
+from core.models import Recipe, Tag, Ingredient
+
+
+# (query parameter, counted model, through table, column of the counted model in the through table) # noqa
+PREDICATES = (
+    ('tags', Tag, Recipe.tags.through, 'tag_id'),
+    ('ingredients', Ingredient, Recipe.ingredients.through, 'ingredient_id'),
+)
+
+
+def _estimate(model, user, ids):
+    """Return the ids owned by the user, with an upper bound of the number of recipes using any of them""" # noqa
+    rows = model.objects.filter(user=user, id__in=ids).values_list('id', 'recipe_count') # noqa
+    return [pk for pk, _ in rows], sum(count for _, count in rows)
+
+
+def filter_recipes(queryset, user, **attr_ids):
+    """Filter recipes having any of the given tags AND any of the given ingredients""" # noqa
+    predicates = [
+        (through, column, attr_ids[name], model)
+        for name, model, through, column in PREDICATES
+        if attr_ids.get(name)
+    ]
+
+    # Semi-joins (id IN (SELECT recipe_id ...)) need no DISTINCT, unlike joins through the relations # noqa
+    candidates = None
+    if len(predicates) > 1:
+        ranked = []
+        for through, column, ids, model in predicates:
+            owned_ids, estimate = _estimate(model, user, ids)
+            ranked.append((estimate, (through, column, owned_ids, model)))
+
+        ranked.sort(key=lambda pair: pair[0])
+        predicates = [predicate for _, predicate in ranked]
+
+        # Materialize a small candidate set first, so the other predicates only probe those recipes # noqa
+        if ranked[0][0] <= settings.RECIPE_FILTER_MATERIALIZE_LIMIT:
+            through, column, ids, _ = predicates.pop(0)
+            # No join with the recipes here, the ids are owned by the user # noqa
+            candidates = set(through.objects.filter(
+                **{f'{column}__in': ids},
+            ).values_list('recipe_id', flat=True))
+            queryset = queryset.filter(id__in=candidates)
+
+    for through, column, ids, _ in predicates:
+        rows = through.objects.filter(**{f'{column}__in': ids})
+        if candidates is not None:
+            rows = rows.filter(recipe_id__in=candidates)  # Index probes on (recipe_id, attr_id) # noqa
+
+        queryset = queryset.filter(id__in=rows.values('recipe_id'))
+
+    return queryset
@@ -0,0 +1,188 @@
+"""
+    On-demand resized variants of recipe images.
+    Variants are rendered with Pillow in a process pool and kept in a size-bounded LRU cache directory under MEDIA_ROOT. # noqa
+    Concurrent requests for the same variant wait for a single render (single-flight), across threads and uWSGI workers. # noqa
+"""
+
+import fcntl
+import hashlib
+import os
+import tempfile
+import threading
+from math import ceil
+
+from django.conf import settings
+from PIL import Image, ImageOps, features
+
+from core.executors import get_executor
+
+
+# Format query parameter -> (Pillow format, file extension, content type)
+FORMATS = {
+    'jpeg': ('JPEG', 'jpg', 'image/jpeg'),
+    'png': ('PNG', 'png', 'image/png'),
+}
+if features.check('webp'):
+    FORMATS['webp'] = ('WEBP', 'webp', 'image/webp')
+
+DEFAULT_FORMAT = 'webp' if 'webp' in FORMATS else 'jpeg'
+
+# Striped in-process locks, so the number of locks stays bounded whatever the number of variants # noqa
+_key_locks = [threading.Lock() for _ in range(64)]
+
+# Size of the cache at the last scan of this worker plus the variants it rendered since, None before the first scan # noqa
+_cache_size = None
+_cache_size_lock = threading.Lock()
+
+
+def cache_dir():
+    """Return the directory holding rendered variants"""
+    return os.path.join(settings.MEDIA_ROOT, 'cache', 'variants')
+
+
+def render_variant(source_path, target_path, width, image_format):
+    """Resize the source image to width and write it to target_path. Runs in a worker process""" # noqa
+    with Image.open(source_path) as img:
+        # Let JPEG decode at a reduced scale. Sized for either orientation, as EXIF may rotate the image # noqa
+        scale = width / min(img.size)
+        img.draft('RGB', (ceil(img.width * scale), ceil(img.height * scale)))
+        img = ImageOps.exif_transpose(img)
+        img.thumbnail((width, img.height))  # Keeps the aspect ratio, never upscales # noqa
+
+        if image_format == 'JPEG' and img.mode not in ('RGB', 'L'):
+            img = img.convert('RGB')
+
+        # Write next to the target and rename, so readers never see a partial file # noqa
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(target_path))
+        try:
+            with os.fdopen(fd, 'wb') as tmp:
+                img.save(tmp, format=image_format, optimize=True)
+            os.replace(tmp_path, target_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    return os.path.getsize(target_path)
+
+
+def _key_lock(path):
+    """Return the in-process lock of a variant"""
+    return _key_locks[hash(path) % len(_key_locks)]
+
+
+def variant_path(image_name, width, fmt):
+    """Return the cache path of a variant. Image names are never reused, so variants never go stale""" # noqa
+    key = hashlib.sha256(f'{image_name}:{width}:{fmt}'.encode()).hexdigest()
+    return os.path.join(cache_dir(), key[:2], f'{key}.{FORMATS[fmt][1]}')
+
+
+def get_variant(image, width, fmt):
+    """Return the path of a variant of an image field, rendering it on a cache miss""" # noqa
+    path = variant_path(image.name, width, fmt)
+
+    try:
+        os.utime(path)  # Mark as recently used for the LRU eviction
+        return path
+    except FileNotFoundError:
+        pass
+
+    # Single flight: threads of this worker wait on the key lock, other workers on the file lock # noqa
+    with _key_lock(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        lock_fd = _lock_file(f'{path}.lock')
+        try:
+            if not os.path.exists(path):
+                executor = get_executor(
+                    'image-variants',
+                    settings.IMAGE_VARIANT_WORKERS,
+                    processes=True,
+                )
+                size = executor.submit(
+                    render_variant, image.path, path, width, FORMATS[fmt][0], # noqa
+                ).result()
+                evict(keep=path, added=size)
+        finally:
+            os.close(lock_fd)  # Releases the lock
+
+    return path
+
+
+def open_variant(image, width, fmt):
+    """Return an open file of a variant, rendering it again if it was evicted in the meantime""" # noqa
+    for attempt in range(3):
+        try:
+            return open(get_variant(image, width, fmt), 'rb')
+        except FileNotFoundError:
+            if attempt == 2:
+                raise
+
+
+def _lock_file(lock_path):
+    """Return a descriptor holding the lock of lock_path. Retries when _remove_lock_file() deleted it while waiting, so every worker locks the same file""" # noqa
+    while True:
+        fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(fd).st_ino == os.stat(lock_path).st_ino:
+                return fd
+        except FileNotFoundError:
+            pass
+        os.close(fd)
+
+
+def _remove_lock_file(lock_path):
+    """Delete a lock file, unless a worker holds it"""
+    try:
+        fd = os.open(lock_path, os.O_RDONLY)
+    except FileNotFoundError:
+        return
+
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        os.remove(lock_path)  # While holding it, see _lock_file()
+    except (BlockingIOError, FileNotFoundError):
+        pass
+    finally:
+        os.close(fd)
+
+
+def evict(keep=None, added=0):
+    """Delete the least recently used variants, except keep, once the cache exceeds its size budget. # noqa
+    added is the size of a variant just rendered. The directory is only scanned once the running total of this worker passes the budget, # noqa
+    so the cache may exceed it by what the other workers rendered since their last scan""" # noqa
+    global _cache_size
+    with _cache_size_lock:
+        if _cache_size is not None:
+            _cache_size += added
+            if _cache_size <= settings.IMAGE_VARIANT_CACHE_MAX_BYTES:
+                return
+
+    entries = []
+    total = 0
+
+    for bucket in os.scandir(cache_dir()):
+        if not bucket.is_dir():
+            continue
+        for entry in os.scandir(bucket.path):
+            if entry.name.endswith('.lock'):
+                continue
+            stat = entry.stat()
+            total += stat.st_size
+            if entry.path != keep:
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+    # Evict down to 90% of the budget, so eviction does not run on every miss # noqa
+    if total > settings.IMAGE_VARIANT_CACHE_MAX_BYTES:
+        target = settings.IMAGE_VARIANT_CACHE_MAX_BYTES * 0.9
+        for _, size, path in sorted(entries):
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            _remove_lock_file(f'{path}.lock')
+            total -= size
+
+    with _cache_size_lock:
+        _cache_size = total
@@ -0,0 +1,128 @@
+"""
+Django command to benchmark recipe filtering on skewed synthetic data.
+All data is created inside a transaction which is rolled back at the end.
+"""
+
+import random
+import statistics
+import time
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.models import Recipe, Tag, Ingredient
+from core.routers import use_shard_of
+from recipe.filters import filter_recipes
+
+
+class Command(BaseCommand):
+    """Compare join + distinct filtering with selectivity ordered filtering"""
+
+    help = "Benchmark filtering recipes by a common tag and a rare ingredient"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--recipes", type=int, default=20000)
+        parser.add_argument("--repeat", type=int, default=20)
+        parser.add_argument(
+            "--common-ratio",
+            type=float,
+            default=0.9,
+            help="Share of recipes having the common tag",
+        )
+        parser.add_argument(
+            "--rare-ratio",
+            type=float,
+            default=0.002,
+            help="Share of recipes having the rare ingredient",
+        )
+
+    def handle(self, *args, **options):
+        """Default entry point for the command"""
+
+        with transaction.atomic():
+            user = get_user_model().objects.create_user(
+                email="bench@example.com", password=None,
+            )
+
+            # The recipes live on the shard of the user, see core/routers.py
+            with use_shard_of(user.pk) as shard, transaction.atomic(using=shard): # noqa
+                tag, ingredient = self._create_data(user, options)
+
+                strategies = {
+                    "join + distinct": lambda: Recipe.objects.filter(
+                        user=user,
+                        tags__id__in=[tag.id],
+                        ingredients__id__in=[ingredient.id],
+                    ).order_by("-id").distinct(),
+                    "selectivity ordered": lambda: filter_recipes(
+                        Recipe.objects.all(),
+                        user,
+                        tags=[tag.id],
+                        ingredients=[ingredient.id],
+                    ).filter(user=user).order_by("-id"),
+                }
+
+                results = {}
+                for name, build in strategies.items():
+                    timings = []
+                    for _ in range(options["repeat"]):
+                        start = time.perf_counter()
+                        ids = list(build().values_list("id", flat=True))
+                        timings.append(time.perf_counter() - start)
+
+                    results[name] = ids
+                    self.stdout.write(
+                        f"{name:>20}: {statistics.median(timings) * 1000:.2f} ms median, " # noqa
+                        f"{len(ids)} recipes"
+                    )
+
+                if len({tuple(ids) for ids in results.values()}) != 1:
+                    self.stdout.write(self.style.ERROR("Strategies returned different recipes!")) # noqa
+
+                transaction.set_rollback(True, using=shard)
+
+            transaction.set_rollback(True)
+
+    def _create_data(self, user, options):
+        """Create recipes for the user which mostly share one tag and rarely use one ingredient""" # noqa
+        rng = random.Random(42)
+
+        recipes = Recipe.objects.bulk_create(
+            Recipe(
+                user=user,
+                title=f"Recipe {i}",
+                time_minutes=rng.randint(5, 120),
+                price=Decimal("5.00"),
+            )
+            for i in range(options["recipes"])
+        )
+        if recipes[0].pk is None:  # Backends without RETURNING for bulk inserts # noqa
+            recipes = list(Recipe.objects.filter(user=user))
+
+        tag = Tag.objects.create(user=user, name="Common")
+        ingredient = Ingredient.objects.create(user=user, name="Rare")
+        noise = Ingredient.objects.create(user=user, name="Noise")
+
+        # Bulk inserts bypass the counter signals, so the counters are set explicitly # noqa
+        tagged = [r for r in recipes if rng.random() < options["common_ratio"]] # noqa
+        rare = [r for r in recipes if rng.random() < options["rare_ratio"]]
+
+        Recipe.tags.through.objects.bulk_create(
+            Recipe.tags.through(recipe_id=r.pk, tag_id=tag.pk) for r in tagged
+        )
+        Recipe.ingredients.through.objects.bulk_create(
+            Recipe.ingredients.through(recipe_id=r.pk, ingredient_id=i.pk)
+            for r in recipes
+            for i in ([ingredient, noise] if r in rare else [noise])
+        )
+        Tag.objects.filter(pk=tag.pk).update(recipe_count=len(tagged))
+        Ingredient.objects.filter(pk=ingredient.pk).update(recipe_count=len(rare)) # noqa
+        Ingredient.objects.filter(pk=noise.pk).update(recipe_count=len(recipes)) # noqa
+
+        self.stdout.write(
+            f"{len(recipes)} recipes, {len(tagged)} with the common tag, "
+            f"{len(rare)} with the rare ingredient"
+        )
+        return tag, ingredient
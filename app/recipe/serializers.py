@@ -2,9 +2,16 @@
     Serializers for recipe app
 """
 
+from collections import OrderedDict
+from typing import Optional
+
+from django.conf import settings
+from django.urls import reverse
 from rest_framework import serializers
 
 from core.models import Recipe, Tag, Ingredient
+from recipe.images import DEFAULT_FORMAT
+from recipe.uploads import BoundedImageField
 
 
 # We put TagSerialzier on top as RecipeSerializer depends on it # noqa
@@ -26,6 +33,23 @@ class IngredientSerializer(serializers.ModelSerializer):
         read_only_fields = ['id']
 
 
+# Detail serializers are used by the tag and ingredient endpoints. Recipes nest the plain ones above # noqa
+class TagDetailSerializer(TagSerializer):
+    """Serializer for tag objects, including usage"""
+
+    class Meta(TagSerializer.Meta):
+        fields = TagSerializer.Meta.fields + ['recipe_count']
+        read_only_fields = ['id', 'recipe_count']
+
+
+class IngredientDetailSerializer(IngredientSerializer):
+    """Serializer for ingredient objects, including usage"""
+
+    class Meta(IngredientSerializer.Meta):
+        fields = IngredientSerializer.Meta.fields + ['recipe_count']
+        read_only_fields = ['id', 'recipe_count']
+
+
 class RecipeSerializer(serializers.ModelSerializer):
     """Serializer for recipe objects"""
     tags = TagSerializer(many=True, required = False)  # Convert tags to JSON # noqa
@@ -41,18 +65,21 @@ class RecipeSerializer(serializers.ModelSerializer):
 
         auth_user = self.context['request'].user  # We assign the ingredient to the authenticated user # noqa
 
-        for tag in tags:
-            tag_obj, created = Tag.objects.get_or_create(user=auth_user, **tag)
-            instance.tags.add(tag_obj)
+        tag_objs = [
+            Tag.objects.get_or_create(user=auth_user, **tag)[0] for tag in tags
+        ]
+        instance.tags.add(*tag_objs)  # Single insert into the through table # noqa
 
     def _get_or_create_ingredients(self, ingredients, instance):
         """ Get or create ingredients for a recipe """
 
         auth_user = self.context['request'].user
 
-        for ingredient in ingredients:
-            ingredient_obj, created = Ingredient.objects.get_or_create(user=auth_user, **ingredient)  # noqa
-            instance.ingredients.add(ingredient_obj)
+        ingredient_objs = [
+            Ingredient.objects.get_or_create(user=auth_user, **ingredient)[0]  # noqa
+            for ingredient in ingredients
+        ]
+        instance.ingredients.add(*ingredient_objs)
 
     def create(self, validated_data):
         """ Override the create method to handle tags """
@@ -69,6 +96,8 @@ class RecipeSerializer(serializers.ModelSerializer):
         if ingredients:
             self._get_or_create_ingredients(ingredients, recipe)
 
+        recipe.refresh_attrs_snapshot()
+
         return recipe
 
     def update(self, instance, validated_data):
@@ -92,29 +121,86 @@ class RecipeSerializer(serializers.ModelSerializer):
         for key, value in validated_data.items():
             setattr(instance, key, value)
 
-        instance.save()
+        # Only the columns sent, so a snapshot cleared or an image processed since the recipe was loaded is not written back # noqa
+        instance.save(update_fields=list(validated_data))
+
+        if tags is not None or ingredients is not None:
+            instance.refresh_attrs_snapshot()
 
         return instance
 
+    def to_representation(self, instance):
+        """Render tags and ingredients from the snapshot column when it is up to date""" # noqa
+        snapshot = instance.attrs_snapshot if settings.RECIPE_ATTRS_SNAPSHOT else None # noqa
+
+        if snapshot is None:
+            return super().to_representation(instance)
+
+        # Same as Serializer.to_representation, without touching the many-to-many relations # noqa
+        ret = OrderedDict()
+        for field in self._readable_fields:
+            if field.field_name in snapshot:
+                ret[field.field_name] = snapshot[field.field_name]
+                continue
+
+            attribute = field.get_attribute(instance)
+            ret[field.field_name] = None if attribute is None else field.to_representation(attribute) # noqa
+
+        return ret
+
 
 # We extend RecipeSerializer as we want the base fields to be included in the detail view # noqa
 class RecipeDetailSerializer(RecipeSerializer):
     """Serializer for recipe detail view"""
+    image_srcset = serializers.SerializerMethodField()  # Resized variants of the image, in srcset syntax # noqa
 
     class Meta(RecipeSerializer.Meta):
         model = Recipe
-        fields = RecipeSerializer.Meta.fields + ['description', 'image']
+        fields = RecipeSerializer.Meta.fields + ['description', 'image', 'image_srcset'] # noqa
+
+    def get_image_srcset(self, obj) -> Optional[str]:
+        """Return 'url 160w, url 320w, ...' for the image variant endpoint"""
+        if not obj.image:
+            return None
+
+        url = reverse('recipe:recipe-image-variant', args=[obj.id])
+        request = self.context.get('request')
+        if request is not None:
+            url = request.build_absolute_uri(url)
+
+        return ', '.join(
+            f'{url}?w={width}&fmt={DEFAULT_FORMAT} {width}w'
+            for width in settings.IMAGE_VARIANT_WIDTHS
+        )
 
 
 class RecipeImageSerializer(serializers.ModelSerializer):
     """Serializer for uploading images to recipes"""
 
+    image = BoundedImageField(required=True)
+
     class Meta:
         model = Recipe
-        fields = ['id', 'image']
-        read_only_fields = ['id']
+        fields = ['id', 'image', 'image_original_size', 'image_size']
+        read_only_fields = ['id', 'image_original_size', 'image_size']
 
         # Extra image field configuration
         extra_kwargs = {
             'image': {'required': True}
         }
+
+    def update(self, instance, validated_data):
+        """Save only the image columns, the others may have changed since the recipe was loaded""" # noqa
+        for key, value in validated_data.items():
+            setattr(instance, key, value)
+
+        instance.save(update_fields=list(validated_data))
+        return instance
+
+
+class ShoppingListItemSerializer(serializers.Serializer):
+    """Serializer for one ingredient of a shopping list"""
+    id = serializers.IntegerField(read_only=True)
+    name = serializers.CharField(read_only=True)
+    count = serializers.IntegerField(read_only=True)  # Number of selected recipes using the ingredient # noqa
+    recipes = serializers.ListField(child=serializers.IntegerField(), read_only=True)  # IDs of the selected recipes using the ingredient # noqa
@@ -0,0 +1,29 @@
+"""
+    Signal handlers for the recipe app.
+    Connected in RecipeConfig.ready(), so they run for every write path (API, admin, shell). # noqa
+"""
+
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from core.models import Recipe, Tag, Ingredient
+from recipe.stats import invalidate_recipe_stats
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def invalidate_stats_on_write(sender, instance, **kwargs):
+    """Drop the cached statistics of the owner of a changed object"""
+    invalidate_recipe_stats(instance.user_id)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def invalidate_stats_on_m2m_change(sender, instance, action, **kwargs):
+    """Drop the cached statistics when tags or ingredients are (un)assigned"""
+    if action.startswith('post_'):
+        invalidate_recipe_stats(instance.user_id)
@@ -0,0 +1,151 @@
+"""
+    Per-user recipe statistics.
+    Simple aggregates come from SQL, percentiles and histograms are computed from values streamed out of the database. # noqa
+    Results are cached per user and invalidated whenever one of the user's recipes changes (see recipe/signals.py). # noqa
+"""
+
+from math import floor
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Avg, Count, Max, Min, Sum
+
+from core.db import iterate_values
+from core.models import Recipe, Tag, Ingredient
+
+
+PERCENTILES = (25, 50, 75, 90, 95)
+
+
+def _cache_key(user_id):
+    """Return the cache key holding the statistics of a user"""
+    return f'recipe-stats:{user_id}'
+
+
+def _percentile(values, percent):
+    """Return the percentile of sorted values, interpolating linearly between the closest ranks""" # noqa
+    position = (len(values) - 1) * percent / 100
+    lower = floor(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower) # noqa
+
+
+def _histogram(values, bins):
+    """Return equal width buckets between the smallest and largest of the sorted values""" # noqa
+    low, high = values[0], values[-1]
+
+    if low == high:
+        return [{'start': low, 'end': high, 'count': len(values)}]
+
+    width = (high - low) / bins
+    counts = [0] * bins
+
+    for value in values:
+        counts[min(int((value - low) / width), bins - 1)] += 1  # The largest value belongs to the last bucket # noqa
+
+    return [
+        {
+            'start': round(low + i * width, 2),
+            'end': round(low + (i + 1) * width, 2),
+            'count': count,
+        }
+        for i, count in enumerate(counts)
+    ]
+
+
+def _describe(values, aggregates):
+    """Summarise one column from its SQL aggregates and its sorted values"""
+    if not values:
+        return None
+
+    return {
+        'min': float(aggregates['min']),
+        'max': float(aggregates['max']),
+        'avg': round(float(aggregates['avg']), 2),
+        'median': round(_percentile(values, 50), 2),
+        'percentiles': {
+            f'p{percent}': round(_percentile(values, percent), 2)
+            for percent in PERCENTILES
+        },
+        'histogram': _histogram(values, settings.RECIPE_STATS_HISTOGRAM_BINS), # noqa
+    }
+
+
+def _top(queryset, limit):
+    """Return the most used tags or ingredients of a queryset"""
+    top = queryset.annotate(
+        count=Count('recipe'),
+    ).filter(count__gt=0).order_by('-count', 'name')[:limit]
+
+    return [{'id': obj.id, 'name': obj.name, 'count': obj.count} for obj in top] # noqa
+
+
+def _image_savings(aggregates):
+    """Summarise the bytes saved by re-encoding uploaded images"""
+    original = aggregates['image_original_bytes'] or 0
+    stored = aggregates['image_stored_bytes'] or 0
+
+    return {
+        'count': aggregates['image_count'],
+        'original_bytes': original,
+        'stored_bytes': stored,
+        'saved_bytes': original - stored,
+    }
+
+
+def compute_recipe_stats(user):
+    """Compute the recipe statistics of a user, without using the cache"""
+    recipes = Recipe.objects.filter(user=user)
+
+    aggregates = recipes.aggregate(
+        count=Count('id'),
+        time_minutes_min=Min('time_minutes'),
+        time_minutes_max=Max('time_minutes'),
+        time_minutes_avg=Avg('time_minutes'),
+        price_min=Min('price'),
+        price_max=Max('price'),
+        price_avg=Avg('price'),
+        image_count=Count('image_size'),
+        image_original_bytes=Sum('image_original_size'),
+        image_stored_bytes=Sum('image_size'),
+    )
+
+    # Stream both columns into plain lists rather than building model instances, sorted in place below # noqa
+    time_minutes, price = [], []
+    for minutes, cost in iterate_values(recipes, 'time_minutes', 'price'):
+        time_minutes.append(minutes)
+        price.append(float(cost))
+
+    def column(name, values):
+        values.sort()
+        return _describe(values, {
+            key: aggregates[f'{name}_{key}'] for key in ('min', 'max', 'avg')
+        })
+
+    limit = settings.RECIPE_STATS_TOP_LIMIT
+
+    return {
+        'recipe_count': aggregates['count'],
+        'time_minutes': column('time_minutes', time_minutes),
+        'price': column('price', price),
+        'top_tags': _top(Tag.objects.filter(user=user), limit),
+        'top_ingredients': _top(Ingredient.objects.filter(user=user), limit),
+        'images': _image_savings(aggregates),
+    }
+
+
+def get_recipe_stats(user):
+    """Return the recipe statistics of a user, from the cache when possible"""
+    key = _cache_key(user.id)
+    stats = cache.get(key)
+
+    if stats is None:
+        stats = compute_recipe_stats(user)
+        cache.set(key, stats, settings.RECIPE_STATS_CACHE_TIMEOUT)
+
+    return stats
+
+
+def invalidate_recipe_stats(user_id):
+    """Drop the cached statistics of a user"""
+    cache.delete(_cache_key(user_id))
@@ -0,0 +1,128 @@
+"""
+Test the batch recipe image upload API
+"""
+from decimal import Decimal
+import shutil
+import tempfile
+
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from PIL import Image
+from io import BytesIO
+
+from core.models import Recipe
+
+
+UPLOAD_IMAGES_URL = reverse('recipe:recipe-upload-images')
+
+
+def create_recipe(user, **params):
+    """Create and return a sample recipe"""
+    defaults = {
+        'title': 'Sample recipe',
+        'time_minutes': 10,
+        'price': Decimal('5.00'),
+    }
+    defaults.update(params)
+    return Recipe.objects.create(user=user, **defaults)
+
+
+def sample_image(color='red'):
+    """Return an uploaded JPEG image"""
+    buffer = BytesIO()
+    Image.new('RGB', (20, 20), color=color).save(buffer, format='JPEG')
+    return SimpleUploadedFile('photo.jpg', buffer.getvalue(), content_type='image/jpeg') # noqa
+
+
+@override_settings(RECIPE_IMAGE_PROCESSING=False)
+class RecipeImageBatchUploadTests(TestCase):
+    """Test uploading images to several recipes at once"""
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root) # noqa
+        self.settings_override.enable()
+
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            email='user@example.com',
+            password='password123',
+        )
+        self.client.force_authenticate(self.user)
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root)
+
+    def test_upload_images(self):
+        """Test each recipe gets its own image and result"""
+        r1 = create_recipe(self.user)
+        r2 = create_recipe(self.user)
+
+        res = self.client.post(UPLOAD_IMAGES_URL, {
+            str(r1.id): sample_image('red'),
+            str(r2.id): sample_image('blue'),
+        }, format='multipart')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        results = {result['id']: result for result in res.data['results']}
+        for recipe in (r1, r2):
+            recipe.refresh_from_db()
+            self.assertTrue(recipe.image)
+            self.assertEqual(results[recipe.id]['status'], status.HTTP_200_OK)
+            self.assertTrue(results[recipe.id]['image'].endswith(recipe.image.name)) # noqa
+        self.assertNotEqual(r1.image.name, r2.image.name)
+
+    def test_partial_failure(self):
+        """Test invalid files and other users' recipes fail on their own"""
+        recipe = create_recipe(self.user)
+        invalid = create_recipe(self.user)
+        other_user = get_user_model().objects.create_user(
+            email='other@example.com',
+            password='password123',
+        )
+        other = create_recipe(other_user)
+
+        res = self.client.post(UPLOAD_IMAGES_URL, {
+            str(recipe.id): sample_image(),
+            str(invalid.id): SimpleUploadedFile('photo.jpg', b'not an image'),
+            str(other.id): sample_image(),
+        }, format='multipart')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        statuses = {result['id']: result['status'] for result in res.data['results']} # noqa
+        self.assertEqual(statuses, {
+            recipe.id: status.HTTP_200_OK,
+            invalid.id: status.HTTP_400_BAD_REQUEST,
+            other.id: status.HTTP_404_NOT_FOUND,
+        })
+        invalid.refresh_from_db()
+        other.refresh_from_db()
+        self.assertFalse(invalid.image)
+        self.assertFalse(other.image)
+
+    def test_invalid_field_name(self):
+        """Test files must be named after recipe IDs"""
+        res = self.client.post(UPLOAD_IMAGES_URL, {
+            'image': sample_image(),
+        }, format='multipart')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_too_many_files(self):
+        """Test batches above the file limit are rejected"""
+        recipes = [create_recipe(self.user) for _ in range(3)]
+
+        with override_settings(RECIPE_IMAGE_BATCH_MAX_FILES=2):
+            res = self.client.post(UPLOAD_IMAGES_URL, {
+                str(recipe.id): sample_image() for recipe in recipes
+            }, format='multipart')
+
+        self.assertEqual(res.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE) # noqa
+        self.assertFalse(Recipe.objects.exclude(image='').exclude(image=None).exists()) # noqa
@@ -0,0 +1,150 @@
+"""
+Test re-encoding of uploaded recipe images
+"""
+from decimal import Decimal
+import os
+import shutil
+import tempfile
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from PIL import Image
+from io import BytesIO
+
+from core.models import Recipe
+from recipe.uploads import process_recipe_image
+
+
+def image_upload_url(recipe_id):
+    """Return URL for recipe image upload"""
+    return reverse('recipe:recipe-upload-image', args=[recipe_id])
+
+
+def phone_photo(size=(3000, 1000)):
+    """Return a noisy JPEG as a phone would upload it: rotated by EXIF, with EXIF and ICC metadata""" # noqa
+    img = Image.frombytes('RGB', size, os.urandom(size[0] * size[1] * 3))
+    exif = Image.Exif()
+    exif[0x0112] = 6  # Orientation: rotate 90 degrees clockwise to display
+    exif[0x010F] = 'Phone maker'
+    buffer = BytesIO()
+    img.save(
+        buffer,
+        format='JPEG',
+        quality=95,
+        exif=exif.tobytes(),
+        icc_profile=b'\0' * 60000,  # Stand-in for a large embedded profile # noqa
+    )
+    return SimpleUploadedFile('photo.jpg', buffer.getvalue(), content_type='image/jpeg') # noqa
+
+
+@override_settings(
+    RECIPE_IMAGE_PROCESSING=True,
+    RECIPE_IMAGE_PROCESSING_WORKERS=0,
+    RECIPE_IMAGE_MAX_DIMENSION=1024,
+    RECIPE_IMAGE_FORMAT='jpeg',
+)
+class RecipeImageProcessingTests(TestCase):
+    """Test uploaded images are oriented, stripped and re-encoded"""
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root) # noqa
+        self.settings_override.enable()
+        cache.clear()
+
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            email='user@example.com',
+            password='password123',
+        )
+        self.client.force_authenticate(self.user)
+        self.recipe = Recipe.objects.create(
+            user=self.user,
+            title='Sample recipe',
+            time_minutes=10,
+            price=Decimal('5.00'),
+        )
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root)
+
+    def upload(self, image):
+        return self.client.post(
+            image_upload_url(self.recipe.id),
+            {'image': image},
+            format='multipart',
+        )
+
+    def test_upload_reencoded_after_commit(self):
+        """Test uploads are oriented, resized, stripped and saved as progressive JPEG""" # noqa
+        photo = phone_photo()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            res = self.upload(photo)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['image_original_size'], photo.size)
+
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.image_original_size, photo.size)
+        self.assertLess(self.recipe.image_size, photo.size)
+        self.assertEqual(self.recipe.image.size, self.recipe.image_size)
+
+        with Image.open(self.recipe.image.path) as img:
+            self.assertEqual(img.format, 'JPEG')
+            self.assertEqual(img.size, (341, 1024))  # Portrait once oriented # noqa
+            self.assertTrue(img.info.get('progressive'))
+            self.assertNotIn('exif', img.info)
+            self.assertNotIn('icc_profile', img.info)
+
+    def test_stale_upload_not_applied(self):
+        """Test the result for a replaced image does not overwrite the newer image""" # noqa
+        with self.captureOnCommitCallbacks(execute=False):
+            self.upload(phone_photo())
+        self.recipe.refresh_from_db()
+        first = self.recipe.image.name
+
+        with override_settings(RECIPE_IMAGE_PROCESSING=False):
+            self.upload(phone_photo((200, 100)))
+        self.recipe.refresh_from_db()
+        second = self.recipe.image.name
+
+        self.assertEqual(process_recipe_image(self.recipe.id, first), 0)
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.image.name, second)
+
+    def test_processing_disabled(self):
+        """Test uploads are stored as is when processing is disabled"""
+        photo = phone_photo()
+
+        with override_settings(RECIPE_IMAGE_PROCESSING=False):
+            with self.captureOnCommitCallbacks(execute=True) as callbacks:
+                self.upload(photo)
+
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.image.size, photo.size)
+        self.assertEqual(self.recipe.image_size, photo.size)
+        self.assertEqual(len(callbacks), 0)
+
+    def test_savings_reported_in_stats(self):
+        """Test the recipe statistics report the bytes saved"""
+        photo = phone_photo()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.upload(photo)
+        self.recipe.refresh_from_db()
+
+        res = self.client.get(reverse('recipe:recipe-stats'))
+
+        images = res.data['images']
+        self.assertEqual(images['count'], 1)
+        self.assertEqual(images['original_bytes'], photo.size)
+        self.assertEqual(images['stored_bytes'], self.recipe.image_size)
+        self.assertEqual(images['saved_bytes'], photo.size - self.recipe.image_size) # noqa
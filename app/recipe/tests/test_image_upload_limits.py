@@ -0,0 +1,141 @@
+"""
+Test the size and memory limits of recipe image uploads
+"""
+from decimal import Decimal
+import os
+import shutil
+import struct
+import tempfile
+import tracemalloc
+import zlib
+
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient, APIRequestFactory, force_authenticate # noqa
+
+from PIL import Image
+from io import BytesIO
+
+from core.models import Recipe
+from recipe.views import RecipeViewSet
+
+
+def image_upload_url(recipe_id):
+    """Return URL for recipe image upload"""
+    return reverse('recipe:recipe-upload-image', args=[recipe_id])
+
+
+def png_chunk(kind, data):
+    """Return a PNG chunk with its length and checksum"""
+    return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data)) # noqa
+
+
+def png_bomb(width, height):
+    """Return a tiny PNG declaring huge dimensions"""
+    return (
+        b'\x89PNG\r\n\x1a\n'
+        + png_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 0, 0, 0, 0)) # noqa
+        + png_chunk(b'IDAT', zlib.compress(b'\x00' * 1024))
+        + png_chunk(b'IEND', b'')
+    )
+
+
+class RecipeImageUploadLimitTests(TestCase):
+    """Test uploads are bounded in size and memory"""
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root) # noqa
+        self.settings_override.enable()
+
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            email='user@example.com',
+            password='password123',
+        )
+        self.client.force_authenticate(self.user)
+        self.recipe = Recipe.objects.create(
+            user=self.user,
+            title='Sample recipe',
+            time_minutes=10,
+            price=Decimal('5.00'),
+        )
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root)
+
+    def test_upload_streamed_with_bounded_memory(self):
+        """Test a large upload is not buffered in memory"""
+        buffer = BytesIO()
+        Image.frombytes('RGB', (1600, 1600), os.urandom(1600 * 1600 * 3)).save(buffer, format='PNG') # noqa
+        upload = SimpleUploadedFile('photo.png', buffer.getvalue(), content_type='image/png') # noqa
+        self.assertGreater(upload.size, 5 * 1024 * 1024)
+
+        # The request body is encoded up front, so only handling it is measured # noqa
+        request = APIRequestFactory().post(
+            image_upload_url(self.recipe.id),
+            {'image': upload},
+            format='multipart',
+        )
+        force_authenticate(request, self.user)
+        view = RecipeViewSet.as_view({'post': 'upload_image'})
+
+        tracemalloc.start()
+        try:
+            res = view(request, pk=self.recipe.id)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertLess(peak, 1024 * 1024)
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.image.size, upload.size)
+
+    def test_upload_too_large(self):
+        """Test uploads above the byte limit are rejected"""
+        buffer = BytesIO()
+        Image.frombytes('RGB', (100, 100), os.urandom(100 * 100 * 3)).save(buffer, format='PNG') # noqa
+
+        with override_settings(RECIPE_IMAGE_MAX_UPLOAD_BYTES=1024):
+            res = self.client.post(
+                image_upload_url(self.recipe.id),
+                {'image': SimpleUploadedFile('photo.png', buffer.getvalue())},
+                format='multipart',
+            )
+
+        self.assertEqual(res.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE) # noqa
+        self.recipe.refresh_from_db()
+        self.assertFalse(self.recipe.image)
+
+    def test_decompression_bomb_rejected_from_header(self):
+        """Test images with too many pixels are rejected without allocating them""" # noqa
+        allocated = Image.core.get_stats()['new_count']
+
+        res = self.client.post(
+            image_upload_url(self.recipe.id),
+            {'image': SimpleUploadedFile('bomb.png', png_bomb(8000, 8000))},
+            format='multipart',
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('image', res.data)
+        self.assertEqual(Image.core.get_stats()['new_count'], allocated)
+
+    def test_unsupported_format_rejected(self):
+        """Test images in formats other than JPEG, PNG and WebP are rejected"""
+        buffer = BytesIO()
+        Image.new('RGB', (10, 10)).save(buffer, format='BMP')
+
+        res = self.client.post(
+            image_upload_url(self.recipe.id),
+            {'image': SimpleUploadedFile('photo.bmp', buffer.getvalue())},
+            format='multipart',
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
@@ -0,0 +1,206 @@
+"""
+Test the recipe image variants API
+"""
+from decimal import Decimal
+import os
+import shutil
+import tempfile
+import threading
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from PIL import Image
+from io import BytesIO
+
+from core.models import Recipe
+from recipe import images
+
+
+def variant_url(recipe_id):
+    """Return URL for recipe image variants"""
+    return reverse('recipe:recipe-image-variant', args=[recipe_id])
+
+
+def detail_url(recipe_id):
+    """Return recipe detail URL"""
+    return reverse('recipe:recipe-detail', args=[recipe_id])
+
+
+def sample_image(size=(800, 600)):
+    """Return an uploaded JPEG image"""
+    buffer = BytesIO()
+    Image.new('RGB', size, color='red').save(buffer, format='JPEG')
+    return SimpleUploadedFile('photo.jpg', buffer.getvalue(), content_type='image/jpeg') # noqa
+
+
+class RecipeImageVariantTests(TestCase):
+    """Test resizing recipe images on demand"""
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(
+            MEDIA_ROOT=self.media_root,
+            IMAGE_VARIANT_WORKERS=0,
+        )
+        self.settings_override.enable()
+
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            email='user@example.com',
+            password='password123',
+        )
+        self.client.force_authenticate(self.user)
+        self.recipe = Recipe.objects.create(
+            user=self.user,
+            title='Sample recipe',
+            time_minutes=10,
+            price=Decimal('5.00'),
+            image=sample_image(),
+        )
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root)
+
+    def test_resize_image(self):
+        """Test a variant is rendered at the requested width and format"""
+        res = self.client.get(variant_url(self.recipe.id), {'w': 320, 'fmt': 'png'}) # noqa
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res['Content-Type'], 'image/png')
+        with Image.open(BytesIO(b''.join(res.streaming_content))) as img:
+            self.assertEqual(img.format, 'PNG')
+            self.assertEqual(img.size, (320, 240))
+
+    def test_invalid_parameters(self):
+        """Test unsupported widths and formats are rejected"""
+        res = self.client.get(variant_url(self.recipe.id), {'w': 333})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+        res = self.client.get(variant_url(self.recipe.id), {'w': 320, 'fmt': 'bmp'}) # noqa
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_variant_rendered_once(self):
+        """Test concurrent and repeated requests render a variant only once"""
+        render = images.render_variant
+        calls = []
+
+        def counting_render(*args):
+            calls.append(args)
+            return render(*args)
+
+        with patch('recipe.images.render_variant', side_effect=counting_render): # noqa
+            threads = [
+                threading.Thread(
+                    target=images.get_variant,
+                    args=(self.recipe.image, 160, 'jpeg'),
+                )
+                for _ in range(5)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(len(calls), 1)
+
+    def test_variant_rendered_in_process_pool(self):
+        """Test variants can be rendered by worker processes"""
+        with override_settings(IMAGE_VARIANT_WORKERS=1):
+            path = images.get_variant(self.recipe.image, 640, 'jpeg')
+
+        with Image.open(path) as img:
+            self.assertEqual(img.size, (640, 480))
+
+    def test_cache_size_is_bounded(self):
+        """Test the least recently used variants are evicted"""
+        first = images.get_variant(self.recipe.image, 160, 'jpeg')
+        os.utime(first, (0, 0))  # Oldest entry
+        budget = os.path.getsize(first) + 1
+
+        with override_settings(IMAGE_VARIANT_CACHE_MAX_BYTES=budget):
+            second = images.get_variant(self.recipe.image, 320, 'jpeg')
+
+        self.assertFalse(os.path.exists(first))
+        self.assertFalse(os.path.exists(f'{first}.lock'))
+        self.assertTrue(os.path.exists(second))
+
+    def test_eviction_scans_over_budget_only(self):
+        """Test misses only scan the cache directory once the running size passes the budget""" # noqa
+        with patch('recipe.images._cache_size', 0), \
+                patch('recipe.images.os.scandir', wraps=os.scandir) as scandir: # noqa
+            first = images.get_variant(self.recipe.image, 160, 'jpeg')
+            scandir.assert_not_called()
+
+            with override_settings(IMAGE_VARIANT_CACHE_MAX_BYTES=os.path.getsize(first) + 1): # noqa
+                images.get_variant(self.recipe.image, 320, 'jpeg')
+            scandir.assert_called()
+
+    def test_eviction_keeps_held_locks(self):
+        """Test eviction leaves lock files held by another worker, which would otherwise render alongside the next one""" # noqa
+        first = images.get_variant(self.recipe.image, 160, 'jpeg')
+        os.utime(first, (0, 0))
+        budget = os.path.getsize(first) + 1
+        lock_fd = images._lock_file(f'{first}.lock')  # Another worker rendering it again # noqa
+        self.addCleanup(os.close, lock_fd)
+
+        with override_settings(IMAGE_VARIANT_CACHE_MAX_BYTES=budget):
+            images.get_variant(self.recipe.image, 320, 'jpeg')
+
+        self.assertFalse(os.path.exists(first))
+        self.assertEqual(os.stat(f'{first}.lock').st_ino, os.fstat(lock_fd).st_ino) # noqa
+
+    def test_variant_evicted_before_open(self):
+        """Test a variant evicted between its lookup and its opening is rendered again""" # noqa
+        get_variant = images.get_variant
+        calls = []
+
+        def evicting_get_variant(*args):
+            path = get_variant(*args)
+            calls.append(path)
+            if len(calls) < 3:
+                os.remove(path)  # Evicted by another worker
+            return path
+
+        with patch('recipe.images.get_variant', side_effect=evicting_get_variant): # noqa
+            res = self.client.get(variant_url(self.recipe.id), {'w': 160, 'fmt': 'jpeg'}) # noqa
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        with Image.open(BytesIO(b''.join(res.streaming_content))) as img:
+            self.assertEqual(img.size, (160, 120))
+
+    def test_missing_source_image(self):
+        """Test a recipe whose image file is gone has no variants, with or without X-Accel-Redirect""" # noqa
+        os.remove(self.recipe.image.path)
+
+        for x_accel in (False, True):
+            with override_settings(MEDIA_X_ACCEL_REDIRECT=x_accel):
+                res = self.client.get(variant_url(self.recipe.id), {'w': 160, 'fmt': 'jpeg'}) # noqa
+
+            self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_other_users_recipe(self):
+        """Test variants of other users' recipes are not served"""
+        self.client.force_authenticate(get_user_model().objects.create_user(
+            email='other@example.com',
+            password='password123',
+        ))
+
+        res = self.client.get(variant_url(self.recipe.id))
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_detail_lists_variants(self):
+        """Test the recipe detail has srcset style variant URLs"""
+        res = self.client.get(detail_url(self.recipe.id))
+
+        srcset = res.data['image_srcset'].split(', ')
+        self.assertEqual(len(srcset), 4)
+        self.assertTrue(srcset[0].endswith(f'?w=160&fmt={images.DEFAULT_FORMAT} 160w')) # noqa
@@ -11,7 +11,7 @@ from rest_framework.test import APIClient
 
 from core.models import Ingredient, Recipe
 
-from recipe.serializers import IngredientSerializer
+from recipe.serializers import IngredientDetailSerializer
 
 
 INGREDIENTS_URL = reverse("recipe:ingredient-list")
@@ -56,7 +56,7 @@ class PrivateIngredientsApiTests(TestCase):
         res = self.client.get(INGREDIENTS_URL)
 
         ingredients = Ingredient.objects.all().order_by("-name")
-        serializer = IngredientSerializer(ingredients, many=True)
+        serializer = IngredientDetailSerializer(ingredients, many=True)
 
         self.assertEqual(res.status_code, status.HTTP_200_OK)
         self.assertEqual(res.data, serializer.data)
@@ -118,8 +118,9 @@ class PrivateIngredientsApiTests(TestCase):
 
         res = self.client.get(INGREDIENTS_URL, {'assigned_only': 1})
 
-        serializer1 = IngredientSerializer(ingredient1)
-        serializer2 = IngredientSerializer(ingredient2)
+        ingredient1.refresh_from_db()  # Pick up the recipe_count maintained in the database # noqa
+        serializer1 = IngredientDetailSerializer(ingredient1)
+        serializer2 = IngredientDetailSerializer(ingredient2)
 
         self.assertIn(serializer1.data, res.data)
         self.assertNotIn(serializer2.data, res.data)
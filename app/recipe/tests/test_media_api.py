@@ -0,0 +1,117 @@
+"""
+Test the protected recipe media API
+"""
+from decimal import Decimal
+import shutil
+import tempfile
+
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from PIL import Image
+from io import BytesIO
+
+from core.models import Recipe
+
+
+def media_url(name):
+    """Return the URL serving a recipe image file"""
+    return reverse('recipe:recipe-media', args=[name])
+
+
+def variant_url(recipe_id):
+    """Return URL for recipe image variants"""
+    return reverse('recipe:recipe-image-variant', args=[recipe_id])
+
+
+def sample_image():
+    """Return an uploaded JPEG image"""
+    buffer = BytesIO()
+    Image.new('RGB', (200, 100), color='red').save(buffer, format='JPEG')
+    return SimpleUploadedFile('photo.jpg', buffer.getvalue(), content_type='image/jpeg') # noqa
+
+
+@override_settings(MEDIA_X_ACCEL_REDIRECT=True, IMAGE_VARIANT_WORKERS=0)
+class RecipeMediaApiTests(TestCase):
+    """Test recipe images are only sent to the owners of the recipes"""
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root) # noqa
+        self.settings_override.enable()
+
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            email='user@example.com',
+            password='password123',
+        )
+        self.client.force_authenticate(self.user)
+        self.recipe = Recipe.objects.create(
+            user=self.user,
+            title='Sample recipe',
+            time_minutes=10,
+            price=Decimal('5.00'),
+            image=sample_image(),
+        )
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root)
+
+    def test_image_handed_to_nginx(self):
+        """Test the response only names the file for nginx to send"""
+        name = self.recipe.image.name
+
+        res = self.client.get(media_url(name))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res['X-Accel-Redirect'], f'/protected-media/{name}')
+        self.assertEqual(res['Content-Type'], 'image/jpeg')
+        self.assertEqual(res['Cache-Control'], 'private, max-age=3600')
+        self.assertEqual(res.content, b'')
+
+    def test_image_url_points_to_media_view(self):
+        """Test recipe image URLs go through the protected media view"""
+        res = self.client.get(reverse('recipe:recipe-detail', args=[self.recipe.id])) # noqa
+
+        self.assertTrue(res.data['image'].endswith(media_url(self.recipe.image.name))) # noqa
+
+    def test_other_users_image(self):
+        """Test images of other users' recipes are not served"""
+        self.client.force_authenticate(get_user_model().objects.create_user(
+            email='other@example.com',
+            password='password123',
+        ))
+
+        res = self.client.get(media_url(self.recipe.image.name))
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertNotIn('X-Accel-Redirect', res)
+
+    def test_auth_required(self):
+        """Test anonymous requests are rejected"""
+        res = APIClient().get(media_url(self.recipe.image.name))
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_variant_handed_to_nginx(self):
+        """Test image variants are sent by nginx as well"""
+        res = self.client.get(variant_url(self.recipe.id), {'w': 160, 'fmt': 'png'}) # noqa
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertTrue(res['X-Accel-Redirect'].startswith('/protected-media/cache/variants/')) # noqa
+        self.assertEqual(res['Content-Type'], 'image/png')
+
+    def test_streamed_without_nginx(self):
+        """Test the file is sent by Django when X-Accel-Redirect is disabled"""
+        with override_settings(MEDIA_X_ACCEL_REDIRECT=False):
+            res = self.client.get(media_url(self.recipe.image.name))
+
+        self.assertNotIn('X-Accel-Redirect', res)
+        with open(self.recipe.image.path, 'rb') as f:
+            self.assertEqual(b''.join(res.streaming_content), f.read())
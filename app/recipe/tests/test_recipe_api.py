@@ -91,6 +91,26 @@ class PrivateRecipeApiTests(TestCase):
         self.assertEqual(res.status_code, status.HTTP_200_OK)
         self.assertEqual(res.data, serializer.data)  # Compare the data in the response to the serializer data # noqa
 
+    def test_list_renders_from_snapshot(self):
+        """Test listing recipes created through the API does not query tags or ingredients""" # noqa
+        payload = {
+            'title': 'Thai prawn red curry',
+            'tags': [{'name': 'Thai'}, {'name': 'Dinner'}],
+            'ingredients': [{'name': 'Prawns'}],
+            'time_minutes': 20,
+            'price': Decimal('7.00'),
+        }
+        for _ in range(3):
+            self.client.post(RECIPES_URL, payload, format='json')
+
+        with self.assertNumQueries(1):
+            res = self.client.get(RECIPES_URL)
+
+        recipes = Recipe.objects.all().order_by('-id')
+        with self.settings(RECIPE_ATTRS_SNAPSHOT=False):
+            serializer = RecipeSerializer(recipes, many=True)
+            self.assertEqual(res.data, serializer.data)
+
     def test_recipe_list_limited_to_user(self):
         """Test that recipes for the authenticated user are returned"""
         other_user = create_user(
@@ -509,6 +529,40 @@ class PrivateRecipeApiTests(TestCase):
         self.assertIn(serializer2.data, res.data)
         self.assertNotIn(serializer3.data, res.data)
 
+    def test_filter_recipes_by_tags_and_ingredients(self):
+        """Test filtering by both tags and ingredients returns recipes matching both""" # noqa
+        common = Tag.objects.create(user=self.user, name='Dinner')
+        rare = Ingredient.objects.create(user=self.user, name='Saffron')
+        other = Ingredient.objects.create(user=self.user, name='Rice')
+
+        r1 = create_recipe(user=self.user, title='Paella')
+        r2 = create_recipe(user=self.user, title='Risotto')
+        r3 = create_recipe(user=self.user, title='Saffron buns')
+        for recipe in (r1, r2):
+            recipe.tags.add(common)
+        r1.ingredients.add(rare, other)
+        r2.ingredients.add(other)
+        r3.ingredients.add(rare)
+
+        params = {'tags': f'{common.id}', 'ingredients': f'{rare.id}'}
+        res = self.client.get(RECIPES_URL, params)
+
+        self.assertEqual([recipe['id'] for recipe in res.data], [r1.id])
+
+    def test_filter_ignores_other_users_tags(self):
+        """Test filtering by another user's tag returns no recipes"""
+        other_user = create_user(email='other@example.com', password='pass123') # noqa
+        tag = Tag.objects.create(user=other_user, name='Dinner')
+        ingredient = Ingredient.objects.create(user=self.user, name='Rice')
+        recipe = create_recipe(user=self.user)
+        recipe.ingredients.add(ingredient)
+        create_recipe(user=other_user).tags.add(tag)
+
+        params = {'tags': f'{tag.id}', 'ingredients': f'{ingredient.id}'}
+        res = self.client.get(RECIPES_URL, params)
+
+        self.assertEqual(res.data, [])
+
 
 class RecipeImageUploadTests(TestCase):
     """Tests for image upload api"""
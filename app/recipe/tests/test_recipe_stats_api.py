@@ -0,0 +1,144 @@
+"""
+Test the recipe statistics API
+"""
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import Recipe, Tag, Ingredient
+
+
+STATS_URL = reverse('recipe:recipe-stats')
+
+
+def create_recipe(user, **params):
+    """Create and return a sample recipe"""
+    defaults = {
+        'title': 'Sample recipe',
+        'time_minutes': 10,
+        'price': Decimal('5.00'),
+    }
+    defaults.update(params)
+
+    return Recipe.objects.create(user=user, **defaults)
+
+
+def create_user(**params):
+    return get_user_model().objects.create_user(**params)
+
+
+class PublicRecipeStatsApiTests(TestCase):
+    """Test unauthenticated recipe statistics API access"""
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def test_auth_required(self):
+        """Test that authentication is required"""
+        res = self.client.get(STATS_URL)
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class PrivateRecipeStatsApiTests(TestCase):
+    """Test authenticated recipe statistics API access"""
+
+    def setUp(self):
+        cache.clear()  # Statistics are cached per user ID, which can be reused between tests # noqa
+        self.client = APIClient()
+        self.user = create_user(email='test@example.com', password='password123') # noqa
+        self.client.force_authenticate(self.user)
+
+    def test_stats_without_recipes(self):
+        """Test statistics of a user without recipes"""
+        res = self.client.get(STATS_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['recipe_count'], 0)
+        self.assertIsNone(res.data['time_minutes'])
+        self.assertIsNone(res.data['price'])
+        self.assertEqual(res.data['top_tags'], [])
+
+    def test_stats_aggregates(self):
+        """Test averages, medians, percentiles and histograms"""
+        for minutes, price in [(10, '2.00'), (20, '4.00'), (30, '6.00'), (40, '8.00')]: # noqa
+            create_recipe(user=self.user, time_minutes=minutes, price=Decimal(price)) # noqa
+        create_recipe(user=create_user(email='other@example.com', password='password123'), time_minutes=500) # noqa
+
+        res = self.client.get(STATS_URL)
+
+        self.assertEqual(res.data['recipe_count'], 4)
+        time_minutes = res.data['time_minutes']
+        self.assertEqual(time_minutes['min'], 10)
+        self.assertEqual(time_minutes['max'], 40)
+        self.assertEqual(time_minutes['avg'], 25)
+        self.assertEqual(time_minutes['median'], 25)
+        self.assertEqual(time_minutes['percentiles']['p90'], 37)
+        self.assertEqual(sum(b['count'] for b in time_minutes['histogram']), 4) # noqa
+        self.assertEqual(res.data['price']['median'], 5)
+
+    def test_top_tags_and_ingredients(self):
+        """Test the most used tags and ingredients are listed first"""
+        r1 = create_recipe(user=self.user)
+        r2 = create_recipe(user=self.user)
+        vegan = Tag.objects.create(user=self.user, name='Vegan')
+        quick = Tag.objects.create(user=self.user, name='Quick')
+        Tag.objects.create(user=self.user, name='Unused')
+        salt = Ingredient.objects.create(user=self.user, name='Salt')
+        r1.tags.add(vegan, quick)
+        r2.tags.add(vegan)
+        r1.ingredients.add(salt)
+
+        res = self.client.get(STATS_URL)
+
+        self.assertEqual(res.data['top_tags'], [
+            {'id': vegan.id, 'name': 'Vegan', 'count': 2},
+            {'id': quick.id, 'name': 'Quick', 'count': 1},
+        ])
+        self.assertEqual(res.data['top_ingredients'], [
+            {'id': salt.id, 'name': 'Salt', 'count': 1},
+        ])
+
+    def test_stats_are_cached(self):
+        """Test repeated requests are served from the cache"""
+        create_recipe(user=self.user)
+        self.client.get(STATS_URL)
+
+        with self.assertNumQueries(0):
+            res = self.client.get(STATS_URL)
+
+        self.assertEqual(res.data['recipe_count'], 1)
+
+    def test_cache_invalidated_on_recipe_write(self):
+        """Test creating, updating and deleting recipes refreshes the statistics""" # noqa
+        recipe = create_recipe(user=self.user, time_minutes=10)
+        self.client.get(STATS_URL)
+
+        recipe.time_minutes = 50
+        recipe.save()
+        res = self.client.get(STATS_URL)
+        self.assertEqual(res.data['time_minutes']['max'], 50)
+
+        create_recipe(user=self.user)
+        res = self.client.get(STATS_URL)
+        self.assertEqual(res.data['recipe_count'], 2)
+
+        recipe.delete()
+        res = self.client.get(STATS_URL)
+        self.assertEqual(res.data['recipe_count'], 1)
+
+    def test_cache_invalidated_on_tag_assignment(self):
+        """Test assigning a tag refreshes the most used tags"""
+        recipe = create_recipe(user=self.user)
+        tag = Tag.objects.create(user=self.user, name='Dinner')
+        self.client.get(STATS_URL)
+
+        recipe.tags.add(tag)
+        res = self.client.get(STATS_URL)
+
+        self.assertEqual(res.data['top_tags'][0]['name'], 'Dinner')
@@ -0,0 +1,112 @@
+"""
+Test the shopping list API
+"""
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import Recipe, Ingredient
+
+
+SHOPPING_LIST_URL = reverse('recipe:recipe-shopping-list')
+
+
+def create_recipe(user, **params):
+    """Create and return a sample recipe"""
+    defaults = {
+        'title': 'Sample recipe',
+        'time_minutes': 10,
+        'price': Decimal('5.00'),
+    }
+    defaults.update(params)
+
+    return Recipe.objects.create(user=user, **defaults)
+
+
+def create_user(**params):
+    return get_user_model().objects.create_user(**params)
+
+
+class PublicShoppingListApiTests(TestCase):
+    """Test unauthenticated shopping list API access"""
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def test_auth_required(self):
+        """Test that authentication is required"""
+        res = self.client.get(SHOPPING_LIST_URL, {'recipes': '1'})
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class PrivateShoppingListApiTests(TestCase):
+    """Test authenticated shopping list API access"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user(email='test@example.com', password='password123') # noqa
+        self.client.force_authenticate(self.user)
+
+    def test_merges_ingredients_across_recipes(self):
+        """Test shared ingredients are listed once with the recipes using them""" # noqa
+        r1 = create_recipe(user=self.user, title='Pancakes')
+        r2 = create_recipe(user=self.user, title='Omelette')
+        eggs = Ingredient.objects.create(user=self.user, name='Eggs')
+        flour = Ingredient.objects.create(user=self.user, name='Flour')
+        r1.ingredients.add(eggs, flour)
+        r2.ingredients.add(eggs)
+
+        res = self.client.get(SHOPPING_LIST_URL, {'recipes': f'{r1.id},{r2.id}'}) # noqa
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data, [
+            {'id': eggs.id, 'name': 'Eggs', 'count': 2, 'recipes': [r1.id, r2.id]}, # noqa
+            {'id': flour.id, 'name': 'Flour', 'count': 1, 'recipes': [r1.id]}, # noqa
+        ])
+
+    def test_only_selected_recipes_are_used(self):
+        """Test ingredients of recipes not in the list are left out"""
+        r1 = create_recipe(user=self.user)
+        r2 = create_recipe(user=self.user)
+        r1.ingredients.add(Ingredient.objects.create(user=self.user, name='Salt')) # noqa
+        r2.ingredients.add(Ingredient.objects.create(user=self.user, name='Sugar')) # noqa
+
+        res = self.client.get(SHOPPING_LIST_URL, {'recipes': f'{r1.id}'})
+
+        self.assertEqual([item['name'] for item in res.data], ['Salt'])
+
+    def test_other_users_recipes_ignored(self):
+        """Test recipes of other users do not leak into the list"""
+        other_user = create_user(email='other@example.com', password='password123') # noqa
+        recipe = create_recipe(user=other_user)
+        recipe.ingredients.add(Ingredient.objects.create(user=other_user, name='Saffron')) # noqa
+
+        res = self.client.get(SHOPPING_LIST_URL, {'recipes': f'{recipe.id}'})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data, [])
+
+    def test_single_query(self):
+        """Test the list is computed with one query"""
+        recipes = [create_recipe(user=self.user) for _ in range(5)]
+        for i, recipe in enumerate(recipes):
+            recipe.ingredients.add(Ingredient.objects.create(user=self.user, name=f'Ingredient {i}')) # noqa
+        ids = ','.join(str(recipe.id) for recipe in recipes)
+
+        with self.assertNumQueries(1):
+            res = self.client.get(SHOPPING_LIST_URL, {'recipes': ids})
+
+        self.assertEqual(len(res.data), 5)
+
+    def test_invalid_recipe_ids(self):
+        """Test a missing or malformed recipes parameter returns an error"""
+        res = self.client.get(SHOPPING_LIST_URL)
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+        res = self.client.get(SHOPPING_LIST_URL, {'recipes': '1,abc'})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
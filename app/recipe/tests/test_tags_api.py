@@ -12,7 +12,7 @@ from rest_framework.test import APIClient
 
 from core.models import Tag, Recipe
 
-from recipe.serializers import TagSerializer
+from recipe.serializers import TagDetailSerializer
 
 from decimal import Decimal
 
@@ -58,7 +58,7 @@ class PrivateTagsApiTests(TestCase):
         res = self.client.get(TAGS_URL)
 
         tags = Tag.objects.all().order_by('-name')  # Order by name in descending order # noqa
-        serializer = TagSerializer(tags, many=True)
+        serializer = TagDetailSerializer(tags, many=True)
 
         self.assertEqual(res.status_code, status.HTTP_200_OK)
         self.assertEqual(res.data, serializer.data)
@@ -113,8 +113,9 @@ class PrivateTagsApiTests(TestCase):
 
         res = self.client.get(TAGS_URL, {'assigned_only': 1})
 
-        serializer1 = TagSerializer(tag1)
-        serializer2 = TagSerializer(tag2)
+        tag1.refresh_from_db()  # Pick up the recipe_count maintained in the database # noqa
+        serializer1 = TagDetailSerializer(tag1)
+        serializer2 = TagDetailSerializer(tag2)
 
         self.assertIn(serializer1.data, res.data)
         self.assertNotIn(serializer2.data, res.data)
@@ -145,3 +146,40 @@ class PrivateTagsApiTests(TestCase):
         res = self.client.get(TAGS_URL, {'assigned_only': 1})
 
         self.assertEqual(len(res.data), 1)
+
+    def test_order_tags_by_popularity(self):
+        """Test ordering tags by the number of recipes using them"""
+        rare = Tag.objects.create(user=self.user, name='Brunch')
+        common = Tag.objects.create(user=self.user, name='Appetizer')
+
+        for title in ('Eggs', 'Toast'):
+            recipe = Recipe.objects.create(
+                user=self.user,
+                title=title,
+                time_minutes=10,
+                price=Decimal('5.00')
+            )
+            recipe.tags.add(common)
+        recipe.tags.add(rare)
+
+        res = self.client.get(TAGS_URL, {'popular': 1})
+
+        self.assertEqual([tag['id'] for tag in res.data], [common.id, rare.id])
+        self.assertEqual([tag['recipe_count'] for tag in res.data], [2, 1])
+
+    def test_rename_tag_updates_recipe_snapshots(self):
+        """Test renaming a tag is reflected in the recipes using it"""
+        tag = Tag.objects.create(user=self.user, name='Diner')
+        recipe = Recipe.objects.create(
+            user=self.user,
+            title='Pancakes',
+            time_minutes=10,
+            price=Decimal('5.00')
+        )
+        recipe.tags.add(tag)
+        recipe.refresh_attrs_snapshot()
+
+        self.client.patch(detail_url(tag.id), {'name': 'Dinner'})
+
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.attrs_snapshot['tags'], [{'id': tag.id, 'name': 'Dinner'}]) # noqa
@@ -0,0 +1,254 @@
+"""
+    Bounded-memory upload pipeline for recipe images.
+    Uploads are streamed to a temporary file with an enforced byte limit, and images are validated from their header only, # noqa
+    so oversize files and decompression bombs are rejected before any pixel buffer is allocated. # noqa
+    Once committed, uploads are re-encoded off the request thread: oriented, stripped of metadata, capped in size and saved as optimized progressive images. # noqa
+"""
+
+import logging
+import tempfile
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.db import close_old_connections
+from django.utils.translation import gettext_lazy as _
+
+from rest_framework import exceptions, serializers, status
+
+from PIL import Image, ImageOps, features
+
+from core.executors import InlineExecutor, get_executor
+from core.models import Recipe, release_recipe_image
+from core.routers import use_shard_of
+from recipe.images import FORMATS
+from recipe.stats import invalidate_recipe_stats
+
+
+logger = logging.getLogger(__name__)
+
+
+class UploadTooLarge(exceptions.APIException):
+    """Raised while streaming an upload which exceeds the size limit"""
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = _('Uploaded file is too large.')
+    default_code = 'upload_too_large'
+
+
+class LimitedTemporaryFileUploadHandler(TemporaryFileUploadHandler):
+    """Stream every uploaded file to a temporary file on disk, aborting once it exceeds max_file_bytes""" # noqa
+
+    # Room for the multipart boundaries and form fields around the files
+    FORM_OVERHEAD_BYTES = 64 * 1024
+
+    def __init__(self, request=None, max_file_bytes=None, max_files=1):
+        super().__init__(request)
+        self.max_file_bytes = max_file_bytes or settings.RECIPE_IMAGE_MAX_UPLOAD_BYTES # noqa
+        self.max_files = max_files
+        self.file_count = 0
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None): # noqa
+        """Reject requests announcing a body larger than the files allowed, before reading it""" # noqa
+        limit = self.max_file_bytes * self.max_files + self.FORM_OVERHEAD_BYTES
+        if content_length > limit:
+            raise UploadTooLarge()
+
+    def new_file(self, *args, **kwargs):
+        """Start a temporary file for the next part, unless the request already had max_files""" # noqa
+        self.file_count += 1
+        if self.file_count > self.max_files:
+            raise UploadTooLarge(
+                _('At most %(limit)d files can be uploaded at once.') % {'limit': self.max_files}, # noqa
+            )
+
+        super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        """Write the chunk to disk, unless the file grew past the limit"""
+        if start + len(raw_data) > self.max_file_bytes:
+            self.file.close()  # Deletes the temporary file
+            raise UploadTooLarge(
+                _('Uploaded file is larger than %(limit)d bytes.') % {'limit': self.max_file_bytes}, # noqa
+            )
+
+        return super().receive_data_chunk(raw_data, start)
+
+
+def validate_image_header(file_object):
+    """Check format and dimensions of an uploaded image from its header, without decoding the pixels""" # noqa
+    file_object.seek(0)
+    try:
+        # Image.open only parses the header. Pillow's own bomb check is a backstop for our lower limit # noqa
+        with Image.open(file_object) as img:
+            if img.format not in settings.RECIPE_IMAGE_FORMATS:
+                raise serializers.ValidationError(
+                    _('Unsupported image format. Use one of %(formats)s.') % {'formats': ', '.join(settings.RECIPE_IMAGE_FORMATS)}, # noqa
+                    code='invalid_image',
+                )
+
+            if img.width * img.height > settings.RECIPE_IMAGE_MAX_PIXELS:
+                raise serializers.ValidationError(
+                    _('Image is larger than %(limit)d pixels.') % {'limit': settings.RECIPE_IMAGE_MAX_PIXELS}, # noqa
+                    code='image_too_large',
+                )
+
+            img.verify()  # Structural checks (chunks, checksums), still no full decode # noqa
+    except serializers.ValidationError:
+        raise
+    except Exception:
+        raise serializers.ValidationError(
+            _('Upload a valid image. The file you uploaded was either not an image or a corrupted image.'), # noqa
+            code='invalid_image',
+        )
+    finally:
+        file_object.seek(0)
+
+
+class BoundedImageField(serializers.ImageField):
+    """Image field validating uploads with validate_image_header instead of Django's ImageField""" # noqa
+
+    def to_internal_value(self, data):
+        file_object = serializers.FileField.to_internal_value(self, data)
+        validate_image_header(file_object)
+        return file_object
+
+
+def _store_upload(recipe, upload):
+    """Validate an uploaded image and write it to storage. Runs on a pool thread, without database access""" # noqa
+    validate_image_header(upload)
+    field = Recipe._meta.get_field('image')
+    return field.storage.save(field.generate_filename(recipe, upload.name), upload) # noqa
+
+
+def store_recipe_images(recipes, uploads):
+    """Validate and store the uploads of several recipes in parallel.
+    Returns {recipe id: stored name, or the ValidationError of the upload}"""
+    executor = get_executor(
+        'image-uploads',
+        settings.RECIPE_IMAGE_BATCH_WORKERS,
+    )
+    futures = {
+        pk: executor.submit(_store_upload, recipes[pk], upload)
+        for pk, upload in uploads.items()
+    }
+
+    results = {}
+    for pk, future in futures.items():
+        try:
+            results[pk] = future.result()
+        except serializers.ValidationError as e:
+            results[pk] = e
+
+    return results
+
+
+def _to_srgb(img):
+    """Convert an image with an embedded colour profile to sRGB, so dropping the profile keeps its colours""" # noqa
+    icc_profile = img.info.get('icc_profile')
+    if not icc_profile or not features.check('littlecms2'):
+        return img
+
+    from PIL import ImageCms
+
+    try:
+        return ImageCms.profileToProfile(
+            img,
+            ImageCms.ImageCmsProfile(BytesIO(icc_profile)),
+            ImageCms.createProfile('sRGB'),
+            outputMode='RGBA' if 'A' in img.getbands() else 'RGB',
+        )
+    except (OSError, ImageCms.PyCMSError):  # Unreadable profile, keep the pixels as they are # noqa
+        return img
+
+
+def reencode_image(source, target, image_format, max_dimension, quality):
+    """Apply the EXIF orientation, cap the dimensions and save source to target without metadata""" # noqa
+    with Image.open(source) as img:
+        img.draft('RGB', (max_dimension, max_dimension))  # Let JPEG decode at a reduced scale # noqa
+        img = ImageOps.exif_transpose(img)
+        img.thumbnail((max_dimension, max_dimension))  # Keeps the aspect ratio, never upscales # noqa
+
+        has_alpha = 'A' in img.getbands() or 'transparency' in img.info
+        img = img.convert('RGBA' if has_alpha else 'RGB')
+        img = _to_srgb(img)
+
+        if image_format == 'JPEG' and has_alpha:
+            background = Image.new('RGB', img.size, 'white')
+            background.paste(img, mask=img.getchannel('A'))
+            img = background
+
+        # EXIF, ICC and other metadata are only written when passed to save() # noqa
+        options = {'quality': quality, 'optimize': True}
+        if image_format == 'JPEG':
+            options['progressive'] = True
+        elif image_format == 'WEBP':
+            options['method'] = 6
+
+        img.save(target, format=image_format, **options)
+
+
+def process_recipe_image(recipe_id, name):
+    """Re-encode the image blob of a recipe and point the recipe at the result, unless the image changed meanwhile""" # noqa
+    fmt = settings.RECIPE_IMAGE_FORMAT if settings.RECIPE_IMAGE_FORMAT in FORMATS else 'jpeg' # noqa
+    image_format, ext, _ = FORMATS[fmt]
+    storage = Recipe._meta.get_field('image').storage
+
+    with tempfile.TemporaryFile() as tmp:
+        with storage.open(name) as source:
+            reencode_image(
+                source,
+                tmp,
+                image_format,
+                settings.RECIPE_IMAGE_MAX_DIMENSION,
+                settings.RECIPE_IMAGE_QUALITY,
+            )
+        size = tmp.tell()
+        tmp.seek(0)
+        processed = storage.save(f'image.{ext}', File(tmp))
+
+    # Conditional update, so a newer upload is never overwritten with the result for an older one # noqa
+    updated = Recipe.objects.filter(pk=recipe_id, image=name).update(
+        image=processed,
+        image_size=size,
+    )
+
+    if updated:
+        release_recipe_image(name)
+        invalidate_recipe_stats(
+            Recipe.objects.values_list('user_id', flat=True).get(pk=recipe_id), # noqa
+        )
+    else:
+        release_recipe_image(processed)
+
+    return updated
+
+
+def _run_processing(recipe_id, user_id, name, close_connection):
+    """Run process_recipe_image, logging failures as nobody waits for the result""" # noqa
+    try:
+        # Pool threads have no request, the owner selects the shard
+        with use_shard_of(user_id):
+            process_recipe_image(recipe_id, name)
+    except Exception:
+        logger.exception('Processing the image of recipe %s failed', recipe_id) # noqa
+    finally:
+        if close_connection:
+            close_old_connections()
+
+
+def schedule_image_processing(recipe_id, user_id, name):
+    """Re-encode a newly uploaded image in the background. Call once the upload is committed""" # noqa
+    executor = get_executor(
+        'image-processing',
+        settings.RECIPE_IMAGE_PROCESSING_WORKERS,
+    )
+
+    # Pool threads have their own database connection, the request thread must keep its one open # noqa
+    executor.submit(
+        _run_processing,
+        recipe_id,
+        user_id,
+        name,
+        close_connection=not isinstance(executor, InlineExecutor),
+    )
@@ -19,5 +19,6 @@ router.register('ingredients', views.IngredientViewSet)
 app_name = 'recipe'
 
 urlpatterns = [
-    path('', include(router.urls))  # Include the URLs generated by the router
+    path('', include(router.urls)),  # Include the URLs generated by the router # noqa
+    path('media/<path:name>', views.RecipeMediaView.as_view(), name='recipe-media'), # noqa
 ]
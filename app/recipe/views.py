@@ -16,13 +16,31 @@ from drf_spectacular.utils import (
     OpenApiTypes,
 )
 
-from rest_framework.authentication import TokenAuthentication
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
+from rest_framework.views import APIView
 
+from django.conf import settings
+from django.db import router, transaction
+
+from itertools import groupby
+
+from core.authentication import (
+    CachedTokenAuthentication,
+    SignedTokenAuthentication,
+)
+from core.media import protected_media_response
 from core.models import Recipe, Tag, Ingredient
-from recipe import serializers
+from recipe import serializers, images
+from recipe.filters import filter_recipes
+from recipe.stats import get_recipe_stats
+from recipe.uploads import (
+    LimitedTemporaryFileUploadHandler,
+    schedule_image_processing,
+    store_recipe_images,
+)
 
 
 # Extend the schema view to add custom parameters to the API documentation # noqa
@@ -40,7 +58,40 @@ from recipe import serializers
                 description='Comma separated list of ingredients to filter by',
             ),
         ]
-    )
+    ),
+    shopping_list=extend_schema(
+        parameters=[
+            OpenApiParameter(
+                name='recipes',
+                type=OpenApiTypes.STR,
+                description='Comma separated list of recipe IDs to build the shopping list from', # noqa
+                required=True,
+            ),
+        ]
+    ),
+    stats=extend_schema(responses=OpenApiTypes.OBJECT),
+    upload_images=extend_schema(
+        description='Upload images to several recipes at once. Each multipart file is named after the ID of its recipe', # noqa
+        request={'multipart/form-data': OpenApiTypes.OBJECT},
+        responses=OpenApiTypes.OBJECT,
+    ),
+    image_variant=extend_schema(
+        parameters=[
+            OpenApiParameter(
+                name='w',
+                type=OpenApiTypes.INT,
+                enum=settings.IMAGE_VARIANT_WIDTHS,
+                description='Maximum width of the image, in pixels',
+            ),
+            OpenApiParameter(
+                name='fmt',
+                type=OpenApiTypes.STR,
+                enum=list(images.FORMATS),
+                description='Image format',
+            ),
+        ],
+        responses={(200, 'image/*'): OpenApiTypes.BINARY},
+    ),
 )
 class RecipeViewSet(viewsets.ModelViewSet):
     """View for Manage recipe APIs in the database"""
@@ -48,8 +99,14 @@ class RecipeViewSet(viewsets.ModelViewSet):
 
     queryset = Recipe.objects.all()  # Models to be queried from the database # noqa
 
-    authentication_classes = [TokenAuthentication]
+    authentication_classes = [
+        CachedTokenAuthentication,
+        SignedTokenAuthentication,
+    ]
     permission_classes = [IsAuthenticated]
+    throttle_scope = 'recipes'
+    throttle_write_scope = 'recipe-writes'
+    replica_actions = ('list', 'retrieve')  # Read from the replicas, see core/routers.py # noqa
 
     def _params_to_ints(self, qs):  # qs is a query string
         """Convert a list of string IDs to a list of integers"""
@@ -62,25 +119,24 @@ class RecipeViewSet(viewsets.ModelViewSet):
         tags = self.request.query_params.get('tags')  # Get the tags query parameter # noqa
         ingredients = self.request.query_params.get('ingredients')  # Get the ingredients query parameter # noqa
 
-        queryset = self.queryset  # Get the queryset # noqa
-
-        if tags:
-            tag_ids = self._params_to_ints(tags)  # Convert the tags str list to integers # noqa
-            queryset = queryset.filter(tags__id__in=tag_ids)
-
-        if ingredients:
-            ingredient_ids = self._params_to_ints(ingredients)
-            queryset = queryset.filter(ingredients__id__in=ingredient_ids)
+        # Filters are applied most selective first, as semi-joins, so no distinct is needed # noqa
+        queryset = filter_recipes(
+            self.queryset,
+            self.request.user,
+            tags=self._params_to_ints(tags) if tags else None,  # Convert the tags str list to integers # noqa
+            ingredients=self._params_to_ints(ingredients) if ingredients else None, # noqa
+        )
 
-        # Distinct because multiple tags and ingredients can be selected, for multiple recipies # noqa
-        return queryset.filter(user=self.request.user).order_by('-id').distinct()  # noqa
+        return queryset.filter(user=self.request.user).order_by('-id')
 
     def get_serializer_class(self):
         """Return aserializer class for Request"""
         if self.action == 'list':  # If the action is list, return the preview serializer # noqa
             return serializers.RecipeSerializer
-        elif self.action == 'upload_image':  # If the action is upload_image, return the image serializer # noqa
+        elif self.action in ('upload_image', 'upload_images'):  # If the action uploads images, return the image serializer # noqa
             return serializers.RecipeImageSerializer
+        elif self.action == 'shopping_list':
+            return serializers.ShoppingListItemSerializer
 
         return self.serializer_class
 
@@ -95,15 +151,161 @@ class RecipeViewSet(viewsets.ModelViewSet):
         # pk is the primary key of the recipe # noqa
         """upload an image to a recipe"""
 
+        # Stream the upload to disk with a size limit. Must be set before request.data is parsed # noqa
+        request.upload_handlers = [LimitedTemporaryFileUploadHandler(request)]
+
         recipe = self.get_object()  # Get the recipe object # noqa
         serializer = self.get_serializer(recipe, data=request.data)
 
         if serializer.is_valid():
-            serializer.save()   # Save the serializer # noqa
+            size = serializer.validated_data['image'].size
+            recipe = serializer.save(image_original_size=size, image_size=size)   # Save the serializer # noqa
+
+            self._schedule_image_processing(recipe)
             return Response(serializer.data, status=status.HTTP_200_OK)
 
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+    def _schedule_image_processing(self, recipe):
+        """Re-encode the new image of a recipe once it is committed"""
+        if settings.RECIPE_IMAGE_PROCESSING:
+            name = recipe.image.name
+            transaction.on_commit(
+                lambda: schedule_image_processing(recipe.id, recipe.user_id, name), # noqa
+                using=recipe._state.db,
+            )
+
+    # Custom action to upload images to several recipes in one request. Detail=False means that the action is for the recipe collection # noqa
+    @action(methods=['POST'], detail=False, url_path='upload-images')
+    def upload_images(self, request):
+        """Upload images to several recipes, returning a result per recipe"""
+
+        request.upload_handlers = [LimitedTemporaryFileUploadHandler(
+            request,
+            max_files=settings.RECIPE_IMAGE_BATCH_MAX_FILES,
+        )]
+
+        try:
+            uploads = {int(key): upload for key, upload in request.FILES.items()} # noqa
+        except ValueError:
+            return Response(
+                {'detail': 'Files must be named after the ID of their recipe.'}, # noqa
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        if not uploads:
+            return Response(
+                {'detail': 'No files were uploaded.'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        # Ownership of every recipe is checked with a single query
+        recipes = Recipe.objects.filter(user=request.user).in_bulk(list(uploads)) # noqa
+        stored = store_recipe_images(
+            recipes,
+            {pk: upload for pk, upload in uploads.items() if pk in recipes},
+        )
+
+        results = []
+        with transaction.atomic(using=router.db_for_write(Recipe)):
+            for pk, upload in uploads.items():
+                if pk not in recipes:
+                    results.append({'id': pk, 'status': status.HTTP_404_NOT_FOUND, 'errors': {'detail': 'Not found.'}}) # noqa
+                    continue
+
+                if isinstance(stored[pk], ValidationError):
+                    results.append({'id': pk, 'status': status.HTTP_400_BAD_REQUEST, 'errors': {'image': stored[pk].detail}}) # noqa
+                    continue
+
+                recipe = recipes[pk]
+                recipe.image = stored[pk]
+                recipe.image_original_size = recipe.image_size = upload.size
+                recipe.save(update_fields=['image', 'image_original_size', 'image_size']) # noqa
+                self._schedule_image_processing(recipe)
+
+                results.append({
+                    **self.get_serializer(recipe).data,
+                    'status': status.HTTP_200_OK,
+                })
+
+        return Response({'results': results}, status=status.HTTP_200_OK)
+
+    # Custom action to merge the ingredients of several recipes. Detail=False means that the action is for the recipe collection # noqa
+    @action(methods=['GET'], detail=False, url_path='shopping-list')
+    def shopping_list(self, request):
+        """Return the deduplicated ingredients used by a set of recipes"""
+
+        recipes = request.query_params.get('recipes')
+
+        try:
+            recipe_ids = set(self._params_to_ints(recipes or ''))
+        except ValueError:
+            return Response(
+                {'recipes': ['Provide a comma separated list of recipe IDs.']},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        # A single query over the recipe <-> ingredient through table, scoped to the user's recipes. # noqa
+        # Rows are ordered so that all rows for one ingredient are adjacent and can be grouped without another query # noqa
+        rows = Recipe.ingredients.through.objects.filter(
+            recipe__user=request.user,
+            recipe_id__in=recipe_ids,
+        ).values_list(
+            'ingredient_id', 'ingredient__name', 'recipe_id',
+        ).order_by('ingredient__name', 'ingredient_id', 'recipe_id')
+
+        items = []
+        for (ingredient_id, name), group in groupby(rows, key=lambda row: row[:2]): # noqa
+            used_in = [row[2] for row in group]
+            items.append({
+                'id': ingredient_id,
+                'name': name,
+                'count': len(used_in),
+                'recipes': used_in,
+            })
+
+        serializer = self.get_serializer(items, many=True)
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+    # Resized variant of the recipe image, rendered on first request and then served from the variant cache # noqa
+    @action(methods=['GET'], detail=True, url_path='image')
+    def image_variant(self, request, pk=None):
+        """Return the recipe image resized to a supported width and format""" # noqa
+        recipe = self.get_object()
+
+        try:
+            width = int(request.query_params.get('w', settings.IMAGE_VARIANT_WIDTHS[-1])) # noqa
+        except ValueError:
+            width = None
+        fmt = request.query_params.get('fmt', images.DEFAULT_FORMAT)
+
+        if width not in settings.IMAGE_VARIANT_WIDTHS or fmt not in images.FORMATS: # noqa
+            return Response(
+                {'detail': f'w must be one of {settings.IMAGE_VARIANT_WIDTHS} and fmt one of {list(images.FORMATS)}.'}, # noqa
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        if not recipe.image:
+            return Response(status=status.HTTP_404_NOT_FOUND)
+
+        try:
+            path = images.get_variant(recipe.image, width, fmt)
+        except FileNotFoundError:
+            # The source image file is gone, e.g. removed from the storage by hand # noqa
+            return Response(status=status.HTTP_404_NOT_FOUND)
+
+        return protected_media_response(
+            path,
+            content_type=images.FORMATS[fmt][2],
+            open_file=lambda: images.open_variant(recipe.image, width, fmt),
+        )
+
+    # Statistics over all recipes of the user, cached until one of them changes # noqa
+    @action(methods=['GET'], detail=False, url_path='stats')
+    def stats(self, request):
+        """Return aggregate statistics about the user's recipes"""
+        return Response(get_recipe_stats(request.user), status=status.HTTP_200_OK) # noqa
+
 
 # Extend the schema view to add custom parameters to the API documentation # noqa
 @extend_schema_view(
@@ -114,6 +316,11 @@ class RecipeViewSet(viewsets.ModelViewSet):
                 type=OpenApiTypes.INT, enum=[0, 1],
                 description='Filter out unassigned tags',
             ),
+            OpenApiParameter(
+                name='popular',
+                type=OpenApiTypes.INT, enum=[0, 1],
+                description='Order by the number of recipes using them, most used first', # noqa
+            ),
         ]
     )
 )
@@ -127,8 +334,14 @@ class BaseRecipeAttrViewSet(mixins.UpdateModelMixin,  # UpdateModelMixin is a mi
     #  This class is used to reduce code duplication in the Tag and Ingredient viewsets # noqa
 
     # User must be authenticated to access the API
-    authentication_classes = [TokenAuthentication]  # Authentication classes to be used # noqa
+    authentication_classes = [  # Authentication classes to be used
+        CachedTokenAuthentication,
+        SignedTokenAuthentication,
+    ]
     permission_classes = [IsAuthenticated]  # Permission classes to be used # noqa
+    throttle_scope = 'recipes'
+    throttle_write_scope = 'recipe-writes'
+    replica_actions = ('list',)  # Read from the replicas, see core/routers.py # noqa
 
     def get_queryset(self):
         """Return objects for the current authenticated user only"""
@@ -136,17 +349,40 @@ class BaseRecipeAttrViewSet(mixins.UpdateModelMixin,  # UpdateModelMixin is a mi
             int(self.request.query_params.get('assigned_only', 0))  # Get the assigned_only query parameter, default to 0 if not set # noqa
         )
 
+        popular = bool(
+            int(self.request.query_params.get('popular', 0))  # Get the popular query parameter, default to 0 if not set # noqa
+        )
+
         queryset = self.queryset  # Get the queryset # noqa
 
+        # recipe_count is a maintained counter, so no join with the recipes (and no distinct) is needed # noqa
         if assigned_only:
-            queryset = queryset.filter(recipe__isnull=False)  # Make sure there is a recipe assigned # noqa
+            queryset = queryset.filter(recipe_count__gt=0)  # Make sure there is a recipe assigned # noqa
 
-        return queryset.filter(user=self.request.user).order_by('-name').distinct()  # noqa
+        ordering = ['-recipe_count', '-name'] if popular else ['-name']
+
+        return queryset.filter(user=self.request.user).order_by(*ordering)
+
+    def _recipe_ids(self, instance):
+        """Return the IDs of the recipes using a tag or ingredient"""
+        return list(instance.recipe_set.values_list('id', flat=True))
+
+    # Renaming or deleting a tag / ingredient changes the snapshot of every recipe using it # noqa
+    def perform_update(self, serializer):
+        """Update the object and rebuild the snapshot of recipes using it"""
+        instance = serializer.save()
+        Recipe.objects.refresh_attrs_snapshots(self._recipe_ids(instance))
+
+    def perform_destroy(self, instance):
+        """Delete the object and rebuild the snapshot of recipes using it"""
+        recipe_ids = self._recipe_ids(instance)
+        instance.delete()
+        Recipe.objects.refresh_attrs_snapshots(recipe_ids)
 
 
 class TagViewSet(BaseRecipeAttrViewSet):
     """Manage tags in the database. Extends the BaseRecipeAttrViewSet."""
-    serializer_class = serializers.TagSerializer
+    serializer_class = serializers.TagDetailSerializer
     queryset = Tag.objects.all()
 
 
@@ -154,5 +390,27 @@ class IngredientViewSet(BaseRecipeAttrViewSet):
     """ Manage Ingredients in the Database. Extends the BaseRecipeAttrViewSet.""" # noqa
 
     """Manage tags in the database"""
-    serializer_class = serializers.IngredientSerializer
+    serializer_class = serializers.IngredientDetailSerializer
     queryset = Ingredient.objects.all()
+
+
+# Recipe images are only served to their owners. Image URLs of the recipe serializers point here # noqa
+class RecipeMediaView(APIView):
+    """Serve recipe image files to the owners of recipes using them"""
+
+    authentication_classes = [
+        CachedTokenAuthentication,
+        SignedTokenAuthentication,
+    ]
+    permission_classes = [IsAuthenticated]
+    throttle_scope = 'recipes'
+
+    @extend_schema(responses={(200, 'image/*'): OpenApiTypes.BINARY})
+    def get(self, request, name):
+        """Return an image file, if one of the user's recipes uses it"""
+        # Blobs are shared by content, so any recipe of the user referencing the blob grants access # noqa
+        if not Recipe.objects.filter(user=request.user, image=name).exists():
+            return Response(status=status.HTTP_404_NOT_FOUND)
+
+        storage = Recipe._meta.get_field('image').storage
+        return protected_media_response(storage.path(name))
@@ -0,0 +1,125 @@
+"""
+    User counts and age distributions by country and city, for the admin dashboards. # noqa
+    Results are cached for DEMOGRAPHICS_CACHE_TIMEOUT seconds, so repeated dashboard loads do not reach the database. # noqa
+"""
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Max, Min, OuterRef, Q, Subquery, Sum
+from django.utils import timezone
+
+from core.models import Recipe, UserDetails
+from core.routers import all_shards
+
+
+def _bucket_names(bounds):
+    """Return the age bucket labels of the bucket bounds, e.g. [18, 25] -> ['<18', '18-24', '25+']""" # noqa
+    names = [f'<{bounds[0]}']
+    names += [f'{low}-{high - 1}' for low, high in zip(bounds, bounds[1:])]
+    names.append(f'{bounds[-1]}+')
+    return names
+
+
+def _bucket_filters(bounds):
+    """Return the age filter of each bucket, in the order of _bucket_names"""
+    filters = [Q(age__lt=bounds[0])]
+    filters += [Q(age__gte=low, age__lt=high) for low, high in zip(bounds, bounds[1:])] # noqa
+    filters.append(Q(age__gte=bounds[-1]))
+    return filters
+
+
+def _recipe_counts(alias):
+    """Return {(country, city): recipes} of the users with details on a database""" # noqa
+    recipes = Recipe.objects.using(alias)
+    if alias in settings.DATABASE_SHARDS:
+        # Shards hold no users to join through, the location comes from the details of the owner # noqa
+        details = UserDetails.objects.using(alias).filter(user_id=OuterRef('user_id')) # noqa
+        recipes = recipes.annotate(
+            country=Subquery(details.values('country')),
+            city=Subquery(details.values('city')),
+        ).filter(country__isnull=False)
+        fields = ('country', 'city')
+    else:
+        recipes = recipes.filter(user__userdetails__isnull=False)
+        fields = ('user__userdetails__country', 'user__userdetails__city')
+
+    return {
+        (row[fields[0]], row[fields[1]]): row['count']
+        for row in recipes.values(*fields).annotate(count=Count('id')).order_by() # noqa
+    }
+
+
+def compute_demographics(include_recipes=False):
+    """Compute the demographics, without using the cache. With sharding, each shard is aggregated and the results merged""" # noqa
+    bounds = settings.DEMOGRAPHICS_AGE_BUCKETS
+    names = _bucket_names(bounds)
+    aliases = all_shards()
+
+    groups = {}
+    age_sums = {}
+    recipes = {}
+    for alias in aliases:
+        # A single pass over the (country, city) index. Each bucket is a filtered count # noqa
+        rows = UserDetails.objects.using(alias).values('country', 'city').annotate( # noqa
+            users=Count('id'),
+            age_min=Min('age'),
+            age_max=Max('age'),
+            age_sum=Sum('age'),
+            **{
+                f'bucket_{i}': Count('id', filter=bucket)
+                for i, bucket in enumerate(_bucket_filters(bounds))
+            },
+        ).order_by('country', 'city')
+
+        for row in rows:
+            key = (row['country'], row['city'])
+            group = groups.setdefault(key, {
+                'country': row['country'],
+                'city': row['city'],
+                'users': 0,
+                'age': {
+                    'min': row['age_min'],
+                    'max': row['age_max'],
+                    'avg': None,
+                    'buckets': dict.fromkeys(names, 0),
+                },
+            })
+            group['users'] += row['users']
+            group['age']['min'] = min(group['age']['min'], row['age_min'])
+            group['age']['max'] = max(group['age']['max'], row['age_max'])
+            age_sums[key] = age_sums.get(key, 0) + row['age_sum']
+            for i, name in enumerate(names):
+                group['age']['buckets'][name] += row[f'bucket_{i}']
+
+        if include_recipes:
+            # Counted separately, as joining recipes into the query above would multiply the user rows # noqa
+            for key, count in _recipe_counts(alias).items():
+                recipes[key] = recipes.get(key, 0) + count
+
+    groups = list(groups.values())
+    if len(aliases) > 1:
+        groups.sort(key=lambda group: (group['country'], group['city']))
+
+    for group in groups:
+        key = (group['country'], group['city'])
+        group['age']['avg'] = round(age_sums[key] / group['users'], 1)
+        if include_recipes:
+            group['recipes'] = recipes.get(key, 0)
+
+    return {
+        'generated_at': timezone.now(),
+        'users': sum(group['users'] for group in groups),
+        'groups': groups,
+    }
+
+
+def get_demographics(include_recipes=False):
+    """Return the demographics, from the cache when possible"""
+    key = f'user-demographics:{int(include_recipes)}'
+    demographics = cache.get(key)
+
+    if demographics is None:
+        demographics = compute_demographics(include_recipes)
+        cache.set(key, demographics, settings.DEMOGRAPHICS_CACHE_TIMEOUT)
+
+    return demographics
@@ -4,12 +4,15 @@
     so that they can be easily transmitted over a network.
 """
 
-from django.contrib.auth import get_user_model, authenticate
+from django.contrib.auth import get_user_model
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
 from rest_framework import serializers
 
+from core.authentication import load_token, record_token_use, token_expired
 from core.models import UserDetails
+from core.passwords import authenticate_login
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -57,10 +60,8 @@ class AuthTokenSerializer(serializers.Serializer):
         email = attrs.get("email")
         password = attrs.get("password")
 
-        # Authenticate the user with the provided email and password
-        user = authenticate(
-            request=self.context.get("request"), username=email, password=password # noqa
-        )
+        # Authenticate the user with the provided email and password, hashing on the bounded pool # noqa
+        user = authenticate_login(email, password, self.context.get("request")) # noqa
 
         if not user:
             msg = _("Unable to authenticate with provided credentials")
@@ -73,6 +74,34 @@ class AuthTokenSerializer(serializers.Serializer):
         return attrs
 
 
+class RefreshTokenSerializer(serializers.Serializer):
+    """Serializer exchanging a database token for a new signed access token""" # noqa
+
+    refresh = serializers.CharField(trim_whitespace=False)
+
+    def validate(self, attrs):
+        """Validate the refresh token and its user"""
+        token = load_token(key=attrs["refresh"])
+        now = timezone.now()
+
+        if token is None or not token.user.is_active or token_expired(token.last_used, now): # noqa
+            msg = _("Invalid or revoked refresh token")
+            raise serializers.ValidationError(msg, code="authentication")
+
+        # Refreshing counts as a use, so tokens of active clients slide
+        record_token_use(token, now)
+        attrs["user"] = token.user
+        return attrs
+
+
+class SignedTokenSerializer(serializers.Serializer):
+    """Serializer for issued signed access tokens"""
+
+    access = serializers.CharField(help_text="Signed access token, sent as 'Authorization: Bearer <access>'") # noqa
+    refresh = serializers.CharField(help_text="Token exchanged for a new access token at /api/user/token/refresh/") # noqa
+    expires_in = serializers.IntegerField(help_text="Seconds until the access token expires") # noqa
+
+
 class UserDetailsSerializer(serializers.ModelSerializer):
 
     age = serializers.IntegerField(default=0)
@@ -81,3 +110,24 @@ class UserDetailsSerializer(serializers.ModelSerializer):
         model = UserDetails
         fields = ['id', 'age', 'country', 'city', 'favorite_food']
         read_only_fields = ['id']
+
+
+class ProfileCountsSerializer(serializers.Serializer):
+    """Serializer for the collection sizes of a profile"""
+
+    recipes = serializers.IntegerField(source="recipes_count")
+    tags = serializers.IntegerField(source="tags_count")
+    ingredients = serializers.IntegerField(source="ingredients_count")
+
+
+class ProfileSerializer(serializers.ModelSerializer):
+    """Serializer for the user, its details and collection sizes in one response""" # noqa
+
+    # Null until the user adds details
+    details = UserDetailsSerializer(source="userdetails", read_only=True, allow_null=True) # noqa
+    counts = ProfileCountsSerializer(source="*", read_only=True)
+
+    class Meta:
+        model = get_user_model()
+        fields = ("email", "name", "details", "counts")
+        read_only_fields = fields
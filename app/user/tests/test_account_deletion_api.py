@@ -0,0 +1,113 @@
+"""
+Test deleting accounts in the background
+"""
+
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from core.models import Ingredient, Recipe, Tag, UserDetails
+
+
+ME_URL = reverse("user:me")
+
+
+def create_user(email):
+    return get_user_model().objects.create_user(email=email, password="testpass123") # noqa
+
+
+def create_data(user, recipes=5):
+    """Give the user recipes with tags and ingredients and details"""
+    UserDetails.objects.create(user=user, age=30, country="Country", city="City") # noqa
+    tag = Tag.objects.create(user=user, name="Vegan")
+    ingredient = Ingredient.objects.create(user=user, name="Salt")
+    for i in range(recipes):
+        recipe = Recipe.objects.create(
+            user=user,
+            title=f"Recipe {i}",
+            time_minutes=5,
+            price=Decimal("1.00"),
+            image=f"blobs/{i % 2}.jpg",
+        )
+        recipe.tags.add(tag)
+        recipe.ingredients.add(ingredient)
+
+
+@override_settings(ACCOUNT_DELETION_WORKERS=0, ACCOUNT_DELETION_BATCH_SIZE=2)
+@mock.patch("core.accounts.release_recipe_image")
+class AccountDeletionTests(TestCase):
+    """Test accounts are deactivated at once and deleted in batches"""
+
+    def setUp(self):
+        self.user = create_user("test@example.com")
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {self.token.key}") # noqa
+
+        self.other = create_user("other@example.com")
+        create_data(self.other, recipes=1)
+
+    def test_delete_account(self, release):
+        """Test the account and all its data are deleted"""
+        create_data(self.user)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            res = self.client.delete(ME_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_202_ACCEPTED)
+        self.assertFalse(get_user_model().objects.filter(pk=self.user.pk).exists()) # noqa
+        for model in (Recipe, Tag, Ingredient, UserDetails, Token):
+            self.assertFalse(model.objects.filter(user=self.user).exists())
+        self.assertEqual(Recipe.tags.through.objects.count(), 1)
+        self.assertEqual(Recipe.objects.filter(user=self.other).count(), 1)
+        self.assertEqual({call.args[0] for call in release.call_args_list}, {"blobs/0.jpg", "blobs/1.jpg"}) # noqa
+
+    def test_deactivated_before_deletion(self, release):
+        """Test the account stops working before its data is deleted"""
+        create_data(self.user)
+
+        res = self.client.delete(ME_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_202_ACCEPTED)
+        self.user.refresh_from_db()
+        self.assertFalse(self.user.is_active)
+        self.assertIsNotNone(self.user.deleted_at)
+        self.assertEqual(self.client.get(ME_URL).status_code, status.HTTP_401_UNAUTHORIZED) # noqa
+
+    def test_resume_command(self, release):
+        """Test the command finishes interrupted deletions only"""
+        create_data(self.user)
+        get_user_model().objects.filter(pk=self.user.pk).update(
+            is_active=False,
+            deleted_at=timezone.now(),
+        )
+
+        out = StringIO()
+        call_command("delete_accounts", stdout=out)
+
+        self.assertIn("Deleted 1 accounts", out.getvalue())
+        self.assertFalse(get_user_model().objects.filter(pk=self.user.pk).exists()) # noqa
+        self.assertTrue(get_user_model().objects.filter(pk=self.other.pk).exists()) # noqa
+
+    def test_resume_command_min_age(self, release):
+        """Test the command leaves accounts marked recently to their background deletion""" # noqa
+        get_user_model().objects.filter(pk=self.user.pk).update(
+            is_active=False,
+            deleted_at=timezone.now(),
+        )
+
+        out = StringIO()
+        call_command("delete_accounts", "--min-age", "3600", stdout=out)
+
+        self.assertIn("Deleted 0 accounts", out.getvalue())
+        self.assertTrue(get_user_model().objects.filter(pk=self.user.pk).exists()) # noqa
@@ -0,0 +1,82 @@
+"""
+Test the demographics API
+"""
+
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import Recipe, UserDetails
+
+
+DEMOGRAPHICS_URL = reverse("user:demographics")
+
+
+def create_user(email, **details):
+    """Create a user, with details when given"""
+    user = get_user_model().objects.create_user(email=email, password="testpass123") # noqa
+    if details:
+        UserDetails.objects.create(user=user, **details)
+    return user
+
+
+class DemographicsApiTests(TestCase):
+    """Test the admin only demographics"""
+
+    def setUp(self):
+        cache.clear()
+        self.admin = get_user_model().objects.create_superuser("admin@example.com", "testpass123") # noqa
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+        self.alice = create_user("a@example.com", age=17, country="UAE", city="Dubai") # noqa
+        create_user("b@example.com", age=30, country="UAE", city="Dubai")
+        create_user("c@example.com", age=70, country="India", city="Pune")
+        Recipe.objects.create(user=self.alice, title="Soup", time_minutes=5, price=Decimal("1.00")) # noqa
+
+    def test_admin_only(self):
+        """Test other users cannot read the demographics"""
+        client = APIClient()
+        client.force_authenticate(self.alice)
+
+        res = client.get(DEMOGRAPHICS_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_groups(self):
+        """Test users are counted by country and city with their ages"""
+        res = self.client.get(DEMOGRAPHICS_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data["users"], 3)
+        pune, dubai = res.data["groups"]
+        self.assertEqual((dubai["country"], dubai["city"], dubai["users"]), ("UAE", "Dubai", 2)) # noqa
+        self.assertEqual(dubai["age"]["avg"], 23.5)
+        self.assertEqual(dubai["age"]["buckets"]["<18"], 1)
+        self.assertEqual(dubai["age"]["buckets"]["25-34"], 1)
+        self.assertEqual(pune["age"]["buckets"]["65+"], 1)
+        self.assertNotIn("recipes", dubai)
+
+    def test_recipes(self):
+        """Test recipe counts are included on request"""
+        res = self.client.get(DEMOGRAPHICS_URL, {"recipes": 1})
+
+        pune, dubai = res.data["groups"]
+        self.assertEqual(dubai["recipes"], 1)
+        self.assertEqual(pune["recipes"], 0)
+
+    def test_cached(self):
+        """Test repeated loads are answered from the cache"""
+        self.client.get(DEMOGRAPHICS_URL)
+        create_user("d@example.com", age=40, country="India", city="Pune")
+
+        with self.assertNumQueries(0):
+            res = self.client.get(DEMOGRAPHICS_URL)
+
+        self.assertEqual(res.data["users"], 3)
@@ -0,0 +1,100 @@
+"""
+Test the combined profile API
+"""
+
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import Ingredient, Recipe, Tag, UserDetails
+
+
+PROFILE_URL = reverse("user:me_profile")
+
+
+def create_user(**params):
+    return get_user_model().objects.create_user(**params)
+
+
+def create_recipe(user, **params):
+    """Create and return a sample recipe"""
+    return Recipe.objects.create(
+        user=user,
+        title="Sample recipe",
+        time_minutes=10,
+        price=Decimal("5.00"),
+        **params,
+    )
+
+
+class PublicProfileApiTests(TestCase):
+    """Test unauthenticated requests to the profile API"""
+
+    def test_auth_required(self):
+        """Test authentication is required for the profile"""
+        res = APIClient().get(PROFILE_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class PrivateProfileApiTests(TestCase):
+    """Test the profile of the authenticated user"""
+
+    def setUp(self):
+        self.user = create_user(
+            email="test@example.com",
+            password="testpass123",
+            name="Test Name",
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_profile_without_details(self):
+        """Test new users get null details and empty counts"""
+        res = self.client.get(PROFILE_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data["email"], "test@example.com")
+        self.assertEqual(res.data["name"], "Test Name")
+        self.assertIsNone(res.data["details"])
+        self.assertEqual(res.data["counts"], {"recipes": 0, "tags": 0, "ingredients": 0}) # noqa
+
+    def test_profile_in_one_query(self):
+        """Test the user, details and counts are loaded with one query"""
+        UserDetails.objects.create(user=self.user, age=32, country="Country", city="City") # noqa
+        recipe = create_recipe(self.user)
+        create_recipe(self.user)
+        recipe.tags.add(Tag.objects.create(user=self.user, name="Vegan"))
+        Ingredient.objects.create(user=self.user, name="Salt")
+        Ingredient.objects.create(user=self.user, name="Pepper")
+        other = create_user(email="other@example.com", password="testpass123") # noqa
+        create_recipe(other)
+        Tag.objects.create(user=other, name="Other")
+
+        with self.assertNumQueries(1):
+            res = self.client.get(PROFILE_URL)
+
+        self.assertEqual(res.data["details"]["age"], 32)
+        self.assertEqual(res.data["counts"], {"recipes": 2, "tags": 1, "ingredients": 2}) # noqa
+
+    def test_conditional_get(self):
+        """Test unchanged profiles are answered with 304"""
+        res = self.client.get(PROFILE_URL)
+        etag = res["ETag"]
+
+        unchanged = self.client.get(PROFILE_URL, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(unchanged.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(unchanged.content, b"")
+
+        create_recipe(self.user)
+        changed = self.client.get(PROFILE_URL, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(changed.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(changed["ETag"], etag)
+        self.assertEqual(changed.data["counts"]["recipes"], 1)
@@ -0,0 +1,152 @@
+"""
+Test cases for signed access tokens
+"""
+
+from django.conf import settings
+from django.test import TestCase, override_settings
+from django.contrib.auth import get_user_model
+from django.urls import reverse
+
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+from rest_framework import status
+
+
+SIGNED_TOKEN_URL = reverse("user:token_signed")
+REFRESH_URL = reverse("user:token_refresh")
+ME_URL = reverse("user:me")
+TAGS_URL = reverse("recipe:tag-list")
+RECIPES_URL = reverse("recipe:recipe-list")
+
+
+def create_user(**params):
+    """Create a new user"""
+    return get_user_model().objects.create_user(**params)
+
+
+@override_settings(SIGNED_TOKEN_AUTH=True)
+class SignedTokenApiTests(TestCase):
+    """Test issuing, using and refreshing signed tokens"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user(
+            email="test@example.com",
+            password="testpass123",
+            name="Test Name",
+        )
+
+    def issue(self):
+        res = self.client.post(SIGNED_TOKEN_URL, {
+            "email": "test@example.com",
+            "password": "testpass123",
+        })
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        return res.data
+
+    def bearer(self, access):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {access}")
+        return client
+
+    def test_issue_signed_token(self):
+        """Test a signed access token and the database refresh token are issued""" # noqa
+        data = self.issue()
+
+        self.assertEqual(data["refresh"], Token.objects.get(user=self.user).key) # noqa
+        self.assertEqual(data["expires_in"], settings.SIGNED_TOKEN_TTL)
+
+    def test_authenticate_without_database(self):
+        """Test signed tokens authenticate without a query"""
+        client = self.bearer(self.issue()["access"])
+
+        with self.assertNumQueries(1):  # Only the tags themselves
+            res = client.get(TAGS_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    def test_me_loads_user(self):
+        """Test the profile endpoint returns the full user"""
+        res = self.bearer(self.issue()["access"]).get(ME_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data["email"], "test@example.com")
+        self.assertEqual(res.data["name"], "Test Name")
+
+    def test_expired_token(self):
+        """Test tokens past their TTL are rejected"""
+        access = self.issue()["access"]
+
+        with override_settings(SIGNED_TOKEN_TTL=-1):
+            res = self.bearer(access).get(TAGS_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_tampered_token(self):
+        """Test tokens with a wrong signature are rejected"""
+        access = self.issue()["access"]
+
+        res = self.bearer(access[:-2] + "xx").get(TAGS_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_secret_key_rotation(self):
+        """Test tokens signed with a previous key are accepted from the fallbacks""" # noqa
+        with override_settings(SECRET_KEY="old-secret-key"):
+            access = self.issue()["access"]
+
+        with override_settings(SECRET_KEY="new-secret-key"):
+            res = self.bearer(access).get(TAGS_URL)
+            self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+        with override_settings(SECRET_KEY="new-secret-key", SECRET_KEY_FALLBACKS=["old-secret-key"]): # noqa
+            res = self.bearer(access).get(TAGS_URL)
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    def test_deleted_account_cannot_write(self):
+        """Test an account being deleted keeps reading but cannot write with its signed token""" # noqa
+        client = self.bearer(self.issue()["access"])
+        self.user.is_active = False
+        self.user.save()
+
+        self.assertEqual(client.get(TAGS_URL).status_code, status.HTTP_200_OK) # noqa
+        res = client.post(RECIPES_URL, {"title": "Soup", "time_minutes": 5, "price": "1.00"}) # noqa
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_refresh(self):
+        """Test the refresh token exchanges for a new access token"""
+        data = self.issue()
+
+        res = self.client.post(REFRESH_URL, {"refresh": data["refresh"]})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.bearer(res.data["access"]).get(TAGS_URL).status_code, status.HTTP_200_OK) # noqa
+
+    def test_refresh_revoked(self):
+        """Test deleting the database token revokes refreshing"""
+        data = self.issue()
+        Token.objects.filter(user=self.user).delete()
+
+        res = self.client.post(REFRESH_URL, {"refresh": data["refresh"]})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_disabled(self):
+        """Test signed tokens are not issued unless enabled"""
+        with override_settings(SIGNED_TOKEN_AUTH=False):
+            res = self.client.post(SIGNED_TOKEN_URL, {
+                "email": "test@example.com",
+                "password": "testpass123",
+            })
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_disabled_rejects_issued_tokens(self):
+        """Test turning signed tokens off stops those already issued"""
+        client = self.bearer(self.issue()["access"])
+
+        with override_settings(SIGNED_TOKEN_AUTH=False):
+            res = client.get(TAGS_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
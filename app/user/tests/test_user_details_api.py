@@ -2,6 +2,9 @@
 Test the user details API
 """
 
+from unittest import mock
+
+from django.db import connection
 from django.urls import reverse
 from django.test import TestCase
 from django.contrib.auth import get_user_model
@@ -94,3 +97,46 @@ class PrivateUserDetailsApiTests(TestCase):
         self.assertEqual(details.favorite_food, "Sushi")
         self.assertEqual(details.city, "Dubai")
         self.assertEqual(details.country, "UAE")
+
+    def test_retrieve_without_details(self):
+        """Test users without details get a 404"""
+        res = self.client.get(MANAGE_USER_DETAILS_URL)
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+        res = self.client.patch(MANAGE_USER_DETAILS_URL, {"age": 30})
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_writes_single_statement(self):
+        """Test creating, replacing and patching details take one query each""" # noqa
+        payload = {"age": 25, "country": "Country", "city": "City"}
+
+        with self.assertNumQueries(1):
+            res = self.client.post(ADD_USER_DETAILS_URL, payload)
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(res.data["favorite_food"], "")
+
+        with self.assertNumQueries(1):
+            res = self.client.post(ADD_USER_DETAILS_URL, dict(payload, favorite_food="Pasta")) # noqa
+        self.assertEqual(res.data["favorite_food"], "Pasta")
+
+        with self.assertNumQueries(1):
+            res = self.client.patch(MANAGE_USER_DETAILS_URL, {"city": "Dubai"}) # noqa
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data["city"], "Dubai")
+        self.assertEqual(res.data["favorite_food"], "Pasta")
+
+        details = UserDetails.objects.get(user=self.user)
+        self.assertEqual(res.data["id"], details.id)
+        self.assertEqual(details.city, "Dubai")
+        self.assertEqual(details.age, 25)
+
+    def test_writes_without_returning(self):
+        """Test databases without ON CONFLICT ... RETURNING use the portable path""" # noqa
+        with mock.patch.object(connection.features, "can_return_columns_from_insert", False): # noqa
+            self.client.post(ADD_USER_DETAILS_URL, {"age": 25, "country": "Country", "city": "City"}) # noqa
+            res = self.client.patch(MANAGE_USER_DETAILS_URL, {"age": 30})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        details = UserDetails.objects.get(user=self.user)
+        self.assertEqual(details.age, 30)
+        self.assertEqual(details.city, "City")
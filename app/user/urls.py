@@ -13,7 +13,11 @@ app_name = "user"
 urlpatterns = [
     path("create/", views.CreateUserView.as_view(), name="create"),
     path("token/", views.CreateTokenView.as_view(), name="token"),
+    path("token/signed/", views.CreateSignedTokenView.as_view(), name="token_signed"), # noqa
+    path("token/refresh/", views.RefreshSignedTokenView.as_view(), name="token_refresh"), # noqa
     path("me/", views.ManageUserView.as_view(), name="me"),
+    path("me/profile/", views.ProfileView.as_view(), name="me_profile"),
     path("details/", views.UserDetailsView.as_view(), name="details"),
     path("details/me/", views.ManageUserDetailsView.as_view(), name="me_details"), # noqa
+    path("demographics/", views.DemographicsView.as_view(), name="demographics"), # noqa
 ]
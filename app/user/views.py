@@ -2,17 +2,45 @@
 This file contains the views for the user API. Views are the endpoints that are exposed to the client. # noqa
 """
 
-from rest_framework import generics, authentication, permissions
+import hashlib
+import json
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.translation import gettext_lazy as _
+
+from drf_spectacular.utils import (
+    extend_schema,
+    OpenApiParameter,
+    OpenApiTypes,
+)
+from rest_framework import generics, permissions, status
 from rest_framework.authtoken.views import ObtainAuthToken
+from rest_framework.exceptions import NotFound
+from rest_framework.response import Response
 from rest_framework.settings import api_settings
 
+from user.demographics import get_demographics
 from user.serializer import (
     UserSerializer,
     AuthTokenSerializer,
-    UserDetailsSerializer
+    UserDetailsSerializer,
+    RefreshTokenSerializer,
+    SignedTokenSerializer,
+    ProfileSerializer,
 )
 
-from core.models import UserDetails
+from core.accounts import schedule_account_deletion
+from core.authentication import (
+    CachedTokenAuthentication,
+    SignedTokenAuthentication,
+    create_signed_token,
+    issue_token,
+)
+from core.models import UserDetails, Recipe, Tag, Ingredient
 
 
 #   CreateAPIView is a generic view that provides a simple way to create a new user in the system. # noqa
@@ -20,6 +48,7 @@ class CreateUserView(generics.CreateAPIView):
     """Create a new user in the system"""
 
     serializer_class = UserSerializer
+    throttle_scope = "signup"
 
 
 #  ObtainAuthToken is a generic view that provides a simple way to create a new auth token for the user. # noqa
@@ -28,20 +57,147 @@ class CreateTokenView(ObtainAuthToken):
 
     serializer_class = AuthTokenSerializer
     renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES
+    # ObtainAuthToken disables throttling, the login rate limits password guessing # noqa
+    throttle_classes = api_settings.DEFAULT_THROTTLE_CLASSES
+    throttle_scope = "login"
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        # Expired tokens are replaced by a new key, the others slide
+        token = issue_token(serializer.validated_data["user"])
+        return Response({"token": token.key})
+
+
+#  Signed tokens are opt-in. Reads authenticated with them need no database access until the token is refreshed # noqa
+class CreateSignedTokenView(generics.GenericAPIView):
+    """Create a short-lived signed access token and a refresh token for user""" # noqa
+
+    serializer_class = AuthTokenSerializer
+    renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES
+    throttle_scope = "login"
+
+    def issue(self, user, refresh):
+        """Return the response carrying a new access token"""
+        if not settings.SIGNED_TOKEN_AUTH:
+            raise NotFound()
+
+        return Response(SignedTokenSerializer({
+            "access": create_signed_token(user),
+            "refresh": refresh,
+            "expires_in": settings.SIGNED_TOKEN_TTL,
+        }).data)
+
+    @extend_schema(responses=SignedTokenSerializer)
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        user = serializer.validated_data["user"]
+
+        # The refresh token is the database token, so deleting it revokes the refresh # noqa
+        return self.issue(user, issue_token(user).key)
+
+
+class RefreshSignedTokenView(CreateSignedTokenView):
+    """Exchange a refresh token for a new signed access token"""
+
+    serializer_class = RefreshTokenSerializer
+
+    @extend_schema(responses=SignedTokenSerializer)
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return self.issue(serializer.validated_data["user"], serializer.validated_data["refresh"]) # noqa
 
 
 #   ManageUserView is a generic view that provides a simple way to manage the authenticated user. # noqa
-class ManageUserView(generics.RetrieveUpdateAPIView):
+class ManageUserView(generics.RetrieveUpdateDestroyAPIView):
     """Manage the authenticated user"""
 
     serializer_class = UserSerializer
-    authentication_classes = (authentication.TokenAuthentication,)
+    authentication_classes = (
+        CachedTokenAuthentication,
+        SignedTokenAuthentication,
+    )
     permission_classes = (permissions.IsAuthenticated,)
+    throttle_scope = "user"
+    replica_actions = ("get",)  # Read from the replicas, see core/routers.py # noqa
 
     # Overriding the get_object function to get the authenticated user object. Called when we make a get request to the endpoint. # noqa
     def get_object(self):
         """Get Authenticated User Object, and run it through the serializer and return"""  # noqa
-        return self.request.user
+        user = self.request.user
+
+        # Users authenticated by a signed token only carry their id. Cached users carry all but their password # noqa
+        if "email" in user.get_deferred_fields():
+            user = get_user_model().objects.get(pk=user.pk)
+
+        return user
+
+    # Deleting happens in the background, see core/accounts.py. The account is deactivated before the response # noqa
+    @extend_schema(responses={202: OpenApiTypes.OBJECT})
+    def destroy(self, request, *args, **kwargs):
+        """Deactivate the user and delete their data in the background"""
+        schedule_account_deletion(request.user.pk)
+        return Response(
+            {"detail": _("The account is being deleted.")},
+            status=status.HTTP_202_ACCEPTED,
+        )
+
+
+def _count_owned(model):
+    """Return a subquery counting the rows of model owned by the outer user""" # noqa
+    counts = model.objects.filter(user=OuterRef("pk")).order_by().values("user").annotate(count=Count("pk")) # noqa
+    return Coalesce(Subquery(counts.values("count")), 0)
+
+
+# Everything a client needs at start-up in one request and one query. Replaces calling me/, details/me/ and the recipe lists # noqa
+class ProfileView(generics.RetrieveAPIView):
+    """Retrieve the authenticated user with their details and collection sizes. Supports If-None-Match""" # noqa
+
+    serializer_class = ProfileSerializer
+    authentication_classes = (
+        CachedTokenAuthentication,
+        SignedTokenAuthentication,
+    )
+    permission_classes = (permissions.IsAuthenticated,)
+    throttle_scope = "user"
+    replica_actions = ("get",)  # Read from the replicas, see core/routers.py # noqa
+
+    def get_object(self):
+        """Load the user, details and counts with a single query, unless sharded""" # noqa
+        if settings.DATABASE_SHARDS:
+            return self._get_sharded_object()
+
+        return get_user_model().objects.select_related("userdetails").annotate( # noqa
+            recipes_count=_count_owned(Recipe),
+            tags_count=_count_owned(Tag),
+            ingredients_count=_count_owned(Ingredient),
+        ).get(pk=self.request.user.pk)
+
+    def _get_sharded_object(self):
+        """Load the user from the directory, then its details and counts from its shard, see core/routers.py""" # noqa
+        user = get_user_model().objects.get(pk=self.request.user.pk)
+        for model, attribute in (
+            (Recipe, "recipes_count"),
+            (Tag, "tags_count"),
+            (Ingredient, "ingredients_count"),
+        ):
+            setattr(user, attribute, model.objects.filter(user=user).count())
+        return user
+
+    def retrieve(self, request, *args, **kwargs):
+        data = self.get_serializer(self.get_object()).data
+
+        # The ETag is the hash of the body, so unchanged profiles are answered with an empty 304 # noqa
+        body = json.dumps(data, sort_keys=True, default=str).encode()
+        etag = f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+        response = get_conditional_response(request, etag=etag) or Response(data) # noqa
+
+        response["ETag"] = etag
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
 
 
 # UserDetailsView is a generic view that provides a simple way to create a new User Details record. # noqa
@@ -49,15 +205,19 @@ class ManageUserView(generics.RetrieveUpdateAPIView):
 class UserDetailsView(generics.CreateAPIView):
     """Create or update a Users Details record"""
     serializer_class = UserDetailsSerializer
-    authentication_classes = (authentication.TokenAuthentication,)
+    authentication_classes = (
+        CachedTokenAuthentication,
+        SignedTokenAuthentication,
+    )
     permission_classes = (permissions.IsAuthenticated,)
+    throttle_scope = "user"
 
     def perform_create(self, serializer):
-        user_details, created = UserDetails.objects.update_or_create(
-            user=self.request.user,
-            defaults=serializer.validated_data
+        # One INSERT ... ON CONFLICT DO UPDATE ... RETURNING where the database supports it # noqa
+        serializer.instance = UserDetails.objects.upsert(
+            self.request.user,
+            **serializer.validated_data
         )
-        return user_details
 
 
 # ManageUserDetailsView is a generic view that provides a simple way to manage the authenticated user's details. # noqa
@@ -65,9 +225,58 @@ class UserDetailsView(generics.CreateAPIView):
 class ManageUserDetailsView(generics.RetrieveUpdateAPIView):
     """Retrieve or update authenticated user's details"""
     serializer_class = UserDetailsSerializer
-    authentication_classes = (authentication.TokenAuthentication,)
+    authentication_classes = (
+        CachedTokenAuthentication,
+        SignedTokenAuthentication,
+    )
     permission_classes = (permissions.IsAuthenticated,)
+    throttle_scope = "user"
+    replica_actions = ("get",)  # Read from the replicas, see core/routers.py # noqa
 
-    # Overriding the get_object function to get the authenticated user's details object. Called when we make a get request to the endpoint. # noqa
-    def get_object(self):
-        return UserDetails.objects.get(user=self.request.user)
+    # Users without details get a plain 404 response, rather than an exception going through DRF's handler # noqa
+    def not_found(self):
+        return Response({"detail": _("Not found.")}, status=status.HTTP_404_NOT_FOUND) # noqa
+
+    def retrieve(self, request, *args, **kwargs):
+        details = UserDetails.objects.filter(user=request.user).first()
+        if details is None:
+            return self.not_found()
+        return Response(self.get_serializer(details).data)
+
+    def update(self, request, *args, **kwargs):
+        """Validate the values and write them with a single UPDATE ... RETURNING""" # noqa
+        serializer = self.get_serializer(data=request.data, partial=kwargs.pop("partial", False)) # noqa
+        serializer.is_valid(raise_exception=True)
+
+        details = UserDetails.objects.update_for_user(request.user, **serializer.validated_data) # noqa
+        if details is None:
+            return self.not_found()
+        return Response(self.get_serializer(details).data)
+
+
+# Aggregates for the product dashboards, so they no longer run GROUP BY queries against production by hand # noqa
+class DemographicsView(generics.GenericAPIView):
+    """Return user counts and age distributions by country and city"""
+
+    authentication_classes = (
+        CachedTokenAuthentication,
+        SignedTokenAuthentication,
+    )
+    permission_classes = (permissions.IsAdminUser,)
+    throttle_scope = "user"
+    replica_actions = ("get",)  # Read from the replicas, see core/routers.py # noqa
+
+    @extend_schema(
+        parameters=[
+            OpenApiParameter(
+                name="recipes",
+                type=OpenApiTypes.INT,
+                enum=[0, 1],
+                description="1 to include the number of recipes of each group", # noqa
+            ),
+        ],
+        responses=OpenApiTypes.OBJECT,
+    )
+    def get(self, request):
+        include_recipes = request.query_params.get("recipes") == "1"
+        return Response(get_demographics(include_recipes))
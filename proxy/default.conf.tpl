@@ -5,6 +5,27 @@ server {
         alias /vol/static;
     }
 
+    # Uploaded media is private, it is only sent through /protected-media/ once the app authorized the request
+    location /static/media/ {
+        return 404;
+    }
+
+    # Internal location targeted by X-Accel-Redirect responses of the app, unreachable from outside
+    location /protected-media/ {
+        internal;
+        alias /vol/static/media/;
+        sendfile on;
+        tcp_nopush on;
+    }
+
+    # Batch image uploads, up to RECIPE_IMAGE_BATCH_MAX_FILES files of 10M streamed through to the app
+    location = /api/recipe/recipes/upload-images/ {
+        uwsgi_pass              ${APP_HOST}:${APP_PORT};
+        include                 /etc/nginx/uwsgi_params;
+        client_max_body_size    200M;
+        uwsgi_request_buffering off;
+    }
+
     location / {
         uwsgi_pass              ${APP_HOST}:${APP_PORT};
         include                 /etc/nginx/uwsgi_params;
@@ -8,4 +8,9 @@ python manage.py collectstatic --noinput
 
 python manage.py migrate
 
-uwsgi --socket :9000 --workers 4 --master --enable-threads --module app.wsgi # Run app on TCP port 9000
+# Shards configured with DB_SHARDS get the same schema (see app/core/routers.py)
+for database in $(python manage.py shell -c "from django.conf import settings; print(*settings.DATABASE_SHARDS)"); do
+    python manage.py migrate --database "$database"
+done
+
+uwsgi --socket :9000 --workers 4 --threads 4 --master --enable-threads --module app.wsgi # Run app on TCP port 9000, 4 request threads per worker